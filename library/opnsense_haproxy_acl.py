@@ -11,6 +11,7 @@ short_description: Manage HAProxy acls on Opnsense
 '''
 
 from ansible.module_utils.opnsense_utils import OpnsenseApi
+from ansible.module_utils.opnsense_utils import HaproxyDiff
 
 from ansible.module_utils.basic import AnsibleModule
 
@@ -28,6 +29,11 @@ def main():
             api_key=dict(type='str', required=True, no_log=True),
             api_secret=dict(type='str', required=True, no_log=True),
             api_ssl_verify=dict(type='bool', default=False),
+            api_timeline=dict(type='path'),
+            api_connect_timeout=dict(type='int', default=10),
+            api_read_timeout=dict(type='int', default=120),
+            api_retries=dict(type='int', default=3),
+            api_template_ttl=dict(type='int', default=60),
             acl_state=dict(type='str', choices=['present', 'absent'], default='present'),
             acl_name=dict(type='str', required=True),
             acl_description=dict(type='str', default=''),
@@ -136,7 +142,11 @@ def main():
     api_url = module.params['api_url']
     api_auth = (module.params['api_key'], module.params['api_secret'])
     api_ssl_verify = module.params['api_ssl_verify']
-    apiconnection = OpnsenseApi.Haproxy(api_url, api_auth, api_ssl_verify)
+    apiconnection = OpnsenseApi.Haproxy(api_url, api_auth, api_ssl_verify,
+                                        connect_timeout=module.params['api_connect_timeout'],
+                                        read_timeout=module.params['api_read_timeout'],
+                                        retries=module.params['api_retries'],
+                                        template_ttl=module.params['api_template_ttl'])
 
     # Prepare properties of acl
     haproxy_reload = module.params['haproxy_reload']
@@ -198,36 +208,19 @@ def main():
     acl_allowed_groups = module.params['acl_allowed_groups']
 
     # Get empty ACL object to lookup UUIDs for allowedUsers, allowedGroups, nbsrv_backend, queryBackend
-    empty_acl = apiconnection.getObjectByUuid('acl', '')
-    #acl_nbsrv_backend = apiconnection.getUuidByName('backend', module.params['acl_nbsrv_backend'])
-    acl_nbsrv_backend_uuid = ''
-    if acl_nbsrv_backend != '':
-        for key,value in empty_acl['nbsrv_backend'].iteritems():
-            if value['value'] == acl_nbsrv_backend:
-                acl_nbsrv_backend_uuid = key
-    #acl_query_backend = apiconnection.getUuidByName('backend', module.params['acl_query_backend'])
-    acl_query_backend_uuid = ''
-    if acl_query_backend != '':
-        for key,value in empty_acl['queryBackend'].iteritems():
-            if value['value'] == acl_query_backend:
-                acl_query_backend_uuid = key
-    # Resolve UUIDs for users
-    acl_allowed_users_uuids = []
-    for acl_allowed_user in acl_allowed_users:
-        #acl_allowed_users_uuids.append(apiconnection.getUuidByName('user', acl_allowed_user))
-        for key,value in empty_acl['allowedUsers'].iteritems():
-            if value['value'] == acl_allowed_user:
-                acl_allowed_users_uuids.append(key)
-    # Resolve UUIDs for allowedGroups
-    acl_allowed_groups_uuids = []
-    for acl_allowed_group in acl_allowed_groups:
-        #acl_allowed_groups_uuids.append(apiconnection.getUuidByName('group', acl_allowed_group))
-        for key,value in empty_acl['allowedGroups'].iteritems():
-            if value['value'] == acl_allowed_group:
-                acl_allowed_groups_uuids.append(key)
-
-    # Fetch list of acls
-    acls = apiconnection.listObjects('acl')
+    acl_options = apiconnection.getTemplateIndex('acl')
+    try:
+        acl_nbsrv_backend_uuid = ''
+        if acl_nbsrv_backend != '':
+            acl_nbsrv_backend_uuid = acl_options.options('nbsrv_backend').key(acl_nbsrv_backend)
+        acl_query_backend_uuid = ''
+        if acl_query_backend != '':
+            acl_query_backend_uuid = acl_options.options('queryBackend').key(acl_query_backend)
+        # Resolve UUIDs for allowedUsers and allowedGroups
+        acl_allowed_users_uuids = acl_options.options('allowedUsers').keys(acl_allowed_users)
+        acl_allowed_groups_uuids = acl_options.options('allowedGroups').keys(acl_allowed_groups)
+    except KeyError as e:
+        module.fail_json(msg=e.args[0])
 
     # Build dict with desired state
     desired_properties = {
@@ -237,7 +230,7 @@ def main():
         'hdr_beg': acl_hdr_beg,
         'hdr_end': acl_hdr_end,
         'hdr': acl_hdr,
-        'hdr_reg': acl_hdr_beg,
+        'hdr_reg': acl_hdr_reg,
         'hdr_sub': acl_hdr_sub,
         'path_beg': acl_path_beg,
         'path_end': acl_path_end,
@@ -282,80 +275,33 @@ def main():
         'ssl_sni_reg': acl_ssl_sni_reg,
         'custom_acl': acl_custom_acl,
         'value': acl_value,
-        'queryBackend': acl_query_backend,
+        'queryBackend': acl_query_backend_uuid,
         'allowedUsers': ','.join(acl_allowed_users_uuids),
         'allowedGroups': ','.join(acl_allowed_groups_uuids)
     }
-    # Prepare dict with properties needing change
-    changed_properties = {}
     # Prepare result dict
     result = {}
     additional_msg = []
     # Initialize some control vars
     needs_change = False
-    uuid = ''
     # Check if acl object with specified name exists
-    for acl in acls:
-        if acl['name'] == acl_name:
-            uuid = acl['uuid']
-            break
+    uuid = apiconnection.findUuidByName('acl', acl_name)
     acl_exists = (uuid != '')
     if acl_state == 'present':
         if acl_exists:
             acl = apiconnection.getObjectByName('acl', acl_name)
-            for prop in desired_properties.keys():
-                # Special cases for complex propertierts:
-                if prop == 'expression':
-                    current_expression = apiconnection.getSelected(acl[prop])
-                    if current_expression != acl_expression:
-                        needs_change = True
-                        changed_properties[prop] = desired_properties[prop]
-                        additional_msg.append('Changing %s: %s => %s' %(prop, current_expression, desired_properties[prop]))
-                # Catch all _comparison properties
-                elif '_comparison' in prop:
-                    current_comparison = apiconnection.getSelected(acl[prop])
-                    if current_comparison != desired_properties[prop]:
-                        needs_change = True
-                        changed_properties[prop] = desired_properties[prop]
-                        additional_msg.append('Changing %s: %s => %s' %(prop, current_comparison, desired_properties[prop]))
-                elif prop == 'nbsrv_backend':
-                    current_nbsrv_backend = apiconnection.getSelected(acl[prop])
-                    if current_nbsrv_backend != acl_nbsrv_backend:
-                        needs_change = True
-                        changed_properties[prop] = desired_properties[prop]
-                        additional_msg.append('Changing %s: %s => %s' %(prop, current_nbsrv_backend, desired_properties[prop]))
-                elif prop == 'queryBackend':
-                    current_query_backend = apiconnection.getSelected(acl[prop])
-                    if current_query_backend != acl_query_backend:
-                        needs_change = True
-                        changed_properties[prop] = desired_properties[prop]
-                        additional_msg.append('Changing %s: %s => %s' %(prop, current_query_backend, desired_properties[prop]))
-                elif prop == 'allowedUsers':
-                    current_allowed_users = apiconnection.getSelectedList(acl[prop])
-                    if not apiconnection.compareLists(current_allowed_users, acl_allowed_users_uuids):
-                        needs_change = True
-                        changed_properties[prop] = desired_properties[prop]
-                        additional_msg.append('Changing %s: %s => %s' %(prop, current_allowed_users, desired_properties[prop]))
-                elif prop == 'allowedGroups':
-                    current_allowed_groups = apiconnection.getSelectedList(acl[prop])
-                    if not apiconnection.compareLists(current_allowed_groups, acl_allowed_groups_uuids):
-                        needs_change = True
-                        changed_properties[prop] = desired_properties[prop]
-                        additional_msg.append('Changing %s: %s => %s' %(prop, current_allowed_groups, desired_properties[prop]))
-                else:
-                    # catch all other properties
-                    if acl[prop] != desired_properties[prop]:
-                        needs_change = True
-                        changed_properties[prop] = desired_properties[prop]
-                        additional_msg.append('Changing %s: %s => %s' %(prop, acl[prop], desired_properties[prop]))
-
+            changed_properties, changes = HaproxyDiff.diffObject('acl', acl, desired_properties)
+            needs_change = bool(changed_properties)
+            additional_msg.extend(HaproxyDiff.formatChanges(changes))
             if not needs_change:
                 result = {'changed': False, 'msg': ['Acl already present: %s' %acl_name, additional_msg]}
             else:
+                # Changes of only cosmetic fields (e.g. descriptions) don't need a reload
+                reload = HaproxyDiff.reloadImpact('acl', changes)
                 if not module.check_mode:
-                    additional_msg.append(apiconnection.updateObject('acl', acl_name, changed_properties))
-                    if haproxy_reload: additional_msg.append(apiconnection.applyConfig())
-                result = {'changed': True, 'msg': ['Acl %s must be changed.' %acl_name, additional_msg]}
+                    additional_msg.append(apiconnection.updateObject('acl', acl_name, changed_properties, reload=reload['required']))
+                    if haproxy_reload and reload['required']: additional_msg.append(apiconnection.applyConfig())
+                result = {'changed': True, 'msg': ['Acl %s must be changed.' %acl_name, additional_msg], 'changes': changes, 'reload': reload}
         else:
             if not module.check_mode:
                 additional_msg.append(apiconnection.createObject('acl', acl_name, desired_properties))
@@ -370,6 +316,10 @@ def main():
         else:
             result = {'changed': False, 'msg': ['Acl %s is not present.' %acl_name]}
 
+    # Report the API calls made by this run
+    result['api_stats'] = apiconnection.getApiStats()
+    if module.params['api_timeline']:
+        apiconnection.writeTimeline(module.params['api_timeline'])
     module.exit_json(**result)
 
 
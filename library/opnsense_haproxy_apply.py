@@ -0,0 +1,72 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2019, Markus Joosten https://github.com/mj84
+from __future__ import absolute_import, division, print_function
+
+DOCUMENTATION =r'''
+---
+module: opnsense_haproxy_apply
+short_description: Test and apply a pending HAProxy configuration on Opnsense
+description:
+  - Every change made by the opnsense_haproxy_* modules marks a reload as pending.
+  - This module runs configtest and reconfigure once, if a reload is pending (or when forced).
+'''
+
+from requests.exceptions import RequestException
+
+from ansible.module_utils.opnsense_utils import OpnsenseApi
+
+from ansible.module_utils.basic import AnsibleModule
+
+# There will only be a single AnsibleModule object per module
+module = None
+
+
+def main():
+
+    global module
+    # Instantiate module
+    module = AnsibleModule(
+        argument_spec=dict(
+            api_url=dict(type='str', required=True),
+            api_key=dict(type='str', required=True, no_log=True),
+            api_secret=dict(type='str', required=True, no_log=True),
+            api_ssl_verify=dict(type='bool', default=False),
+            api_timeline=dict(type='path'),
+            api_connect_timeout=dict(type='int', default=10),
+            api_read_timeout=dict(type='int', default=120),
+            api_retries=dict(type='int', default=3),
+            force=dict(type='bool', default=False),
+        ),
+        supports_check_mode=True,
+    )
+    force = module.params['force']
+
+    # Instantiate API connection
+    api_url = module.params['api_url']
+    api_auth = (module.params['api_key'], module.params['api_secret'])
+    api_ssl_verify = module.params['api_ssl_verify']
+    apiconnection = OpnsenseApi.Haproxy(api_url, api_auth, api_ssl_verify,
+                                        connect_timeout=module.params['api_connect_timeout'],
+                                        read_timeout=module.params['api_read_timeout'],
+                                        retries=module.params['api_retries'])
+
+    if not force and not apiconnection.isReloadPending():
+        module.exit_json(changed=False, msg=['No HAProxy reload pending.'])
+
+    additional_msg = []
+    if not module.check_mode:
+        try:
+            additional_msg.append(apiconnection.applyConfig())
+        # An unreachable firewall (or an open circuit breaker, OpnsenseApi.CircuitOpenError) fails the task instead of a traceback
+        except (ValueError, RequestException) as e:
+            module.fail_json(msg='Failed to apply the HAProxy configuration: %s' % e, api_stats=apiconnection.getApiStats())
+    # Report the API calls made by this run
+    if module.params['api_timeline']:
+        apiconnection.writeTimeline(module.params['api_timeline'])
+    module.exit_json(changed=True, msg=['HAProxy configuration must be applied.', additional_msg], api_stats=apiconnection.getApiStats())
+
+
+if __name__ == '__main__':
+    main()
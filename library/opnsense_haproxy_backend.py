@@ -11,6 +11,7 @@ short_description: Manage HAProxy backends on Opnsense
 '''
 
 from ansible.module_utils.opnsense_utils import OpnsenseApi
+from ansible.module_utils.opnsense_utils import HaproxyDiff
 
 from ansible.module_utils.basic import AnsibleModule
 
@@ -28,6 +29,11 @@ def main():
             api_key=dict(type='str', required=True, no_log=True),
             api_secret=dict(type='str', required=True, no_log=True),
             api_ssl_verify=dict(type='bool', default=False),
+            api_timeline=dict(type='path'),
+            api_connect_timeout=dict(type='int', default=10),
+            api_read_timeout=dict(type='int', default=120),
+            api_retries=dict(type='int', default=3),
+            api_template_ttl=dict(type='int', default=60),
             backend_state=dict(type='str', choices=['present', 'absent'], default='present'),
             backend_enabled=dict(type='bool', default=True),
             backend_name=dict(type='str', required=True),
@@ -147,10 +153,12 @@ def main():
     api_url = module.params['api_url']
     api_auth = (module.params['api_key'], module.params['api_secret'])
     api_ssl_verify = module.params['api_ssl_verify']
-    apiconnection = OpnsenseApi.Haproxy(api_url, api_auth, api_ssl_verify)
+    apiconnection = OpnsenseApi.Haproxy(api_url, api_auth, api_ssl_verify,
+                                        connect_timeout=module.params['api_connect_timeout'],
+                                        read_timeout=module.params['api_read_timeout'],
+                                        retries=module.params['api_retries'],
+                                        template_ttl=module.params['api_template_ttl'])
 
-    # Fetch list of backends
-    backends = apiconnection.listObjects('backend')
     # Get an empty backend object to lookup UUIDs for:
     # - linkedServers
     # - healthCheck
@@ -158,45 +166,18 @@ def main():
     # - basicAuthGroups
     # - linkedActions
     # - linkedErrorfiles
-    empty_backend = apiconnection.getObjectByUuid('backend', '')
-    # Need to get UUIDs for:
-    # linkedServers, healthCheck, basicAuthUsers, basicAuthGroups, linkedActions, linkedErrorfiles
-    backend_linked_servers_uuids = []
-    #backend_linked_servers_uuids = apiconnection.getUuidsFromNames('server', backend_linked_servers)
-    for backend_linked_server in backend_linked_servers:
-        for key,value in empty_backend['linkedServers'].iteritems():
-            if value['value'] == backend_linked_server:
-                backend_linked_servers_uuids.append(key)
-    backend_health_check_uuid = ''
-    if backend_health_check != '':
-        #backend_health_check_uuid = apiconnection.getUuidByName('healthcheck', backend_health_check)
-        for key,value in empty_backend['healthCheck'].iteritems():
-            if value['value'] == backend_health_check:
-                backend_health_check_uuid = key
-    #backend_basic_auth_users_uuids = apiconnection.getUuidsFromNames('user', backend_basic_auth_users)
-    backend_basic_auth_users_uuids = []
-    for backend_basic_auth_user in backend_basic_auth_users:
-        for key,value in empty_backend['basicAuthUsers'].iteritems():
-            if value['value'] == backend_basic_auth_user:
-                backend_basic_auth_users_uuids.append(key)
-    #backend_basic_auth_groups_uuids = apiconnection.getUuidsFromNames('group', backend_basic_auth_groups)
-    backend_basic_auth_groups_uuids = []
-    for backend_basic_auth_group in backend_basic_auth_groups:
-        for key,value in empty_backend['basicAuthGroups'].iteritems():
-            if value['value'] == backend_basic_auth_group:
-                backend_basic_auth_groups_uuids.append(key)
-    #backend_linked_actions_uuids = apiconnection.getUuidsFromNames('action', backend_linked_actions)
-    backend_linked_actions_uuids = []
-    for backend_linked_action in backend_linked_actions:
-        for key,value in empty_backend['linkedActions'].iteritems():
-            if value['value'] == backend_linked_action:
-                backend_linked_actions_uuids.append(key)
-    #backend_linked_errorfiles_uuids = apiconnection.getUuidsFromNames('errorfile', backend_linked_errorfiles)
-    backend_linked_errorfiles_uuids = []
-    for backend_linked_errorfile in backend_linked_errorfiles:
-        for key,value in empty_backend['linkedErrorfiles'].iteritems():
-            if value['value'] == backend_linked_errorfile:
-                backend_linked_errorfiles_uuids.append(key)
+    backend_options = apiconnection.getTemplateIndex('backend')
+    try:
+        backend_linked_servers_uuids = backend_options.options('linkedServers').keys(backend_linked_servers)
+        backend_health_check_uuid = ''
+        if backend_health_check != '':
+            backend_health_check_uuid = backend_options.options('healthCheck').key(backend_health_check)
+        backend_basic_auth_users_uuids = backend_options.options('basicAuthUsers').keys(backend_basic_auth_users)
+        backend_basic_auth_groups_uuids = backend_options.options('basicAuthGroups').keys(backend_basic_auth_groups)
+        backend_linked_actions_uuids = backend_options.options('linkedActions').keys(backend_linked_actions)
+        backend_linked_errorfiles_uuids = backend_options.options('linkedErrorfiles').keys(backend_linked_errorfiles)
+    except KeyError as e:
+        module.fail_json(msg=e.args[0])
     # Build dict with desired state
     desired_properties = {
         'enabled': backend_enabled,
@@ -243,133 +224,32 @@ def main():
         'linkedActions': ','.join(backend_linked_actions_uuids),
         'linkedErrorfiles': ','.join(backend_linked_errorfiles_uuids)
     }
-    # Prepare dict with properties needing change
-    changed_properties = {}
     # Prepare result dict
     result = {}
     additional_msg = []
     # Initialize some control vars
     needs_change = False
-    uuid = ''
     # Check if backend object with specified name exists
-    for backend in backends:
-        if backend['name'] == backend_name:
-            uuid = backend['uuid']
-            break
+    uuid = apiconnection.findUuidByName('backend', backend_name)
     backend_exists = (uuid != '')
     if backend_state == 'present':
         if backend_exists:
             backend = apiconnection.getObjectByName('backend', backend_name)
-            for prop in desired_properties.keys():
-                # Special cases for complex propertierts:
-                if prop == 'mode':
-                    current_mode = apiconnection.getSelected(backend[prop])
-                    if current_mode != desired_properties[prop]:
-                        needs_change = True
-                        changed_properties[prop] = desired_properties[prop]
-                        additional_msg.append('Changing %s: %s => %s' %(prop, current_mode, desired_properties[prop]))
-                elif prop == 'algorithm':
-                    current_algorithm = apiconnection.getSelected(backend[prop])
-                    if current_algorithm != backend_algorithm:
-                        needs_change = True
-                        changed_properties[prop] = desired_properties[prop]
-                        additional_msg.append('Changing %s: %s => %s' %(prop, current_algorithm, desired_properties[prop]))
-                elif prop == 'proxyProtocol':
-                    current_proxy_protocol = apiconnection.getSelected(backend[prop])
-                    if current_proxy_protocol != backend_proxy_protocol:
-                        needs_change = True
-                        changed_properties[prop] = desired_properties[prop]
-                        additional_msg.append('Changing %s: %s => %s' %(prop, current_proxy_protocol, desired_properties[prop]))
-                elif prop == 'linkedServers':
-                    current_linked_servers = apiconnection.getSelectedList(backend[prop], retval='key')
-                    if not apiconnection.compareLists(current_linked_servers, backend_linked_servers_uuids):
-                        needs_change = True
-                        changed_properties[prop] = desired_properties[prop]
-                        additional_msg.append('Changing %s: %s => %s' %(prop, current_linked_servers, desired_properties[prop]))
-                elif prop == 'healthCheck':
-                    current_health_check = apiconnection.getSelected(backend[prop], retval='value')
-                    if current_health_check != backend_health_check:
-                        if current_health_check == 'none' and backend_health_check == '':
-                            pass
-                        else:
-                            needs_change = True
-                            changed_properties[prop] = desired_properties[prop]
-                            additional_msg.append('Changing %s: %s => %s' %(prop, current_health_check, desired_properties[prop]))
-                elif prop == 'persistence':
-                    current_persistence = apiconnection.getSelected(backend[prop], retval='key')
-                    if current_persistence != backend_persistence:
-                        needs_change = True
-                        changed_properties[prop] = desired_properties[prop]
-                        additional_msg.append('Changing %s: %s => %s' %(prop, current_persistence, desired_properties[prop]))
-                elif prop == 'persistence_cookiemode':
-                    current_persistence_cookie_mode = apiconnection.getSelected(backend[prop], retval='key')
-                    if current_persistence_cookie_mode != backend_persistence_cookie_mode:
-                        needs_change = True
-                        changed_properties[prop] = desired_properties[prop]
-                        additional_msg.append('Changing %s: %s => %s' %(prop, current_persistence_cookie_mode, desired_properties[prop]))
-                elif prop == 'stickiness_pattern':
-                    current_stickiness_pattern = apiconnection.getSelected(backend[prop])
-                    if current_stickiness_pattern != desired_properties[prop]:
-                        needs_change = True
-                        changed_properties[prop] = desired_properties[prop]
-                        additional_msg.append('Changing %s: %s => %s' %(prop, current_stickiness_pattern, desired_properties[prop]))
-                elif prop == 'stickiness_dataTypes':
-                    current_stickiness_data_types = apiconnection.getSelected(backend[prop])
-                    if not apiconnection.compareLists(current_stickiness_data_types, backend_stickiness_data_types):
-                        needs_change = True
-                        changed_properties[prop] = desired_properties[prop]
-                        additional_msg.append('Changing %s: %s => %s' %(prop, current_stickiness_data_types, desired_properties[prop]))
-                elif prop == 'basicAuthUsers':
-                    # only care about basicAuthUsers when basic auth is enabled
-                    if backend_basic_auth_enabled:
-                        current_basic_auth_users = apiconnection.getSelectedList(backend[prop])
-                        if not apiconnection.compareLists(current_basic_auth_users, backend_basic_auth_users):
-                            needs_change = True
-                            changed_properties[prop] = desired_properties[prop]
-                            additional_msg.append('Changing %s: %s => %s' %(prop, current_basic_auth_users, desired_properties[prop]))
-                elif prop == 'basicAuthGroups':
-                    # only care about basicAuthGroups when basic auth is enabled
-                    if backend_basic_auth_enabled:
-                        current_basic_auth_groups = apiconnection.getSelectedList(backend[prop])
-                        if not apiconnection.compareLists(current_basic_auth_groups, backend_basic_auth_groups):
-                            needs_change = True
-                            changed_properties[prop] = desired_properties[prop]
-                            additional_msg.append('Changing %s: %s => %s' %(prop, current_basic_auth_groups, desired_properties[prop]))
-                elif prop == 'tuning_httpreuse':
-                    current_tuning_httpreuse = apiconnection.getSelected(backend[prop])
-                    if current_tuning_httpreuse != desired_properties[prop]:
-                        needs_change = True
-                        changed_properties[prop] = desired_properties[prop]
-                        additional_msg.append('Changing %s: %s => %s' %(prop, current_tuning_httpreuse, desired_properties[prop]))
-                elif prop == 'linkedActions':
-                    current_linked_actions = apiconnection.getSelectedList(backend[prop], retval='key')
-                    if not apiconnection.compareLists(current_linked_actions, backend_linked_actions_uuids, order_sensitive=True):
-                        needs_change = True
-                        changed_properties[prop] = desired_properties[prop]
-                        additional_msg.append('Changing %s: %s => %s' %(prop, current_linked_actions, desired_properties[prop]))
-                elif prop == 'linkedErrorfiles':
-                    current_linked_errorfiles = apiconnection.getSelectedList(backend[prop], retval='key')
-                    if not apiconnection.compareLists(current_linked_errorfiles, backend_linked_errorfiles_uuids):
-                        needs_change = True
-                        changed_properties[prop] = desired_properties[prop]
-                        additional_msg.append('Changing %s: %s => %s' %(prop, current_linked_errorfiles, desired_properties[prop]))
-                else:
-                    # catch all other properties
-                    if backend[prop] != desired_properties[prop]:
-                        needs_change = True
-                        changed_properties[prop] = desired_properties[prop]
-                        additional_msg.append('Changing %s: %s => %s' %(prop, backend[prop], desired_properties[prop]))
-
+            changed_properties, changes = HaproxyDiff.diffObject('backend', backend, desired_properties)
+            needs_change = bool(changed_properties)
+            additional_msg.extend(HaproxyDiff.formatChanges(changes))
             if not needs_change:
                 result = {'changed': False, 'msg': ['Backend already present: %s' %backend_name, additional_msg]}
             else:
+                # Changes of only cosmetic fields (e.g. descriptions) don't need a reload
+                reload = HaproxyDiff.reloadImpact('backend', changes)
                 if not module.check_mode:
                     # workaround for https://github.com/opnsense/plugins/issues/1494
                     # any change must include the linkedActions to maintain the correct order
                     changed_properties['linkedActions'] = desired_properties['linkedActions']
-                    additional_msg.append(apiconnection.updateObject('backend', backend_name, changed_properties))
-                    if haproxy_reload: additional_msg.append(apiconnection.applyConfig())
-                result = {'changed': True, 'msg': ['Backend %s must be changed.' %backend_name, additional_msg]}
+                    additional_msg.append(apiconnection.updateObject('backend', backend_name, changed_properties, reload=reload['required']))
+                    if haproxy_reload and reload['required']: additional_msg.append(apiconnection.applyConfig())
+                result = {'changed': True, 'msg': ['Backend %s must be changed.' %backend_name, additional_msg], 'changes': changes, 'reload': reload}
         else:
             if not module.check_mode:
                 additional_msg.append(apiconnection.createObject('backend', backend_name, desired_properties))
@@ -384,6 +264,10 @@ def main():
         else:
             result = {'changed': False, 'msg': ['Backend %s is not present.' %backend_name]}
 
+    # Report the API calls made by this run
+    result['api_stats'] = apiconnection.getApiStats()
+    if module.params['api_timeline']:
+        apiconnection.writeTimeline(module.params['api_timeline'])
     module.exit_json(**result)
 
 
@@ -0,0 +1,97 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2019, Markus Joosten https://github.com/mj84
+from __future__ import absolute_import, division, print_function
+
+DOCUMENTATION =r'''
+---
+module: opnsense_haproxy_bulk
+short_description: Manage all HAProxy objects of one type on Opnsense in a single run
+description:
+  - Takes the whole dict of objects of one type, shaped like the opnsense_haproxy_* role variables.
+  - Current objects are listed once, the necessary creates, updates and deletes are computed in memory.
+  - With snapshot (default), the whole HAProxy model is read with a single settings/get request.
+'''
+
+from ansible.module_utils.opnsense_utils import OpnsenseApi
+from ansible.module_utils.opnsense_utils import HaproxyReconcile
+from ansible.module_utils.opnsense_utils import HaproxyValidate
+
+from ansible.module_utils.basic import AnsibleModule
+
+# There will only be a single AnsibleModule object per module
+module = None
+
+
+def main():
+
+    global module
+    # Instantiate module
+    module = AnsibleModule(
+        argument_spec=dict(
+            api_url=dict(type='str', required=True),
+            api_key=dict(type='str', required=True, no_log=True),
+            api_secret=dict(type='str', required=True, no_log=True),
+            api_ssl_verify=dict(type='bool', default=False),
+            api_timeline=dict(type='path'),
+            api_connect_timeout=dict(type='int', default=10),
+            api_read_timeout=dict(type='int', default=120),
+            api_retries=dict(type='int', default=3),
+            api_snapshot_cache=dict(type='bool', default=False),
+            api_template_ttl=dict(type='int', default=60),
+            objecttype=dict(type='str', required=True, choices=['acl', 'action', 'backend', 'cpu', 'errorfile', 'frontend', 'group', 'healthcheck', 'lua', 'mapfile', 'server', 'user']),
+            items=dict(type='dict', default={}),
+            purge=dict(type='bool', default=False),
+            snapshot=dict(type='bool', default=True),
+            haproxy_reload=dict(type='bool', default=False),
+        ),
+        supports_check_mode=True,
+    )
+    haproxy_reload = module.params['haproxy_reload']
+    objecttype = module.params['objecttype']
+    items = module.params['items']
+    purge = module.params['purge']
+
+    # Instantiate API connection
+    api_url = module.params['api_url']
+    api_auth = (module.params['api_key'], module.params['api_secret'])
+    api_ssl_verify = module.params['api_ssl_verify']
+    apiconnection = OpnsenseApi.Haproxy(api_url, api_auth, api_ssl_verify,
+                                        connect_timeout=module.params['api_connect_timeout'],
+                                        read_timeout=module.params['api_read_timeout'],
+                                        retries=module.params['api_retries'],
+                                        template_ttl=module.params['api_template_ttl'],
+                                        snapshot_cache=module.params['api_snapshot_cache'])
+    # Read the whole model with one request instead of listing and fetching every object
+    if module.params['snapshot']:
+        apiconnection.loadSnapshot()
+    # Check all references before the first write
+    problems = HaproxyValidate.validate(apiconnection, {objecttype: items}, purge=purge)
+    if problems:
+        module.fail_json(msg='%d problems found, nothing was changed: %s' %(len(problems), '; '.join(problem['msg'] for problem in problems)),
+                         problems=problems, api_stats=apiconnection.getApiStats())
+
+    reconciler = HaproxyReconcile.Reconciler(apiconnection, check_mode=module.check_mode)
+    results = reconciler.reconcile(objecttype, items, purge=purge)
+    changed = HaproxyReconcile.isChanged(results)
+    # Changes of only cosmetic fields (e.g. descriptions) don't need a reload
+    reload_required = HaproxyReconcile.needsReload(results)
+
+    additional_msg = []
+    if reload_required and haproxy_reload and not module.check_mode:
+        additional_msg.append(apiconnection.applyConfig())
+
+    # Report the API calls made by this run
+    api_stats = apiconnection.getApiStats()
+    if module.params['api_timeline']:
+        apiconnection.writeTimeline(module.params['api_timeline'])
+
+    failed = HaproxyReconcile.failedItems(results)
+    if failed:
+        module.fail_json(msg='Failed to manage %s objects: %s' %(objecttype, ', '.join(failed)), changed=changed, results=results, api_stats=api_stats)
+    module.exit_json(changed=changed, msg=additional_msg, results=results, reload_required=reload_required, api_stats=api_stats)
+
+
+if __name__ == '__main__':
+    main()
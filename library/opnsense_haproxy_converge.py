@@ -0,0 +1,102 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2019, Markus Joosten https://github.com/mj84
+from __future__ import absolute_import, division, print_function
+
+DOCUMENTATION =r'''
+---
+module: opnsense_haproxy_converge
+short_description: Manage all HAProxy objects on Opnsense in dependency order
+description:
+  - Takes the objects of every type, keyed by objecttype and shaped like the opnsense_haproxy_* role variables.
+  - The order is derived from the references between the objects, objects of independent types are converged concurrently.
+  - Deletions (state absent, purge) run last, referencing objects before the objects they reference.
+'''
+
+from ansible.module_utils.opnsense_utils import OpnsenseApi
+from ansible.module_utils.opnsense_utils import HaproxyReconcile
+from ansible.module_utils.opnsense_utils import HaproxySchedule
+from ansible.module_utils.opnsense_utils import HaproxyValidate
+
+from ansible.module_utils.basic import AnsibleModule
+
+# There will only be a single AnsibleModule object per module
+module = None
+
+
+def main():
+
+    global module
+    # Instantiate module
+    module = AnsibleModule(
+        argument_spec=dict(
+            api_url=dict(type='str', required=True),
+            api_key=dict(type='str', required=True, no_log=True),
+            api_secret=dict(type='str', required=True, no_log=True),
+            api_ssl_verify=dict(type='bool', default=False),
+            api_timeline=dict(type='path'),
+            api_connect_timeout=dict(type='int', default=10),
+            api_read_timeout=dict(type='int', default=120),
+            api_retries=dict(type='int', default=3),
+            api_snapshot_cache=dict(type='bool', default=False),
+            api_template_ttl=dict(type='int', default=60),
+            objects=dict(type='dict', default={}),
+            purge=dict(type='bool', default=False),
+            max_workers=dict(type='int', default=4),
+            haproxy_reload=dict(type='bool', default=False),
+        ),
+        supports_check_mode=True,
+    )
+    haproxy_reload = module.params['haproxy_reload']
+    # Types without objects are not managed, so purge leaves them alone
+    objects = dict((objecttype, items) for objecttype, items in module.params['objects'].items() if items)
+
+    # Instantiate API connection
+    api_url = module.params['api_url']
+    api_auth = (module.params['api_key'], module.params['api_secret'])
+    api_ssl_verify = module.params['api_ssl_verify']
+    apiconnection = OpnsenseApi.Haproxy(api_url, api_auth, api_ssl_verify,
+                                        connect_timeout=module.params['api_connect_timeout'],
+                                        read_timeout=module.params['api_read_timeout'],
+                                        retries=module.params['api_retries'],
+                                        template_ttl=module.params['api_template_ttl'],
+                                        snapshot_cache=module.params['api_snapshot_cache'])
+    # All types are read with a single request
+    apiconnection.loadSnapshot()
+    # Check all references before the first write
+    problems = HaproxyValidate.validate(apiconnection, objects, purge=module.params['purge'])
+    if problems:
+        module.fail_json(msg='%d problems found, nothing was changed: %s' %(len(problems), '; '.join(problem['msg'] for problem in problems)),
+                         problems=problems, api_stats=apiconnection.getApiStats())
+
+    scheduler = HaproxySchedule.Scheduler(apiconnection, check_mode=module.check_mode, max_workers=module.params['max_workers'])
+    try:
+        results, schedule = scheduler.converge(objects, purge=module.params['purge'])
+    except (KeyError, ValueError) as e:
+        module.fail_json(msg=str(e), api_stats=apiconnection.getApiStats())
+    changed = False
+    reload_required = False
+    failed = []
+    for objecttype, typeresults in results.items():
+        changed = changed or HaproxyReconcile.isChanged(typeresults)
+        # Changes of only cosmetic fields (e.g. descriptions) don't need a reload
+        reload_required = reload_required or HaproxyReconcile.needsReload(typeresults)
+        failed.extend('%s %s' %(objecttype, name) for name in HaproxyReconcile.failedItems(typeresults))
+
+    additional_msg = []
+    if reload_required and haproxy_reload and not module.check_mode and not failed:
+        additional_msg.append(apiconnection.applyConfig())
+
+    # Report the API calls made by this run
+    api_stats = apiconnection.getApiStats()
+    if module.params['api_timeline']:
+        apiconnection.writeTimeline(module.params['api_timeline'])
+
+    if failed:
+        module.fail_json(msg='Failed to manage objects: %s' % ', '.join(failed), changed=changed, results=results, schedule=schedule, api_stats=api_stats)
+    module.exit_json(changed=changed, msg=additional_msg, results=results, schedule=schedule, reload_required=reload_required, api_stats=api_stats)
+
+
+if __name__ == '__main__':
+    main()
@@ -11,6 +11,7 @@ short_description: Manage HAProxy cpus on Opnsense
 '''
 
 from ansible.module_utils.opnsense_utils import OpnsenseApi
+from ansible.module_utils.opnsense_utils import HaproxyDiff
 
 from ansible.module_utils.basic import AnsibleModule
 
@@ -28,6 +29,11 @@ def main():
             api_key=dict(type='str', required=True, no_log=True),
             api_secret=dict(type='str', required=True, no_log=True),
             api_ssl_verify=dict(type='bool', default=False),
+            api_timeline=dict(type='path'),
+            api_connect_timeout=dict(type='int', default=10),
+            api_read_timeout=dict(type='int', default=120),
+            api_retries=dict(type='int', default=3),
+            api_template_ttl=dict(type='int', default=60),
             cpu_state=dict(type='str', choices=['present', 'absent'], default='present'),
             cpu_enabled=dict(type='bool', default=True),
             cpu_name=dict(type='str', required=True),
@@ -87,10 +93,11 @@ def main():
     api_url = module.params['api_url']
     api_auth = (module.params['api_key'], module.params['api_secret'])
     api_ssl_verify = module.params['api_ssl_verify']
-    apiconnection = OpnsenseApi.Haproxy(api_url, api_auth, api_ssl_verify)
-
-    # Fetch list of cpus
-    cpus = apiconnection.listObjects('cpu')
+    apiconnection = OpnsenseApi.Haproxy(api_url, api_auth, api_ssl_verify,
+                                        connect_timeout=module.params['api_connect_timeout'],
+                                        read_timeout=module.params['api_read_timeout'],
+                                        retries=module.params['api_retries'],
+                                        template_ttl=module.params['api_template_ttl'])
 
     # Build dict with desired state
     desired_properties = {
@@ -99,57 +106,29 @@ def main():
         'thread_id': cpu_thread_id,
         'cpu_id': ','.join(cpu_cpu_id)
     }
-    # Prepare dict with properties needing change
-    changed_properties = {}
     # Prepare result dict
     result = {}
     additional_msg = []
     # Initialize some control vars
     needs_change = False
-    uuid = ''
     # Check if cpu object with specified name exists
-    for cpu in cpus:
-        if cpu['name'] == cpu_name:
-            uuid = cpu['uuid']
-            break
+    uuid = apiconnection.findUuidByName('cpu', cpu_name)
     cpu_exists = (uuid != '')
     if cpu_state == 'present':
         if cpu_exists:
             cpu = apiconnection.getObjectByName('cpu', cpu_name)
-            for prop in desired_properties.keys():
-                # Special cases for complex propertierts:
-                if prop == 'process_id':
-                    current_process_id = apiconnection.getSelected(cpu[prop])
-                    if current_process_id != cpu_process_id:
-                        needs_change = True
-                        changed_properties[prop] = desired_properties[prop]
-                        additional_msg.append('Changing %s: %s => %s' %(prop, current_process_id, desired_properties[prop]))
-                elif prop == 'thread_id':
-                    current_thread_id = apiconnection.getSelected(cpu[prop])
-                    if current_thread_id != cpu_thread_id:
-                        needs_change = True
-                        changed_properties[prop] = desired_properties[prop]
-                        additional_msg.append('Changing %s: %s => %s' %(prop, current_thread_id, desired_properties[prop]))
-                elif prop == 'cpu_id':
-                    current_cpu_id = apiconnection.getSelectedList(cpu[prop], retval='key')
-                    if not apiconnection.compareLists(current_cpu_id, cpu_cpu_id):
-                        needs_change = True
-                        changed_properties[prop] = desired_properties[prop]
-                        additional_msg.append('Changing %s: %s => %s' %(prop, current_cpu_id, desired_properties[prop]))
-                else:
-                    # catch all other properties
-                    if cpu[prop] != desired_properties[prop]:
-                        needs_change = True
-                        changed_properties[prop] = desired_properties[prop]
-                        additional_msg.append('Changing %s: %s => %s' %(prop, cpu[prop], desired_properties[prop]))
-
+            changed_properties, changes = HaproxyDiff.diffObject('cpu', cpu, desired_properties)
+            needs_change = bool(changed_properties)
+            additional_msg.extend(HaproxyDiff.formatChanges(changes))
             if not needs_change:
                 result = {'changed': False, 'msg': ['Cpu already present: %s' %cpu_name, additional_msg]}
             else:
+                # Changes of only cosmetic fields (e.g. descriptions) don't need a reload
+                reload = HaproxyDiff.reloadImpact('cpu', changes)
                 if not module.check_mode:
-                    additional_msg.append(apiconnection.updateObject('cpu', cpu_name, changed_properties))
-                    if haproxy_reload: additional_msg.append(apiconnection.applyConfig())
-                result = {'changed': True, 'msg': ['Cpu %s must be changed.' %cpu_name, additional_msg]}
+                    additional_msg.append(apiconnection.updateObject('cpu', cpu_name, changed_properties, reload=reload['required']))
+                    if haproxy_reload and reload['required']: additional_msg.append(apiconnection.applyConfig())
+                result = {'changed': True, 'msg': ['Cpu %s must be changed.' %cpu_name, additional_msg], 'changes': changes, 'reload': reload}
         else:
             if not module.check_mode:
                 additional_msg.append(apiconnection.createObject('cpu', cpu_name, desired_properties))
@@ -164,6 +143,10 @@ def main():
         else:
             result = {'changed': False, 'msg': ['Cpu %s is not present.' %cpu_name]}
 
+    # Report the API calls made by this run
+    result['api_stats'] = apiconnection.getApiStats()
+    if module.params['api_timeline']:
+        apiconnection.writeTimeline(module.params['api_timeline'])
     module.exit_json(**result)
 
 
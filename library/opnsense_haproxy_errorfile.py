@@ -11,6 +11,7 @@ short_description: Manage HAProxy errorfiles on Opnsense
 '''
 
 from ansible.module_utils.opnsense_utils import OpnsenseApi
+from ansible.module_utils.opnsense_utils import HaproxyDiff
 
 from ansible.module_utils.basic import AnsibleModule
 
@@ -28,6 +29,11 @@ def main():
             api_key=dict(type='str', required=True, no_log=True),
             api_secret=dict(type='str', required=True, no_log=True),
             api_ssl_verify=dict(type='bool', default=False),
+            api_timeline=dict(type='path'),
+            api_connect_timeout=dict(type='int', default=10),
+            api_read_timeout=dict(type='int', default=120),
+            api_retries=dict(type='int', default=3),
+            api_template_ttl=dict(type='int', default=60),
             errorfile_name=dict(type='str', required=True),
             errorfile_code=dict(type='str', required=True),
             errorfile_description=dict(type='str', default=''),
@@ -48,51 +54,40 @@ def main():
     api_url = module.params['api_url']
     auth = (module.params['api_key'], module.params['api_secret'])
     api_ssl_verify = module.params['api_ssl_verify']
-    apiconnection = OpnsenseApi.Haproxy(api_url, auth, api_ssl_verify)
-
-    # Fetch list of errorfiles
-    errorfiles = apiconnection.listObjects('errorfile')
+    apiconnection = OpnsenseApi.Haproxy(api_url, auth, api_ssl_verify,
+                                        connect_timeout=module.params['api_connect_timeout'],
+                                        read_timeout=module.params['api_read_timeout'],
+                                        retries=module.params['api_retries'],
+                                        template_ttl=module.params['api_template_ttl'])
 
     # Build dict with desired state
     desired_properties = {'code': errorfile_code, 'description': errorfile_description, 'content': errorfile_content}
-    # Prepare dict with properties needing change
-    changed_properties = {}
     # Prepare result dict
     result = {}
     additional_msg = []
     # Initialize some control vars
     needs_change = False
-    uuid = ''
     # Check if errorfile object with specified name exists
-    for errorfile in errorfiles:
-        if errorfile['name'] == errorfile_name:
-            errorfile_exists = True
-            uuid = errorfile['uuid']
-            additional_msg.append(uuid)
-            break
+    uuid = apiconnection.findUuidByName('errorfile', errorfile_name)
+    if uuid != '':
+        additional_msg.append(uuid)
     errorfile_exists = (uuid != '')
 
     if errorfile_state == 'present':
         if errorfile_exists:
             errorfile = apiconnection.getObjectByName('errorfile', errorfile_name)
-            for prop in desired_properties.keys():
-                # Special case for code
-                if prop == 'code':
-                    current_code = apiconnection.getSelected(errorfile[prop])
-                    if current_code != desired_properties[prop]:
-                        changed_properties[prop] = desired_properties[prop]
-                else:
-                    if errorfile[prop] != desired_properties[prop]:
-                        needs_change = True
-                        changed_properties[prop] = desired_properties[prop]
-                        additional_msg.append('Changing %s: %s => %s' %(prop, errorfile[prop], desired_properties[prop]))
+            changed_properties, changes = HaproxyDiff.diffObject('errorfile', errorfile, desired_properties)
+            needs_change = bool(changed_properties)
+            additional_msg.extend(HaproxyDiff.formatChanges(changes))
             if not needs_change:
                 result = {'changed': False, 'msg': ['Errorfile already present: %s' %errorfile_name]}
             else:
+                # Changes of only cosmetic fields (e.g. descriptions) don't need a reload
+                reload = HaproxyDiff.reloadImpact('errorfile', changes)
                 if not module.check_mode:
-                    additional_msg.append(apiconnection.updateObject('errorfile', errorfile_name, changed_properties))
-                    if haproxy_reload: additional_msg.append(apiconnection.applyConfig())
-                result = {'changed': True, 'msg': ['Errorfile %s must be changed.' %errorfile_name, additional_msg]}
+                    additional_msg.append(apiconnection.updateObject('errorfile', errorfile_name, changed_properties, reload=reload['required']))
+                    if haproxy_reload and reload['required']: additional_msg.append(apiconnection.applyConfig())
+                result = {'changed': True, 'msg': ['Errorfile %s must be changed.' %errorfile_name, additional_msg], 'changes': changes, 'reload': reload}
         else:
             if not module.check_mode:
                 additional_msg.append(apiconnection.createObject('errorfile', errorfile_name, desired_properties))
@@ -107,6 +102,10 @@ def main():
         else:
             result = {'changed': False, 'msg': ['Errorfile %s is not present.' %errorfile_name]}
 
+    # Report the API calls made by this run
+    result['api_stats'] = apiconnection.getApiStats()
+    if module.params['api_timeline']:
+        apiconnection.writeTimeline(module.params['api_timeline'])
     module.exit_json(**result)
 
 
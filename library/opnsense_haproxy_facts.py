@@ -0,0 +1,77 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2019, Markus Joosten https://github.com/mj84
+from __future__ import absolute_import, division, print_function
+
+DOCUMENTATION =r'''
+---
+module: opnsense_haproxy_facts
+short_description: Read the HAProxy configuration on Opnsense in the shape of the role variables
+description:
+  - Reads all objects of the given types (default all) and returns them keyed by role variable
+    (opnsense_haproxy_acls, opnsense_haproxy_backends, ...), with references resolved to names.
+  - The result can be used as role variables again. Values equal to the role defaults are left out unless include_defaults is set,
+    secret values (user passwords) unless include_secrets is set.
+  - With snapshot (default), the whole model is read with a single request.
+'''
+
+from ansible.module_utils.opnsense_utils import OpnsenseApi
+from ansible.module_utils.opnsense_utils import HaproxyFacts
+
+from ansible.module_utils.basic import AnsibleModule
+
+# There will only be a single AnsibleModule object per module
+module = None
+
+
+def main():
+
+    global module
+    objecttypes = ['acl', 'action', 'backend', 'cpu', 'errorfile', 'frontend', 'group', 'healthcheck', 'lua', 'mapfile', 'server', 'user']
+    # Instantiate module
+    module = AnsibleModule(
+        argument_spec=dict(
+            api_url=dict(type='str', required=True),
+            api_key=dict(type='str', required=True, no_log=True),
+            api_secret=dict(type='str', required=True, no_log=True),
+            api_ssl_verify=dict(type='bool', default=False),
+            api_timeline=dict(type='path'),
+            api_connect_timeout=dict(type='int', default=10),
+            api_read_timeout=dict(type='int', default=120),
+            api_retries=dict(type='int', default=3),
+            api_snapshot_cache=dict(type='bool', default=False),
+            objecttypes=dict(type='list', default=objecttypes, choices=objecttypes),
+            include_defaults=dict(type='bool', default=False),
+            include_secrets=dict(type='bool', default=False),
+            snapshot=dict(type='bool', default=True),
+        ),
+        supports_check_mode=True,
+    )
+
+    # Instantiate API connection
+    api_url = module.params['api_url']
+    api_auth = (module.params['api_key'], module.params['api_secret'])
+    api_ssl_verify = module.params['api_ssl_verify']
+    apiconnection = OpnsenseApi.Haproxy(api_url, api_auth, api_ssl_verify,
+                                        connect_timeout=module.params['api_connect_timeout'],
+                                        read_timeout=module.params['api_read_timeout'],
+                                        retries=module.params['api_retries'],
+                                        snapshot_cache=module.params['api_snapshot_cache'])
+
+    haproxy = HaproxyFacts.export(apiconnection, module.params['objecttypes'],
+                                  include_secrets=module.params['include_secrets'],
+                                  include_defaults=module.params['include_defaults'],
+                                  snapshot=module.params['snapshot'])
+
+    # Report the API calls made by this run
+    api_stats = apiconnection.getApiStats()
+    if module.params['api_timeline']:
+        apiconnection.writeTimeline(module.params['api_timeline'])
+    # Returned below opnsense_haproxy_facts, as facts named like the role variables would take precedence over them
+    module.exit_json(changed=False, ansible_facts={'opnsense_haproxy_facts': haproxy},
+                     msg=['%d %s' %(len(items), variable) for variable, items in haproxy.items()], api_stats=api_stats)
+
+
+if __name__ == '__main__':
+    main()
@@ -11,6 +11,7 @@ short_description: Manage HAProxy frontends on Opnsense
 '''
 
 from ansible.module_utils.opnsense_utils import OpnsenseApi
+from ansible.module_utils.opnsense_utils import HaproxyDiff
 
 from ansible.module_utils.basic import AnsibleModule
 
@@ -28,6 +29,11 @@ def main():
             api_key=dict(type='str', required=True, no_log=True),
             api_secret=dict(type='str', required=True, no_log=True),
             api_ssl_verify=dict(type='bool', default=False),
+            api_timeline=dict(type='path'),
+            api_connect_timeout=dict(type='int', default=10),
+            api_read_timeout=dict(type='int', default=120),
+            api_retries=dict(type='int', default=3),
+            api_template_ttl=dict(type='int', default=60),
             frontend_state=dict(type='str', choices=['present', 'absent'], default='present'),
             frontend_enabled=dict(type='bool', default=True),
             frontend_name=dict(type='str', required=True),
@@ -190,10 +196,11 @@ def main():
     api_url = module.params['api_url']
     api_auth = (module.params['api_key'], module.params['api_secret'])
     api_ssl_verify = module.params['api_ssl_verify']
-    apiconnection = OpnsenseApi.Haproxy(api_url, api_auth, api_ssl_verify)
-
-    # Fetch list of frontends
-    frontends = apiconnection.listObjects('frontend')
+    apiconnection = OpnsenseApi.Haproxy(api_url, api_auth, api_ssl_verify,
+                                        connect_timeout=module.params['api_connect_timeout'],
+                                        read_timeout=module.params['api_read_timeout'],
+                                        retries=module.params['api_retries'],
+                                        template_ttl=module.params['api_template_ttl'])
 
     # Get an empty default object:
     # - to determine API version (not yet implemented)
@@ -205,52 +212,25 @@ def main():
     #   - linkedCpuAffinityRules
     #   - linkedActions
     #   - linkedErrorfiles
-    empty_frontend = apiconnection.getObjectByUuid('frontend', '')
-    # Need to get UUIDs for:
-    # defaultBackend, basicAuthUsers, basicAuthGroups, linkedCpuAffinityRules, linkedActions, linkedErrorfiles
-    frontend_default_backend_uuid = ''
-    if frontend_default_backend != 'none':
-        #frontend_default_backend_uuid = apiconnection.getUuidByName('backend', frontend_default_backend)
-        for key,value in empty_frontend['defaultBackend'].iteritems():
-            if value['value'] == frontend_default_backend:
-                frontend_default_backend_uuid = key
-    #frontend_basic_auth_users_uuids = apiconnection.getUuidsFromNames('user', frontend_basic_auth_users)
-    frontend_basic_auth_users_uuids = []
-    for frontend_basic_auth_user in frontend_basic_auth_users:
-        for key,value in empty_frontend['basicAuthUsers'].iteritems():
-            if value['value'] == frontend_basic_auth_user:
-                frontend_basic_auth_users_uuids.append(key)
-    #frontend_basic_auth_groups_uuids = apiconnection.getUuidsFromNames('group', frontend_basic_auth_groups)
-    frontend_basic_auth_groups_uuids = []
-    for frontend_basic_auth_group in frontend_basic_auth_groups:
-        for key,value in empty_frontend['basicAuthGroups'].iteritems():
-            if value['value'] == frontend_basic_auth_group:
-                frontend_basic_auth_groups_uuids.append(key)
-    #frontend_linked_cpu_affinity_rules_uuids = apiconnection.getUuidsFromNames('cpu', frontend_linked_cpu_affinity_rules)
-    frontend_linked_cpu_affinity_rules_uuids = []
-    for frontend_linked_cpu_affinity_rule in frontend_linked_cpu_affinity_rules:
-        for key,value in empty_frontend['linkedCpuAffinityRules'].iteritems():
-            if value['value'] == frontend_linked_cpu_affinity_rule:
-                frontend_linked_cpu_affinity_rules_uuids.append(key)
-    #frontend_linked_actions_uuids = apiconnection.getUuidsFromNames('action', frontend_linked_actions)
-    frontend_linked_actions_uuids = []
-    for frontend_linked_action in frontend_linked_actions:
-        for key,value in empty_frontend['linkedActions'].iteritems():
-            if value['value'] == frontend_linked_action:
-                frontend_linked_actions_uuids.append(key)
-    #frontend_linked_errorfiles_uuids = apiconnection.getUuidsFromNames('errorfile', frontend_linked_errorfiles)
-    frontend_linked_errorfiles_uuids = []
-    for frontend_linked_errorfile in frontend_linked_errorfiles:
-        for key,value in empty_frontend['linkedErrorfiles'].iteritems():
-            if value['value'] == frontend_linked_errorfile:
-                frontend_linked_errorfiles_uuids.append(key)
-    frontend_ssl_certificates_uuids = apiconnection.getSslObjectKeys(empty_frontend['ssl_certificates'], frontend_ssl_certificates)
-    # Only fetch default SSL cert uuid when one is set, otherwise supply an empty string
-    frontend_ssl_default_certificate_uuid = ''
-    if frontend_ssl_default_certificate != '':
-        frontend_ssl_default_certificate_uuid = apiconnection.getSslObjectKeys(empty_frontend['ssl_default_certificate'], [frontend_ssl_default_certificate])[0]
-    frontend_ssl_client_auth_cas_uuids = apiconnection.getSslObjectKeys(empty_frontend['ssl_clientAuthCAs'], frontend_ssl_client_auth_cas)
-    frontend_ssl_client_auth_crls_uuids = apiconnection.getSslObjectKeys(empty_frontend['ssl_clientAuthCRLs'], frontend_ssl_client_auth_crls)
+    frontend_options = apiconnection.getTemplateIndex('frontend')
+    try:
+        frontend_default_backend_uuid = ''
+        if frontend_default_backend != 'none':
+            frontend_default_backend_uuid = frontend_options.options('defaultBackend').key(frontend_default_backend)
+        frontend_basic_auth_users_uuids = frontend_options.options('basicAuthUsers').keys(frontend_basic_auth_users)
+        frontend_basic_auth_groups_uuids = frontend_options.options('basicAuthGroups').keys(frontend_basic_auth_groups)
+        frontend_linked_cpu_affinity_rules_uuids = frontend_options.options('linkedCpuAffinityRules').keys(frontend_linked_cpu_affinity_rules)
+        frontend_linked_actions_uuids = frontend_options.options('linkedActions').keys(frontend_linked_actions)
+        frontend_linked_errorfiles_uuids = frontend_options.options('linkedErrorfiles').keys(frontend_linked_errorfiles)
+        frontend_ssl_certificates_uuids = frontend_options.options('ssl_certificates').keys(frontend_ssl_certificates)
+        # Only fetch default SSL cert uuid when one is set, otherwise supply an empty string
+        frontend_ssl_default_certificate_uuid = ''
+        if frontend_ssl_default_certificate != '':
+            frontend_ssl_default_certificate_uuid = frontend_options.options('ssl_default_certificate').key(frontend_ssl_default_certificate)
+        frontend_ssl_client_auth_cas_uuids = frontend_options.options('ssl_clientAuthCAs').keys(frontend_ssl_client_auth_cas)
+        frontend_ssl_client_auth_crls_uuids = frontend_options.options('ssl_clientAuthCRLs').keys(frontend_ssl_client_auth_crls)
+    except KeyError as e:
+        module.fail_json(msg=e.args[0])
     # Build dict with desired state
     desired_properties = {
         'enabled': frontend_enabled,
@@ -307,206 +287,32 @@ def main():
         'linkedActions': ','.join(frontend_linked_actions_uuids),
         'linkedErrorfiles': ','.join(frontend_linked_errorfiles_uuids)
     }
-    # Prepare dict with properties needing change
-    changed_properties = {}
     # Prepare result dict
     result = {}
     additional_msg = []
     # Initialize some control vars
     needs_change = False
-    uuid = ''
     # Check if frontend object with specified name exists
-    for frontend in frontends:
-        if frontend['name'] == frontend_name:
-            uuid = frontend['uuid']
-            break
+    uuid = apiconnection.findUuidByName('frontend', frontend_name)
     frontend_exists = (uuid != '')
     if frontend_state == 'present':
         if frontend_exists:
             frontend = apiconnection.getObjectByName('frontend', frontend_name)
-            for prop in desired_properties.keys():
-                # Special cases for complex propertierts:
-                if prop == 'bind':
-                    current_binds = apiconnection.getSelectedList(frontend[prop])
-                    if not apiconnection.compareLists(frontend_bind, frontend[prop]):
-                        needs_change = True
-                        changed_properties[prop] = desired_properties[prop]
-                        additional_msg.append('Property %s must be changed' % prop)
-                elif prop == 'mode':
-                    current_mode = apiconnection.getSelected(frontend[prop])
-                    if current_mode != desired_properties[prop]:
-                        needs_change = True
-                        changed_properties[prop] = desired_properties[prop]
-                        additional_msg.append('Property %s must be changed' % prop)
-                elif prop == 'defaultBackend':
-                    current_default_backend = apiconnection.getSelected(frontend[prop],retval='value')
-                    if current_default_backend != frontend_default_backend:
-                        # Check if current default backend is an empty string and we don't want to have one:
-                        if current_default_backend == '' and frontend_default_backend == 'none':
-                            pass
-                        else:
-                            needs_change = True
-                            changed_properties[prop] = desired_properties[prop]
-                            additional_msg.append('Changing %s: %s => %s' %(prop, current_default_backend, desired_properties[prop]))
-                elif prop == 'ssl_certificates' and frontend_ssl_enabled:
-                    current_ssl_certificates = apiconnection.getSelectedList(frontend[prop], retval='key')
-                    if not apiconnection.compareLists(current_ssl_certificates, frontend_ssl_certificates_uuids):
-                        needs_change = True
-                        changed_properties[prop] = desired_properties[prop]
-                        additional_msg.append('Property %s must be changed' % prop)
-                elif prop == 'ssl_default_certificate' and frontend_ssl_enabled:
-                    current_ssl_default_certificate = apiconnection.getSelected(frontend[prop])
-                    if current_ssl_default_certificate != desired_properties[prop]:
-                        # Check if current default certificate is an empty string and we don't want to have one:
-                        #if current_ssl_default_certificate == '' and frontend_ssl_default_certificate == 'none':
-                        #    pass
-                        #else:
-                        needs_change = True
-                        changed_properties[prop] = desired_properties[prop]
-                        additional_msg.append('Changing %s: %s => %s' %(prop, current_ssl_default_certificate, desired_properties[prop]))
-                elif prop == 'ssl_bindOptions' and frontend_ssl_enabled:
-                    current_ssl_bind_options = apiconnection.getSelectedList(frontend[prop])
-                    if not apiconnection.compareLists(current_ssl_bind_options, frontend_ssl_bind_options):
-                        needs_change = True
-                        changed_properties[prop] = desired_properties[prop]
-                        additional_msg.append('Changing %s: %s => %s' %(prop, current_ssl_bind_options, desired_properties[prop]))
-                # only care about ssl_clientAuthVerify when SSL client auth is enabled
-                elif prop == 'ssl_clientAuthVerify' and frontend_ssl_enabled:
-                    if not frontend_ssl_client_auth_enabled:
-                        pass
-                    else:
-                        current_ssl_client_auth_verify = apiconnection.getSelected(frontend[prop])
-                        if current_ssl_client_auth_verify != desired_properties[prop]:
-                            needs_change = True
-                            changed_properties[prop] = desired_properties[prop]
-                            additional_msg.append('Changing %s: %s => %s' %(prop, current_ssl_client_auth_verify, desired_properties[prop]))
-                # only care about ssl_clientAuthVerify when SSL client auth is enabled
-                elif prop == 'ssl_clientAuthCAs' and frontend_ssl_enabled:
-                    if not frontend_ssl_client_auth_enabled:
-                        pass
-                    else:
-                        current_ssl_client_auth_cas = apiconnection.getSelectedList(frontend[prop])
-                        if not apiconnection.compareLists(current_ssl_client_auth_cas, frontend_ssl_client_auth_cas_uuids):
-                            needs_change = True
-                            changed_properties[prop] = desired_properties[prop]
-                            additional_msg.append('Changing %s: %s => %s' %(prop, current_ssl_client_auth_cas, desired_properties[prop]))
-                # only care about ssl_clientAuthVerify when SSL client auth is enabled
-                elif prop == 'ssl_clientAuthCRLs' and frontend_ssl_enabled:
-                    if not frontend_ssl_client_auth_enabled:
-                        pass
-                    else:
-                        current_ssl_client_auth_crls = apiconnection.getSelectedList(frontend[prop])
-                        if not apiconnection.compareLists(current_ssl_client_auth_crls, frontend_ssl_client_auth_crls_uuids):
-                            needs_change = True
-                            changed_properties[prop] = desired_properties[prop]
-                            additional_msg.append('Changing %s: %s => %s' %(prop, current_ssl_client_auth_crls, desired_properties[prop]))
-                elif prop == 'basicAuthUsers':
-                    # only care about basicAuthUsers when basic auth is enabled
-                    if frontend_basic_auth_enabled:
-                        current_basic_auth_users = apiconnection.getSelectedList(frontend[prop])
-                        if not apiconnection.compareLists(current_basic_auth_users, frontend_basic_auth_users):
-                            needs_change = True
-                            changed_properties[prop] = desired_properties[prop]
-                            additional_msg.append('Changing %s: %s => %s' %(prop, current_basic_auth_users, desired_properties[prop]))
-                elif prop == 'basicAuthGroups':
-                    # only care about basicAuthGroups when basic auth is enabled
-                    if frontend_basic_auth_enabled:
-                        current_basic_auth_groups = apiconnection.getSelectedList(frontend[prop])
-                        if not apiconnection.compareLists(current_basic_auth_groups, frontend_basic_auth_groups):
-                            needs_change = True
-                            changed_properties[prop] = desired_properties[prop]
-                            additional_msg.append('Changing %s: %s => %s' %(prop, current_basic_auth_groups, desired_properties[prop]))
-                elif prop == 'stickiness_pattern':
-                    current_stickiness_pattern = apiconnection.getSelected(frontend[prop])
-                    if current_stickiness_pattern != desired_properties[prop]:
-                        needs_change = True
-                        changed_properties[prop] = desired_properties[prop]
-                        additional_msg.append('Changing %s: %s => %s' %(prop, current_stickiness_pattern, desired_properties[prop]))
-                elif prop == 'stickiness_dataTypes':
-                    current_stickiness_data_types = apiconnection.getSelected(frontend[prop])
-                    if not apiconnection.compareLists(current_stickiness_data_types, frontend_stickiness_data_types):
-                        needs_change = True
-                        changed_properties[prop] = desired_properties[prop]
-                        additional_msg.append('Changing %s: %s => %s' %(prop, current_stickiness_data_types, desired_properties[prop]))
-                    pass
-                elif prop == 'connectionBehaviour':
-                    current_connection_behaviour = apiconnection.getSelected(frontend[prop])
-                    if current_connection_behaviour != desired_properties[prop]:
-                        needs_change = True
-                        changed_properties[prop] = desired_properties[prop]
-                        additional_msg.append('Changing %s: %s => %s' %(prop, current_connection_behaviour, desired_properties[prop]))
-                elif prop == 'linkedCpuAffinityRules':
-                    current_linked_cpu_affinity_rules = apiconnection.getSelectedList(frontend[prop], retval='key')
-                    if not apiconnection.compareLists(current_linked_cpu_affinity_rules, frontend_linked_cpu_affinity_rules):
-                        needs_change = True
-                        changed_properties[prop] = desired_properties[prop]
-                        additional_msg.append('Changing %s: %s => %s' %(prop, current_linked_cpu_affinity_rules, desired_properties[prop]))
-                elif prop == 'linkedActions':
-                    current_linked_actions = apiconnection.getSelectedList(frontend[prop], retval='key')
-                    if not apiconnection.compareLists(current_linked_actions, frontend_linked_actions_uuids, order_sensitive=True):
-                        needs_change = True
-                        changed_properties[prop] = desired_properties[prop]
-                        additional_msg.append('Changing %s: %s => %s' %(prop, current_linked_actions, desired_properties[prop]))
-                elif prop == 'linkedErrorfiles':
-                    current_linked_errorfiles = apiconnection.getSelectedList(frontend[prop], retval='key')
-                    if not apiconnection.compareLists(current_linked_errorfiles, frontend_linked_errorfiles_uuids):
-                        needs_change = True
-                        changed_properties[prop] = desired_properties[prop]
-                        additional_msg.append('Changing %s: %s => %s' %(prop, current_linked_errorfiles, desired_properties[prop]))
-                else:
-                    # only care about SSL properties when it should be enabled
-                    if 'ssl' in prop and not frontend_ssl_enabled:
-                        # SSL enabled must still be evaluated
-                        if prop == 'ssl_enabled' and frontend[prop] != desired_properties[prop]:
-                            needs_change = True
-                            changed_properties[prop] = desired_properties[prop]
-                            additional_msg.append('Changing %s: %s => %s' %(prop, frontend[prop], desired_properties[prop]))
-                        else:
-                            pass
-                    elif 'ssl' in prop and frontend_ssl_enabled:
-                        # Some properties are only stored when enabling advanced SSL options
-                        if not frontend_ssl_advanced_enabled and prop == 'ssl_bindOptions':
-                            pass
-                        elif not frontend_ssl_advanced_enabled and prop == 'ssl_cipherList':
-                            pass
-                        elif not frontend_ssl_advanced_enabled and prop == 'ssl_http2Enabled':
-                            pass
-                        elif not frontend_ssl_advanced_enabled and prop == 'ssl_hstsEnabled':
-                            pass
-                        elif not frontend_ssl_advanced_enabled and prop == 'ssl_hstsIncludeSubdomains':
-                            pass
-                        elif not frontend_ssl_advanced_enabled and prop == 'ssl_hstsPreload':
-                            pass
-                        elif not frontend_ssl_advanced_enabled and prop == 'ssl_hstsMaxAge':
-                            pass
-                        else:
-                            if prop not in frontend:
-                                # prop might not be present in current state
-                                needs_change = True
-                                changed_properties[prop] = desired_properties[prop]
-                                additional_msg.append('Changing %s: %s => %s' %(prop, '', desired_properties[prop]))
-                            else:
-                                if frontend[prop] != desired_properties[prop]:
-                                    needs_change = True
-                                    changed_properties[prop] = desired_properties[prop]
-                                    additional_msg.append('Changing %s: %s => %s' %(prop, frontend[prop], desired_properties[prop]))
-                    # catch all other properties
-                    else:
-                        if frontend[prop] != desired_properties[prop]:
-                            needs_change = True
-                            changed_properties[prop] = desired_properties[prop]
-                            additional_msg.append('Changing %s: %s => %s' %(prop, frontend[prop], desired_properties[prop]))
-
+            changed_properties, changes = HaproxyDiff.diffObject('frontend', frontend, desired_properties)
+            needs_change = bool(changed_properties)
+            additional_msg.extend(HaproxyDiff.formatChanges(changes))
             if not needs_change:
                 result = {'changed': False, 'msg': ['Frontend already present: %s' %frontend_name, additional_msg]}
             else:
+                # Changes of only cosmetic fields (e.g. descriptions) don't need a reload
+                reload = HaproxyDiff.reloadImpact('frontend', changes)
                 if not module.check_mode:
                     # workaround for https://github.com/opnsense/plugins/issues/1494
                     # any change must include the linkedActions to maintain the correct order
                     changed_properties['linkedActions'] = desired_properties['linkedActions']
-                    additional_msg.append(apiconnection.updateObject('frontend', frontend_name, changed_properties))
-                    if haproxy_reload: additional_msg.append(apiconnection.applyConfig())
-                result = {'changed': True, 'msg': ['Frontend %s must be changed.' %frontend_name, additional_msg]}
+                    additional_msg.append(apiconnection.updateObject('frontend', frontend_name, changed_properties, reload=reload['required']))
+                    if haproxy_reload and reload['required']: additional_msg.append(apiconnection.applyConfig())
+                result = {'changed': True, 'msg': ['Frontend %s must be changed.' %frontend_name, additional_msg], 'changes': changes, 'reload': reload}
         else:
             if not module.check_mode:
                 additional_msg.append(apiconnection.createObject('frontend', frontend_name, desired_properties))
@@ -521,6 +327,10 @@ def main():
         else:
             result = {'changed': False, 'msg': ['Frontend %s is not present.' %frontend_name]}
 
+    # Report the API calls made by this run
+    result['api_stats'] = apiconnection.getApiStats()
+    if module.params['api_timeline']:
+        apiconnection.writeTimeline(module.params['api_timeline'])
     module.exit_json(**result)
 
 
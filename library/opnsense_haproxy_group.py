@@ -11,6 +11,7 @@ short_description: Manage HAProxy groups on Opnsense
 '''
 
 from ansible.module_utils.opnsense_utils import OpnsenseApi
+from ansible.module_utils.opnsense_utils import HaproxyDiff
 
 from ansible.module_utils.basic import AnsibleModule
 
@@ -28,6 +29,11 @@ def main():
             api_key=dict(type='str', required=True, no_log=True),
             api_secret=dict(type='str', required=True, no_log=True),
             api_ssl_verify=dict(type='bool', default=False),
+            api_timeline=dict(type='path'),
+            api_connect_timeout=dict(type='int', default=10),
+            api_read_timeout=dict(type='int', default=120),
+            api_retries=dict(type='int', default=3),
+            api_template_ttl=dict(type='int', default=60),
             group_name=dict(type='str', required=True),
             group_enabled=dict(type='bool', default=True),
             group_description=dict(type='str', default=''),
@@ -48,18 +54,18 @@ def main():
     api_url = module.params['api_url']
     api_auth = (module.params['api_key'], module.params['api_secret'])
     api_ssl_verify = module.params['api_ssl_verify']
-    apiconnection = OpnsenseApi.Haproxy(api_url, api_auth, api_ssl_verify)
-
-    # Fetch list of groups
-    groups = apiconnection.listObjects('group')
+    apiconnection = OpnsenseApi.Haproxy(api_url, api_auth, api_ssl_verify,
+                                        connect_timeout=module.params['api_connect_timeout'],
+                                        read_timeout=module.params['api_read_timeout'],
+                                        retries=module.params['api_retries'],
+                                        template_ttl=module.params['api_template_ttl'])
 
     # Get an empty group object to lookup UUIDs for group members
-    empty_group = apiconnection.getObjectByUuid('group', '')
-    group_members_uuids = []
-    for group_member in group_members:
-        for key,value in empty_group['members']:
-            if value['value'] == group_member:
-                group_members_uuids.append(key)
+    group_options = apiconnection.getTemplateIndex('group')
+    try:
+        group_members_uuids = group_options.options('members').keys(group_members)
+    except KeyError as e:
+        module.fail_json(msg=e.args[0])
 
     # Build dict with desired state
     desired_properties = {
@@ -67,43 +73,29 @@ def main():
         'description': group_description,
         'members': ','.join(group_members_uuids)
     }
-    # Prepare dict with properties needing change
-    changed_properties = {}
     # Prepare result dict
     result = {}
     additional_msg = []
     # Initialize some control vars
     needs_change = False
-    uuid = ''
     # Check if group object with specified name exists
-    for group in groups:
-        if group['name'] == group_name:
-            uuid = group['uuid']
-            break
+    uuid = apiconnection.findUuidByName('group', group_name)
     group_exists = (uuid != '')
     if group_state == 'present':
         if group_exists:
             group = apiconnection.getObjectByName('group', group_name)
-            for prop in desired_properties.keys():
-                # Special case for members where two lists have to be compared
-                if prop == 'members':
-                    current_members_keys = apiconnection.getSelectedList(group[prop])
-                    if not apiconnection.compareLists(current_members_keys, group_members):
-                        needs_change = True
-                        changed_properties[prop] = desired_properties[prop]
-                        additional_msg.append('Changing members: %s => %s' %(current_members_keys, desired_properties[prop]))
-                else:
-                    if group[prop] != desired_properties[prop]:
-                        needs_change = True
-                        changed_properties[prop] = desired_properties[prop]
-                        additional_msg.append('Changing %s: %s => %s' %(prop, group[prop], desired_properties[prop]))
+            changed_properties, changes = HaproxyDiff.diffObject('group', group, desired_properties)
+            needs_change = bool(changed_properties)
+            additional_msg.extend(HaproxyDiff.formatChanges(changes))
             if not needs_change:
                 result = {'changed': False, 'msg': ['Group already present: %s' %group_name]}
             else:
+                # Changes of only cosmetic fields (e.g. descriptions) don't need a reload
+                reload = HaproxyDiff.reloadImpact('group', changes)
                 if not module.check_mode:
-                    additional_msg.append(apiconnection.updateObject('group', group_name, changed_properties))
-                    if haproxy_reload: additional_msg.append(apiconnection.applyConfig())
-                result = {'changed': True, 'msg': ['Group %s must be changed.' %group_name, additional_msg]}
+                    additional_msg.append(apiconnection.updateObject('group', group_name, changed_properties, reload=reload['required']))
+                    if haproxy_reload and reload['required']: additional_msg.append(apiconnection.applyConfig())
+                result = {'changed': True, 'msg': ['Group %s must be changed.' %group_name, additional_msg], 'changes': changes, 'reload': reload}
         else:
             if not module.check_mode:
                 additional_msg.append(apiconnection.createObject('group', group_name, desired_properties))
@@ -118,6 +110,10 @@ def main():
         else:
             result = {'changed': False, 'msg': ['Group %s is not present.' %group_name]}
 
+    # Report the API calls made by this run
+    result['api_stats'] = apiconnection.getApiStats()
+    if module.params['api_timeline']:
+        apiconnection.writeTimeline(module.params['api_timeline'])
     module.exit_json(**result)
 
 
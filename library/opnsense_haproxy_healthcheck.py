@@ -11,6 +11,7 @@ short_description: Manage HAProxy healthchecks on Opnsense
 '''
 
 from ansible.module_utils.opnsense_utils import OpnsenseApi
+from ansible.module_utils.opnsense_utils import HaproxyDiff
 
 from ansible.module_utils.basic import AnsibleModule
 
@@ -28,6 +29,11 @@ def main():
             api_key=dict(type='str', required=True, no_log=True),
             api_secret=dict(type='str', required=True, no_log=True),
             api_ssl_verify=dict(type='bool', default=False),
+            api_timeline=dict(type='path'),
+            api_connect_timeout=dict(type='int', default=10),
+            api_read_timeout=dict(type='int', default=120),
+            api_retries=dict(type='int', default=3),
+            api_template_ttl=dict(type='int', default=60),
             healthcheck_state=dict(type='str', choices=['present', 'absent'], default='present'),
             healthcheck_name=dict(type='str', required=True),
             healthcheck_type=dict(type='str', choices=['tcp', 'http', 'agent', 'ldap', 'mysql', 'pgsql', 'redis', 'smtp', 'esmtp', 'ssl'], default='http'),
@@ -93,10 +99,11 @@ def main():
     api_url = module.params['api_url']
     api_auth = (module.params['api_key'], module.params['api_secret'])
     api_ssl_verify = module.params['api_ssl_verify']
-    apiconnection = OpnsenseApi.Haproxy(api_url, api_auth, api_ssl_verify)
-
-    # Fetch list of healthchecks
-    healthchecks = apiconnection.listObjects('healthcheck')
+    apiconnection = OpnsenseApi.Haproxy(api_url, api_auth, api_ssl_verify,
+                                        connect_timeout=module.params['api_connect_timeout'],
+                                        read_timeout=module.params['api_read_timeout'],
+                                        retries=module.params['api_retries'],
+                                        template_ttl=module.params['api_template_ttl'])
 
     # Build dict with desired state
     desired_properties = {
@@ -118,78 +125,35 @@ def main():
         'tcp_matchType': healthcheck_tcp_match_type,
         'tcp_negate': str(int(healthcheck_tcp_negate)),
         'tcp_matchValue': healthcheck_tcp_match_value,
-        'agent_port': healthcheck_agent_port,
-        'mysql_user': healthcheck_mysql_user,
-        'mysql_post41': str(int(healthcheck_mysql_post41)),
-        'pgsql_user': healthcheck_pgsql_user,
-        'smtp_domain': healthcheck_smtp_domain,
-        'esmtp_domain': healthcheck_esmtp_domain,
         'agentPort': healthcheck_agent_port,
-        'smtpDomain': healthcheck_smtp_domain
+        # OPNsense has one user for the mysql and pgsql checks and one domain for the smtp and esmtp checks
+        'dbUser': healthcheck_db_user or healthcheck_mysql_user or healthcheck_pgsql_user,
+        'mysql_post41': str(int(healthcheck_mysql_post41)),
+        'smtpDomain': healthcheck_smtp_domain or healthcheck_esmtp_domain,
     }
-    # Prepare dict with properties needing change
-    changed_properties = {}
     # Prepare result dict
     result = {}
     additional_msg = []
     # Initialize some control vars
     needs_change = False
-    uuid = ''
     # Check if healthcheck object with specified name exists
-    for healthcheck in healthchecks:
-        if healthcheck['name'] == healthcheck_name:
-            uuid = healthcheck['uuid']
-            break
+    uuid = apiconnection.findUuidByName('healthcheck', healthcheck_name)
     healthcheck_exists = (uuid != '')
     if healthcheck_state == 'present':
         if healthcheck_exists:
             healthcheck = apiconnection.getObjectByName('healthcheck', healthcheck_name)
-            for prop in desired_properties.keys():
-                # Special cases for complex propertierts:
-                if prop == 'type':
-                    current_type = apiconnection.getSelected(healthcheck[prop])
-                    if current_type != healthcheck_type:
-                        needs_change = True
-                        changed_properties[prop] = desired_properties[prop]
-                        additional_msg.append('Changing %s: %s => %s' %(prop, current_type, desired_properties[prop]))
-                elif prop == 'http_method':
-                    current_http_method = apiconnection.getSelected(healthcheck[prop])
-                    if current_http_method != healthcheck_http_method:
-                        needs_change = True
-                        changed_properties[prop] = desired_properties[prop]
-                        additional_msg.append('Changing %s: %s => %s' %(prop, current_http_method, desired_properties[prop]))
-                elif prop == 'http_version':
-                    current_http_version = apiconnection.getSelected(healthcheck[prop])
-                    if current_http_version != healthcheck_http_version:
-                        needs_change = True
-                        changed_properties[prop] = desired_properties[prop]
-                        additional_msg.append('Changing %s: %s => %s' %(prop, current_http_version, desired_properties[prop]))
-                elif prop == 'http_expression':
-                    current_http_expression = apiconnection.getSelected(healthcheck[prop])
-                    if current_http_expression != healthcheck_http_expression:
-                        needs_change = True
-                        changed_properties[prop] = desired_properties[prop]
-                        additional_msg.append('Changing %s: %s => %s' %(prop, current_http_expression, desired_properties[prop]))
-                elif prop == 'tcp_matchType':
-                    current_tcp_match_type = apiconnection.getSelected(healthcheck[prop])
-                    if current_tcp_match_type != healthcheck_tcp_match_type:
-                        needs_change = True
-                        changed_properties[prop] = desired_properties[prop]
-                        additional_msg.append('Changing %s: %s => %s' %(prop, current_tcp_match_type, desired_properties[prop]))
-                else:
-                    # catch all other properties
-                    if healthcheck[prop] != desired_properties[prop]:
-                        needs_change = True
-                        changed_properties[prop] = desired_properties[prop]
-                        additional_msg.append('Changing %s: %s => %s' %(prop, healthcheck[prop], desired_properties[prop]))
-
+            changed_properties, changes = HaproxyDiff.diffObject('healthcheck', healthcheck, desired_properties)
+            needs_change = bool(changed_properties)
+            additional_msg.extend(HaproxyDiff.formatChanges(changes))
             if not needs_change:
                 result = {'changed': False, 'msg': ['Healthcheck already present: %s' %healthcheck_name, additional_msg]}
             else:
+                # Changes of only cosmetic fields (e.g. descriptions) don't need a reload
+                reload = HaproxyDiff.reloadImpact('healthcheck', changes)
                 if not module.check_mode:
-                    additional_msg.append(apiconnection.updateObject('healthcheck', healthcheck_name, changed_properties))
-                    if haproxy_reload: additional_msg.append(apiconnection.applyConfig())
-                result = {'changed': True, 'msg': ['Healthcheck %s must be changed.' %healthcheck_name, additional_msg]}
+                    additional_msg.append(apiconnection.updateObject('healthcheck', healthcheck_name, changed_properties, reload=reload['required']))
+                    if haproxy_reload and reload['required']: additional_msg.append(apiconnection.applyConfig())
+                result = {'changed': True, 'msg': ['Healthcheck %s must be changed.' %healthcheck_name, additional_msg], 'changes': changes, 'reload': reload}
         else:
             if not module.check_mode:
                 additional_msg.append(apiconnection.createObject('healthcheck', healthcheck_name, desired_properties))
@@ -204,6 +168,10 @@ def main():
         else:
             result = {'changed': False, 'msg': ['Healthcheck %s is not present.' %healthcheck_name]}
 
+    # Report the API calls made by this run
+    result['api_stats'] = apiconnection.getApiStats()
+    if module.params['api_timeline']:
+        apiconnection.writeTimeline(module.params['api_timeline'])
     module.exit_json(**result)
 
 
@@ -11,6 +11,7 @@ short_description: Manage HAProxy luas on Opnsense
 '''
 
 from ansible.module_utils.opnsense_utils import OpnsenseApi
+from ansible.module_utils.opnsense_utils import HaproxyDiff
 
 from ansible.module_utils.basic import AnsibleModule
 
@@ -28,6 +29,11 @@ def main():
             api_key=dict(type='str', required=True, no_log=True),
             api_secret=dict(type='str', required=True, no_log=True),
             api_ssl_verify=dict(type='bool', default=False),
+            api_timeline=dict(type='path'),
+            api_connect_timeout=dict(type='int', default=10),
+            api_read_timeout=dict(type='int', default=120),
+            api_retries=dict(type='int', default=3),
+            api_template_ttl=dict(type='int', default=60),
             lua_name=dict(type='str', required=True),
             lua_enabled=dict(type='bool', default=True),
             lua_description=dict(type='str', default=''),
@@ -48,42 +54,38 @@ def main():
     api_url = module.params['api_url']
     api_auth = (module.params['api_key'], module.params['api_secret'])
     api_ssl_verify = module.params['api_ssl_verify']
-    apiconnection = OpnsenseApi.Haproxy(api_url, api_auth, api_ssl_verify)
-
-    # Fetch list of luas
-    luas = apiconnection.listObjects('lua')
+    apiconnection = OpnsenseApi.Haproxy(api_url, api_auth, api_ssl_verify,
+                                        connect_timeout=module.params['api_connect_timeout'],
+                                        read_timeout=module.params['api_read_timeout'],
+                                        retries=module.params['api_retries'],
+                                        template_ttl=module.params['api_template_ttl'])
 
     # Build dict with desired state
     desired_properties = {'enabled': lua_enabled, 'description': lua_description, 'content': lua_content}
-    # Prepare dict with properties needing change
-    changed_properties = {}
     # Prepare result dict
     result = {}
     additional_msg = []
     # Initialize some control vars
     needs_change = False
-    uuid = ''
     # Check if lua object with specified name exists
-    for lua in luas:
-        if lua['name'] == lua_name:
-            uuid = lua['uuid']
-            break
+    uuid = apiconnection.findUuidByName('lua', lua_name)
     lua_exists = (uuid != '')
 
     if lua_state == 'present':
         if lua_exists:
             lua = apiconnection.getObjectByName('lua', lua_name)
-            for prop in desired_properties.keys():
-                if lua[prop] != desired_properties[prop]:
-                    needs_change = True
-                    changed_properties[prop] = desired_properties[prop]
+            changed_properties, changes = HaproxyDiff.diffObject('lua', lua, desired_properties)
+            needs_change = bool(changed_properties)
+            additional_msg.extend(HaproxyDiff.formatChanges(changes))
             if not needs_change:
                 result = {'changed': False, 'msg': ['Lua already present: %s' %lua_name]}
             else:
+                # Changes of only cosmetic fields (e.g. descriptions) don't need a reload
+                reload = HaproxyDiff.reloadImpact('lua', changes)
                 if not module.check_mode:
-                    additional_msg.append(apiconnection.updateObject('lua', lua_name, changed_properties))
-                    if haproxy_reload: additional_msg.append(apiconnection.applyConfig())
-                result = {'changed': True, 'msg': ['Lua %s must be changed.' %lua_name, additional_msg]}
+                    additional_msg.append(apiconnection.updateObject('lua', lua_name, changed_properties, reload=reload['required']))
+                    if haproxy_reload and reload['required']: additional_msg.append(apiconnection.applyConfig())
+                result = {'changed': True, 'msg': ['Lua %s must be changed.' %lua_name, additional_msg], 'changes': changes, 'reload': reload}
         else:
             if not module.check_mode:
                 additional_msg.append(apiconnection.createObject('lua', lua_name, desired_properties))
@@ -98,6 +100,10 @@ def main():
         else:
             result = {'changed': False, 'msg': ['Lua %s is not present.' %lua_name]}
 
+    # Report the API calls made by this run
+    result['api_stats'] = apiconnection.getApiStats()
+    if module.params['api_timeline']:
+        apiconnection.writeTimeline(module.params['api_timeline'])
     module.exit_json(**result)
 
 
@@ -8,9 +8,15 @@ DOCUMENTATION =r'''
 ---
 module: opnsense_haproxy_mapfile
 short_description: Manage HAProxy mapfiles on Opnsense
+description:
+  - The content is either given as mapfile_content or read from the file mapfile_src on the executing node.
+  - Contents are compared by their sha256 digest (ignoring line endings and empty lines, with mapfile_sort also the order of entries),
+    the content is only uploaded when the digests differ.
 '''
 
 from ansible.module_utils.opnsense_utils import OpnsenseApi
+from ansible.module_utils.opnsense_utils import HaproxyDiff
+from ansible.module_utils.opnsense_utils import HaproxyMapfile
 
 from ansible.module_utils.basic import AnsibleModule
 
@@ -28,12 +34,20 @@ def main():
             api_key=dict(type='str', required=True, no_log=True),
             api_secret=dict(type='str', required=True, no_log=True),
             api_ssl_verify=dict(type='bool', default=False),
+            api_timeline=dict(type='path'),
+            api_connect_timeout=dict(type='int', default=10),
+            api_read_timeout=dict(type='int', default=120),
+            api_retries=dict(type='int', default=3),
+            api_template_ttl=dict(type='int', default=60),
             mapfile_name=dict(type='str', required=True),
             mapfile_description=dict(type='str', default=''),
             mapfile_content=dict(type='str', default=''),
+            mapfile_src=dict(type='path'),
+            mapfile_sort=dict(type='bool', default=False),
             mapfile_state=dict(type='str', choices=['present', 'absent'], default='present'),
             haproxy_reload=dict(type='bool', default=False),
         ),
+        mutually_exclusive=[('mapfile_content', 'mapfile_src')],
         supports_check_mode=True,
     )
     haproxy_reload = module.params['haproxy_reload']
@@ -42,51 +56,75 @@ def main():
     mapfile_content = module.params['mapfile_content']
     mapfile_state = module.params['mapfile_state']
     mapfile_description = module.params['mapfile_description']
+    mapfile_src = module.params['mapfile_src']
+    mapfile_sort = module.params['mapfile_sort']
+    # Fingerprint the desired content, a file is read line by line and only loaded completely for an upload
+    try:
+        if mapfile_src:
+            desired_digest, desired_lines = HaproxyMapfile.fileDigest(mapfile_src, sort=mapfile_sort)
+        else:
+            desired_digest, desired_lines = HaproxyMapfile.contentDigest(mapfile_content, sort=mapfile_sort)
+    except (IOError, OSError, UnicodeDecodeError) as e:
+        module.fail_json(msg='Cannot read mapfile_src %s: %s' %(mapfile_src, e))
     # Instantiate API connection
     api_url = module.params['api_url']
     api_auth = (module.params['api_key'], module.params['api_secret'])
     api_ssl_verify = module.params['api_ssl_verify']
-    apiconnection = OpnsenseApi.Haproxy(api_url, api_auth, api_ssl_verify)
-
-    # Fetch list of mapfiles
-    mapfiles = apiconnection.listObjects('mapfile')
+    apiconnection = OpnsenseApi.Haproxy(api_url, api_auth, api_ssl_verify,
+                                        connect_timeout=module.params['api_connect_timeout'],
+                                        read_timeout=module.params['api_read_timeout'],
+                                        retries=module.params['api_retries'],
+                                        template_ttl=module.params['api_template_ttl'])
 
-    # Build dict with desired state
-    desired_properties = {'description': mapfile_description, 'content': mapfile_content}
-    # Prepare dict with properties needing change
-    changed_properties = {}
+    # Build dict with desired state, the content is compared separately by its digest
+    desired_properties = {'description': mapfile_description}
     # Prepare result dict
     result = {}
     additional_msg = []
     # Initialize some control vars
     needs_change = False
-    uuid = ''
     # Check if mapfile object with specified name exists
-    for mapfile in mapfiles:
-        if mapfile['name'] == mapfile_name:
-            uuid = mapfile['uuid']
-            break
+    uuid = apiconnection.findUuidByName('mapfile', mapfile_name)
     mapfile_exists = (uuid != '')
 
     if mapfile_state == 'present':
         if mapfile_exists:
             mapfile = apiconnection.getObjectByName('mapfile', mapfile_name)
-            for prop in desired_properties.keys():
-                if mapfile[prop] != desired_properties[prop]:
-                    needs_change = True
-                    changed_properties[prop] = desired_properties[prop]
+            changed_properties, changes = HaproxyDiff.diffObject('mapfile', mapfile, desired_properties)
+            current_digest = HaproxyMapfile.contentDigest(mapfile.get('content'), sort=mapfile_sort)[0]
+            content_changes = None
+            if current_digest != desired_digest:
+                if mapfile_src:
+                    mapfile_content = HaproxyMapfile.readFile(mapfile_src)
+                changed_properties['content'] = mapfile_content
+                # Reports the digests instead of the whole contents
+                content_field = HaproxyDiff.getFieldsByProp('mapfile')['content']
+                changes.append(HaproxyDiff.changeEntry(content_field, mapfile.get('content'), mapfile_content, {'sort': mapfile_sort}))
+                content_changes = HaproxyMapfile.diffLines(mapfile.get('content'), mapfile_content)
+            needs_change = bool(changed_properties)
+            additional_msg.extend(HaproxyDiff.formatChanges(changes))
             if not needs_change:
                 result = {'changed': False, 'msg': ['Mapfile already present: %s' %mapfile_name]}
             else:
+                # Changes of only cosmetic fields (e.g. descriptions) don't need a reload
+                reload = HaproxyDiff.reloadImpact('mapfile', changes)
                 if not module.check_mode:
-                    additional_msg.append(apiconnection.updateObject('mapfile', mapfile_name, changed_properties))
-                    if haproxy_reload: additional_msg.append(apiconnection.applyConfig())
-                result = {'changed': True, 'msg': ['Mapfile %s must be changed.' %mapfile_name, additional_msg]}
+                    additional_msg.append(apiconnection.updateObject('mapfile', mapfile_name, changed_properties, reload=reload['required']))
+                    if haproxy_reload and reload['required']: additional_msg.append(apiconnection.applyConfig())
+                result = {'changed': True, 'msg': ['Mapfile %s must be changed.' %mapfile_name, additional_msg], 'changes': changes, 'reload': reload}
+                if content_changes is not None:
+                    result['lines_added'] = content_changes['added']
+                    result['lines_removed'] = content_changes['removed']
+                    result['added_lines'] = content_changes['added_lines']
+                    result['removed_lines'] = content_changes['removed_lines']
         else:
+            if mapfile_src:
+                mapfile_content = HaproxyMapfile.readFile(mapfile_src)
+            desired_properties['content'] = mapfile_content
             if not module.check_mode:
                 additional_msg.append(apiconnection.createObject('mapfile', mapfile_name, desired_properties))
                 if haproxy_reload: additional_msg.append(apiconnection.applyConfig())
-            result = {'changed': True, 'msg': ['Mapfile %s must be created.' %mapfile_name, additional_msg]}
+            result = {'changed': True, 'msg': ['Mapfile %s must be created.' %mapfile_name, additional_msg], 'lines_added': desired_lines}
     else:
         if mapfile_exists:
             if not module.check_mode:
@@ -96,6 +134,12 @@ def main():
         else:
             result = {'changed': False, 'msg': ['Mapfile %s is not present.' %mapfile_name]}
 
+    if mapfile_state == 'present':
+        result['digest'] = desired_digest
+    # Report the API calls made by this run
+    result['api_stats'] = apiconnection.getApiStats()
+    if module.params['api_timeline']:
+        apiconnection.writeTimeline(module.params['api_timeline'])
     module.exit_json(**result)
 
 
@@ -0,0 +1,137 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2019, Markus Joosten https://github.com/mj84
+from __future__ import absolute_import, division, print_function
+
+DOCUMENTATION =r'''
+---
+module: opnsense_haproxy_multi
+short_description: Manage the same HAProxy objects on several Opnsense firewalls
+description:
+  - Converges the objects (keyed by objecttype, shaped like the opnsense_haproxy_* role variables) on every target like opnsense_haproxy_converge.
+  - Up to max_targets firewalls are converged concurrently, each with its own snapshot and result.
+  - At most max_reloads firewalls run configtest and reconfigure at the same time.
+'''
+
+from collections import OrderedDict
+
+from ansible.module_utils.opnsense_utils import OpnsenseApi
+from ansible.module_utils.opnsense_utils import HaproxyReconcile
+from ansible.module_utils.opnsense_utils import HaproxySchedule
+from ansible.module_utils.opnsense_utils import HaproxyValidate
+
+from ansible.module_utils.basic import AnsibleModule
+
+# There will only be a single AnsibleModule object per module
+module = None
+
+
+def main():
+
+    global module
+    # Instantiate module
+    module = AnsibleModule(
+        argument_spec=dict(
+            targets=dict(type='list',
+                elements='dict',
+                required=True,
+                options=dict(
+                    name=dict(type='str'),
+                    api_url=dict(type='str', required=True),
+                    api_key=dict(type='str', required=True, no_log=True),
+                    api_secret=dict(type='str', required=True, no_log=True),
+                    api_ssl_verify=dict(type='bool', default=False),
+                ),
+            ),
+            api_connect_timeout=dict(type='int', default=10),
+            api_read_timeout=dict(type='int', default=120),
+            api_retries=dict(type='int', default=3),
+            api_snapshot_cache=dict(type='bool', default=False),
+            api_template_ttl=dict(type='int', default=60),
+            objects=dict(type='dict', default={}),
+            purge=dict(type='bool', default=False),
+            max_targets=dict(type='int', default=4),
+            max_reloads=dict(type='int', default=1),
+            max_workers=dict(type='int', default=4),
+            haproxy_reload=dict(type='bool', default=True),
+        ),
+        supports_check_mode=True,
+    )
+    haproxy_reload = module.params['haproxy_reload']
+    purge = module.params['purge']
+    # Types without objects are not managed, so purge leaves them alone
+    objects = dict((objecttype, items) for objecttype, items in module.params['objects'].items() if items)
+
+    # Instantiate one API connection per target
+    targets = [{'name': target['name'], 'url': target['api_url'], 'auth': (target['api_key'], target['api_secret']),
+                'ssl_verify': target['api_ssl_verify']} for target in module.params['targets']]
+    try:
+        apiconnections = OpnsenseApi.HaproxyTargets(targets,
+                                                    max_targets=module.params['max_targets'],
+                                                    max_reloads=module.params['max_reloads'],
+                                                    connect_timeout=module.params['api_connect_timeout'],
+                                                    read_timeout=module.params['api_read_timeout'],
+                                                    retries=module.params['api_retries'],
+                                                    template_ttl=module.params['api_template_ttl'],
+                                                    snapshot_cache=module.params['api_snapshot_cache'])
+    except ValueError as e:
+        module.fail_json(msg=str(e))
+
+    def convergeTarget(name, apiconnection):
+        result = OrderedDict([('url', apiconnection.url), ('changed', False), ('failed', False)])
+        # All types of this firewall are read with a single request
+        apiconnection.loadSnapshot()
+        # Check all references before the first write
+        problems = HaproxyValidate.validate(apiconnection, objects, purge=purge)
+        if problems:
+            result['failed'] = True
+            result['msg'] = '%d problems found, nothing was changed: %s' %(len(problems), '; '.join(problem['msg'] for problem in problems))
+            result['problems'] = problems
+            return result
+        scheduler = HaproxySchedule.Scheduler(apiconnection, check_mode=module.check_mode, max_workers=module.params['max_workers'])
+        results, schedule = scheduler.converge(objects, purge=purge)
+        reload_required = False
+        failed = []
+        for objecttype, typeresults in results.items():
+            result['changed'] = result['changed'] or HaproxyReconcile.isChanged(typeresults)
+            # Changes of only cosmetic fields (e.g. descriptions) don't need a reload
+            reload_required = reload_required or HaproxyReconcile.needsReload(typeresults)
+            failed.extend('%s %s' %(objecttype, name) for name in HaproxyReconcile.failedItems(typeresults))
+        result['reload_required'] = reload_required
+        result['reloaded'] = False
+        if failed:
+            result['failed'] = True
+            result['msg'] = 'Failed to manage objects: %s' % ', '.join(failed)
+        elif reload_required and haproxy_reload and not module.check_mode:
+            apiconnections.applyConfig(name)
+            result['reloaded'] = True
+        result['results'] = results
+        result['schedule'] = schedule
+        return result
+
+    outcomes = apiconnections.run(convergeTarget)
+
+    # One result per target, a failing target doesn't stop the others
+    changed = False
+    failed = []
+    target_results = OrderedDict()
+    api_stats = apiconnections.getApiStats()
+    for name, (result, error) in outcomes.items():
+        if result is None:
+            result = OrderedDict([('url', apiconnections.connections[name].url), ('changed', False), ('failed', True), ('msg', error)])
+        result['api_stats'] = api_stats[name]
+        target_results[name] = result
+        changed = changed or result['changed']
+        if result['failed']:
+            failed.append('%s (%s)' %(name, result['msg']))
+
+    if failed:
+        module.fail_json(msg='Failed on %d of %d targets: %s' %(len(failed), len(target_results), ', '.join(failed)),
+                         changed=changed, targets=target_results)
+    module.exit_json(changed=changed, targets=target_results,
+                     reload_required=any(result['reload_required'] for result in target_results.values()))
+
+
+if __name__ == '__main__':
+    main()
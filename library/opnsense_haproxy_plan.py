@@ -0,0 +1,131 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2019, Markus Joosten https://github.com/mj84
+from __future__ import absolute_import, division, print_function
+
+DOCUMENTATION =r'''
+---
+module: opnsense_haproxy_plan
+short_description: Plan and apply changes of all HAProxy objects on Opnsense
+description:
+  - With mode plan, the whole HAProxy model is read with a single request and diffed against the objects in memory.
+    The creates, updates and deletes with their field level changes are returned and written to plan_file.
+    Planning never changes the firewall, so it always reports changed=false. In check mode plan_file is not written.
+  - With mode apply, exactly the changes of plan_file are applied with the same objects, unless the HAProxy configuration
+    or the objects changed since planning. The plan only holds digests of the objects, not their values.
+'''
+
+from ansible.module_utils.opnsense_utils import OpnsenseApi
+from ansible.module_utils.opnsense_utils import HaproxyPlan
+from ansible.module_utils.opnsense_utils import HaproxyReconcile
+
+from ansible.module_utils.basic import AnsibleModule
+
+# There will only be a single AnsibleModule object per module
+module = None
+
+
+def main():
+
+    global module
+    # Instantiate module
+    module = AnsibleModule(
+        argument_spec=dict(
+            api_url=dict(type='str', required=True),
+            api_key=dict(type='str', required=True, no_log=True),
+            api_secret=dict(type='str', required=True, no_log=True),
+            api_ssl_verify=dict(type='bool', default=False),
+            api_timeline=dict(type='path'),
+            api_connect_timeout=dict(type='int', default=10),
+            api_read_timeout=dict(type='int', default=120),
+            api_retries=dict(type='int', default=3),
+            api_snapshot_cache=dict(type='bool', default=False),
+            api_template_ttl=dict(type='int', default=60),
+            mode=dict(type='str', choices=['plan', 'apply'], default='plan'),
+            plan_file=dict(type='path'),
+            objects=dict(type='dict', default={}),
+            purge=dict(type='bool', default=False),
+            force=dict(type='bool', default=False),
+            max_workers=dict(type='int', default=4),
+            haproxy_reload=dict(type='bool', default=False),
+        ),
+        required_if=[('mode', 'apply', ['plan_file'])],
+        supports_check_mode=True,
+    )
+    mode = module.params['mode']
+    plan_file = module.params['plan_file']
+    # Types without objects are not managed, so purge leaves them alone
+    objects = dict((objecttype, items) for objecttype, items in module.params['objects'].items() if items)
+
+    # Instantiate API connection
+    api_url = module.params['api_url']
+    api_auth = (module.params['api_key'], module.params['api_secret'])
+    api_ssl_verify = module.params['api_ssl_verify']
+    apiconnection = OpnsenseApi.Haproxy(api_url, api_auth, api_ssl_verify,
+                                        connect_timeout=module.params['api_connect_timeout'],
+                                        read_timeout=module.params['api_read_timeout'],
+                                        retries=module.params['api_retries'],
+                                        template_ttl=module.params['api_template_ttl'],
+                                        snapshot_cache=module.params['api_snapshot_cache'])
+
+    if mode == 'plan' or module.check_mode:
+        # Planning never writes to the firewall, so it also serves as check mode of apply
+        try:
+            if mode == 'plan':
+                plan = HaproxyPlan.makePlan(apiconnection, objects, purge=module.params['purge'], max_workers=module.params['max_workers'])
+            else:
+                plan = HaproxyPlan.readPlan(plan_file)
+        except (IOError, KeyError, ValueError) as e:
+            module.fail_json(msg=str(e), api_stats=apiconnection.getApiStats())
+        # Writing the plan is the only effect of planning, check mode skips it like any other change
+        if mode == 'plan' and plan_file and not module.check_mode:
+            HaproxyPlan.writePlan(plan, plan_file)
+        result = {
+            # Only applying changes the firewall, a check mode apply reports what it would change
+            'changed': mode == 'apply' and bool(plan['changes']),
+            'msg': 'Plan: %(create)d to create, %(update)d to update, %(delete)d to delete, %(failed)d failed' % plan['summary'],
+            'summary': plan['summary'],
+            'changes': plan['changes'],
+            'api_stats': apiconnection.getApiStats(),
+        }
+        if plan.get('problems'):
+            result['problems'] = plan['problems']
+            result['msg'] = '%d problems found: %s' %(len(plan['problems']), '; '.join(problem['msg'] for problem in plan['problems']))
+        if module.params['api_timeline']:
+            apiconnection.writeTimeline(module.params['api_timeline'])
+        if plan['summary']['failed']:
+            module.fail_json(**result)
+        module.exit_json(**result)
+
+    try:
+        plan = HaproxyPlan.readPlan(plan_file)
+        results, schedule = HaproxyPlan.applyPlan(apiconnection, plan, module.params['objects'], force=module.params['force'],
+                                                  max_workers=module.params['max_workers'])
+    except (IOError, KeyError, ValueError) as e:
+        module.fail_json(msg=str(e), api_stats=apiconnection.getApiStats())
+    changed = False
+    reload_required = False
+    failed = []
+    for objecttype, typeresults in results.items():
+        changed = changed or HaproxyReconcile.isChanged(typeresults)
+        # Changes of only cosmetic fields (e.g. descriptions) don't need a reload
+        reload_required = reload_required or HaproxyReconcile.needsReload(typeresults)
+        failed.extend('%s %s' %(objecttype, name) for name in HaproxyReconcile.failedItems(typeresults))
+
+    additional_msg = []
+    if reload_required and module.params['haproxy_reload'] and not failed:
+        additional_msg.append(apiconnection.applyConfig())
+
+    # Report the API calls made by this run
+    api_stats = apiconnection.getApiStats()
+    if module.params['api_timeline']:
+        apiconnection.writeTimeline(module.params['api_timeline'])
+
+    if failed:
+        module.fail_json(msg='Failed to apply the plan for: %s' % ', '.join(failed), changed=changed, results=results, schedule=schedule, api_stats=api_stats)
+    module.exit_json(changed=changed, msg=additional_msg, results=results, schedule=schedule, reload_required=reload_required, api_stats=api_stats)
+
+
+if __name__ == '__main__':
+    main()
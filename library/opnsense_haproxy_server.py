@@ -8,9 +8,14 @@ DOCUMENTATION =r'''
 ---
 module: opnsense_haproxy_server
 short_description: Manage HAProxy servers on Opnsense
+description:
+  - With runtime_socket, changes of only weight and mode (active/disabled) are saved to the configuration
+    and applied to the running HAProxy through its runtime API instead of a reload.
 '''
 
 from ansible.module_utils.opnsense_utils import OpnsenseApi
+from ansible.module_utils.opnsense_utils import HaproxyDiff
+from ansible.module_utils.opnsense_utils import HaproxyRuntime
 
 from ansible.module_utils.basic import AnsibleModule
 
@@ -28,6 +33,11 @@ def main():
             api_key=dict(type='str', required=True, no_log=True),
             api_secret=dict(type='str', required=True, no_log=True),
             api_ssl_verify=dict(type='bool', default=False),
+            api_timeline=dict(type='path'),
+            api_connect_timeout=dict(type='int', default=10),
+            api_read_timeout=dict(type='int', default=120),
+            api_retries=dict(type='int', default=3),
+            api_template_ttl=dict(type='int', default=60),
             server_enabled=dict(type='bool', default=True),
             server_name=dict(type='str', required=True),
             server_address=dict(type='str', required=True),
@@ -45,9 +55,13 @@ def main():
             server_check_down_interval=dict(type='str', default=''),
             server_source=dict(type='str', default=''),
             server_advanced=dict(type='str', default=''),
+            server_drain=dict(type='bool', default=False),
             server_state=dict(type='str', choices=['present', 'absent'], default='present'),
+            runtime_socket=dict(type='str'),
+            runtime_timeout=dict(type='int', default=10),
             haproxy_reload=dict(type='bool', default=False),
         ),
+        required_if=[('server_drain', True, ['runtime_socket'])],
         supports_check_mode=True,
     )
     haproxy_reload = module.params['haproxy_reload']
@@ -58,7 +72,8 @@ def main():
     server_description = module.params['server_description']
     server_address = module.params['server_address']
     server_port = module.params['server_port']
-    server_checkport = module.params['server_port']
+    # Checks go to the server port unless another port is given
+    server_checkport = module.params['server_checkport'] or server_port
     server_mode = module.params['server_mode']
     server_ssl = module.params['server_ssl']
     server_ssl_verify = module.params['server_ssl_verify']
@@ -70,18 +85,40 @@ def main():
     server_check_down_interval = module.params['server_check_down_interval']
     server_source = module.params['server_source']
     server_advanced = module.params['server_advanced']
+    server_drain = module.params['server_drain']
+    runtime = None
+    if module.params['runtime_socket']:
+        try:
+            runtime = HaproxyRuntime.RuntimeApi(module.params['runtime_socket'], timeout=module.params['runtime_timeout'])
+        except ValueError as e:
+            module.fail_json(msg=str(e))
     # Instantiate API connection
     api_url = module.params['api_url']
     auth = (module.params['api_key'], module.params['api_secret'])
     api_ssl_verify = module.params['api_ssl_verify']
-    apiconnection = OpnsenseApi.Haproxy(api_url, auth, api_ssl_verify)
+    apiconnection = OpnsenseApi.Haproxy(api_url, auth, api_ssl_verify,
+                                        connect_timeout=module.params['api_connect_timeout'],
+                                        read_timeout=module.params['api_read_timeout'],
+                                        retries=module.params['api_retries'],
+                                        template_ttl=module.params['api_template_ttl'])
 
-    # Fetch list of servers
-    servers = apiconnection.listObjects('server')
+    # Get an empty server object to lookup the ids of sslCA, sslCRL and sslClientCertificate
+    server_options = apiconnection.getTemplateIndex('server')
+    try:
+        server_ssl_ca_keys = server_options.options('sslCA').keys(server_ssl_ca)
+        server_ssl_crl_key = ''
+        if server_ssl_crl != '':
+            server_ssl_crl_key = server_options.options('sslCRL').key(server_ssl_crl)
+        server_ssl_client_certificate_key = ''
+        if server_ssl_client_certificate != '':
+            server_ssl_client_certificate_key = server_options.options('sslClientCertificate').key(server_ssl_client_certificate)
+    except KeyError as e:
+        module.fail_json(msg=e.args[0])
 
     # Build dict with desired state
     desired_properties = {
         'name': server_name,
+        'enabled': str(int(server_enabled)),
         'address': server_address,
         'description': server_description,
         'port': server_port,
@@ -89,101 +126,61 @@ def main():
         'mode': server_mode,
         'ssl': str(int(server_ssl)),
         'sslVerify': str(int(server_ssl_verify)),
-        'sslCA': server_ssl_ca,
-        'sslCRL': server_ssl_crl,
-        'sslClientCertificate': server_ssl_client_certificate,
+        'sslCA': ','.join(server_ssl_ca_keys),
+        'sslCRL': server_ssl_crl_key,
+        'sslClientCertificate': server_ssl_client_certificate_key,
         'weight': server_weight,
         'checkInterval': server_check_interval,
         'checkDownInterval': server_check_down_interval,
         'source': server_source,
         'advanced': server_advanced,
     }
-    # Prepare dict with properties needing change
-    changed_properties = {}
     # Prepare result dict
     result = {}
     additional_msg = []
     # Initialize some control vars
     needs_change = False
-    uuid = ''
     # Check if server object with specified name exists
-    for server in servers:
-        if server['name'] == server_name:
-            server_exists = True
-            uuid = server['uuid']
-            break
+    uuid = apiconnection.findUuidByName('server', server_name)
     server_exists = (uuid != '')
 
     if server_state == 'present':
         if server_exists:
             server = apiconnection.getObjectByName('server', server_name)
-            #for prop in ['code', 'content', 'description']:
-            for prop in desired_properties.keys():
-                # Special case for mode where selected element must be determined
-                if prop == 'mode':
-                    current_mode = apiconnection.getSelected(server[prop])
-                    if current_mode != server_mode:
-                        needs_change = True
-                        changed_properties[prop] = desired_properties[prop]
-                        additional_msg.append('Changing mode: %s => %s' %(current_mode, server_mode))
-                # Special case for sslCA where a list must be compared to a dict
-                elif prop == 'sslCA':
-                    # Get current list of selected CAs by their name
-                    current_ssl_ca = apiconnection.getSelectedList(server[prop])
-                    # Build list with keys of desired CAs
-                    desired_ssl_ca = []
-                    # Search the ids of desired ssl_ca names
-                    for ca in server_ssl_ca:
-                        ca_key = apiconnection.findValueInDict(
-                            server[prop],
-                            searchvalue=ca
-                        )
-                        if ca_key != '':
-                            desired_ssl_ca.append(ca_key)
-                    # Compare current and desired list of CA names
-                    if not apiconnection.compareLists(current_ssl_ca, server_ssl_ca):
-                        needs_change = True
-                        changed_properties['sslCA'] = ','.join(desired_ssl_ca)
-                        additional_msg.append('Changing sslCA: %s => %s' % (current_ssl_ca, desired_ssl_ca))
-                # Special case for sslCRL where a list must be compared to a dict
-                elif prop == 'sslCRL':
-                    current_ssl_crl = apiconnection.getSelected(server[prop])
-                    # Find id of sslCRL with desired name
-                    desired_ssl_crl = apiconnection.findValueInDict(server[prop], searchvalue=server_ssl_crl)
-                    if not current_ssl_crl == desired_ssl_crl:
-                        needs_change = True
-                        changed_properties['sslCRL'] = desired_ssl_crl
-                        additional_msg.append('Changing sslCRL: %s => %s' % (current_ssl_crl, server_ssl_crl))
-                # Special case for sslClientCertificate where a single object must be determined from a list
-                elif prop == 'sslClientCertificate':
-                    current_ssl_client_certificate = apiconnection.getSelected(server[prop], retval='value')
-                    if current_ssl_client_certificate != server_ssl_client_certificate:
-                        needs_change = True
-                        desired_ssl_client_certificate = apiconnection.findValueInDict(
-                            server[prop],
-                            searchvalue=server_ssl_client_certificate                           
-                        )
-                        changed_properties['sslClientCertificate'] = desired_ssl_client_certificate
-                        additional_msg.append('Changing sslClientCertificate: %s => %s' % (current_ssl_client_certificate, server_ssl_client_certificate))
-                # Standard case for regular simple values
-                else:
-                    if server[prop] != desired_properties[prop]:
-                        needs_change = True
-                        changed_properties[prop] = desired_properties[prop]
-                        additional_msg.append('Changing %s: %s => %s' %(prop, server[prop], desired_properties[prop]))
-            if not needs_change:
+            changed_properties, changes = HaproxyDiff.diffObject('server', server, desired_properties)
+            needs_change = bool(changed_properties)
+            additional_msg.extend(HaproxyDiff.formatChanges(changes))
+            if runtime is not None and HaproxyRuntime.isRuntimeChange(server, changed_properties):
+                # Save the configuration without reload and apply weight and state to the running servers,
+                # the running servers are compared as well, so they never drift from the configuration
+                reload = HaproxyDiff.reloadImpact('server', changes)
+                reload['required'] = False
+                try:
+                    if needs_change and not module.check_mode:
+                        additional_msg.append(apiconnection.updateObject('server', server_name, changed_properties, reload=False))
+                    runtime_changes = []
+                    for backend in HaproxyRuntime.linkedBackends(apiconnection, uuid):
+                        change = runtime.convergeServer(backend, server_name, HaproxyRuntime.desiredWeight(server_weight),
+                                                        HaproxyRuntime.desiredState(server_mode, server_drain, server_enabled),
+                                                        module.check_mode)
+                        if change is not None:
+                            runtime_changes.append(change)
+                except ValueError as e:
+                    module.fail_json(msg=str(e), changes=changes, runtime_stats=runtime.getStats())
+                changed = needs_change or bool(runtime_changes)
+                result = {'changed': changed, 'msg': ['Server %s %s.' %(server_name, 'must be changed at runtime' if changed else 'already present'), additional_msg],
+                          'changes': changes, 'runtime_changes': runtime_changes, 'reload': reload}
+            elif not needs_change:
                 result = {'changed': False, 'msg': ['Server already present: %s' %server_name, additional_msg]}
             else:
+                # Changes of only cosmetic fields (e.g. descriptions) don't need a reload
+                reload = HaproxyDiff.reloadImpact('server', changes)
                 if not module.check_mode:
-                    additional_msg.append(apiconnection.updateObject('server', server_name, changed_properties))
-                    if haproxy_reload: additional_msg.append(apiconnection.applyConfig())
-                result = {'changed': True, 'msg': ['Server %s must be changed.' %server_name, additional_msg]}
+                    additional_msg.append(apiconnection.updateObject('server', server_name, changed_properties, reload=reload['required']))
+                    if haproxy_reload and reload['required']: additional_msg.append(apiconnection.applyConfig())
+                result = {'changed': True, 'msg': ['Server %s must be changed.' %server_name, additional_msg], 'changes': changes, 'reload': reload}
         else:
             if not module.check_mode:
-                # clear parameters sslCA, sslCRL and sslClientCertificate, because we can't get their available ids at this time
-                desired_properties['sslCA'] = ''
-                desired_properties['sslCRL'] = ''
-                desired_properties['sslClientCertificate'] = ''
                 additional_msg.append(apiconnection.createObject('server', server_name, desired_properties))
                 if haproxy_reload: additional_msg.append(apiconnection.applyConfig())
             result = {'changed': True, 'msg': ['Server %s must be created.' %server_name, additional_msg]}
@@ -196,6 +193,12 @@ def main():
         else:
             result = {'changed': False, 'msg': ['Server %s is not present.' %server_name]}
 
+    # Report the API calls made by this run
+    result['api_stats'] = apiconnection.getApiStats()
+    if runtime is not None:
+        result['runtime_stats'] = runtime.getStats()
+    if module.params['api_timeline']:
+        apiconnection.writeTimeline(module.params['api_timeline'])
     module.exit_json(**result)
 
 
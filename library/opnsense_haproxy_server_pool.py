@@ -0,0 +1,171 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2019, Markus Joosten https://github.com/mj84
+from __future__ import absolute_import, division, print_function
+
+DOCUMENTATION =r'''
+---
+module: opnsense_haproxy_server_pool
+short_description: Manage a pool of near-identical HAProxy servers on Opnsense
+description:
+  - Expands a name pattern and a list of addresses or CIDR ranges into servers sharing port and properties
+    and converges all of them in one run, only the differing servers get created, updated or deleted.
+  - Servers which are not part of the pool anymore get deleted, if the name pattern could have produced their name
+    and they are pool members, i.e. linked to pool_backend or carrying the description of the pool's servers.
+  - The servers of a pool get the description "Server pool <pool_name>" unless pool_properties sets one.
+  - With pool_backend, the linkedServers of that backend are updated in the same run,
+    servers not belonging to the pool stay linked.
+'''
+
+from ansible.module_utils.opnsense_utils import OpnsenseApi
+from ansible.module_utils.opnsense_utils import HaproxyDiff
+from ansible.module_utils.opnsense_utils import HaproxyPool
+from ansible.module_utils.opnsense_utils import HaproxyReconcile
+from ansible.module_utils.opnsense_utils import HaproxySchema
+from ansible.module_utils.opnsense_utils import HaproxyValidate
+
+from ansible.module_utils.basic import AnsibleModule
+
+# There will only be a single AnsibleModule object per module
+module = None
+
+
+def main():
+
+    global module
+    # Instantiate module
+    module = AnsibleModule(
+        argument_spec=dict(
+            api_url=dict(type='str', required=True),
+            api_key=dict(type='str', required=True, no_log=True),
+            api_secret=dict(type='str', required=True, no_log=True),
+            api_ssl_verify=dict(type='bool', default=False),
+            api_timeline=dict(type='path'),
+            api_connect_timeout=dict(type='int', default=10),
+            api_read_timeout=dict(type='int', default=120),
+            api_retries=dict(type='int', default=3),
+            api_snapshot_cache=dict(type='bool', default=False),
+            api_template_ttl=dict(type='int', default=60),
+            pool_name=dict(type='str', required=True),
+            pool_name_pattern=dict(type='str'),
+            pool_addresses=dict(type='list', default=[]),
+            pool_port=dict(type='str', required=True),
+            pool_properties=dict(type='dict', default={}),
+            pool_backend=dict(type='str'),
+            pool_state=dict(type='str', choices=['present', 'absent'], default='present'),
+            snapshot=dict(type='bool', default=True),
+            haproxy_reload=dict(type='bool', default=False),
+        ),
+        supports_check_mode=True,
+    )
+    haproxy_reload = module.params['haproxy_reload']
+    pool_name = module.params['pool_name']
+    # Servers are named <pool_name>-1, <pool_name>-2, ... unless a pattern with {index} and/or {address} is given
+    pool_name_pattern = module.params['pool_name_pattern'] or pool_name + '-{index}'
+    pool_backend = module.params['pool_backend']
+    # The description marks the servers as members of this pool, see step 3
+    pool_properties = dict(module.params['pool_properties'])
+    pool_properties.setdefault('description', 'Server pool %s' % pool_name)
+    try:
+        items = HaproxyPool.poolItems(pool_name_pattern, module.params['pool_addresses'], module.params['pool_port'],
+                                      pool_properties)
+    except ValueError as e:
+        module.fail_json(msg=str(e))
+    if module.params['pool_state'] == 'absent':
+        items = {}
+
+    # Instantiate API connection
+    api_url = module.params['api_url']
+    api_auth = (module.params['api_key'], module.params['api_secret'])
+    api_ssl_verify = module.params['api_ssl_verify']
+    apiconnection = OpnsenseApi.Haproxy(api_url, api_auth, api_ssl_verify,
+                                        connect_timeout=module.params['api_connect_timeout'],
+                                        read_timeout=module.params['api_read_timeout'],
+                                        retries=module.params['api_retries'],
+                                        template_ttl=module.params['api_template_ttl'],
+                                        snapshot_cache=module.params['api_snapshot_cache'])
+    # Read all servers and backends with a single request instead of fetching every server
+    if module.params['snapshot']:
+        apiconnection.loadSnapshot()
+
+    # Check the references of the servers (e.g. SSL objects in pool_properties) and the backend before the first write
+    problems = HaproxyValidate.validate(apiconnection, {'server': items})
+    if pool_backend and apiconnection.findUuidByName('backend', pool_backend) == '':
+        problems.append(HaproxyValidate.problem('backend', pool_backend, '', 'pool %s: pool_backend references unknown backend %s' %(pool_name, pool_backend)))
+    if problems:
+        module.fail_json(msg='%d problems found, nothing was changed: %s' %(len(problems), '; '.join(problem['msg'] for problem in problems)),
+                         problems=problems, api_stats=apiconnection.getApiStats())
+
+    existing = dict((row['name'], row['uuid']) for row in apiconnection.listObjects('server'))
+    # Pool members are linked to the pool's backend or carry the description of the pool's servers
+    members = set()
+    fields = HaproxyDiff.getFieldsByProp('backend')
+    if pool_backend:
+        members.update(HaproxySchema.currentValue(fields['linkedServers'], apiconnection.getObjectByName('backend', pool_backend)))
+    candidates = [existing[name] for name in HaproxyPool.candidates(pool_name_pattern, existing, items) if existing[name] not in members]
+    if candidates:
+        servers, errors = apiconnection.getObjectsByUuids('server', candidates)
+        if errors:
+            module.fail_json(msg='Failed to read servers: %s' % ', '.join('%s (%s)' %(uuid, error) for uuid, error in errors.items()),
+                             api_stats=apiconnection.getApiStats())
+        members.update(uuid for uuid, server in zip(candidates, servers) if server.get('description') == pool_properties['description'])
+    obsolete = HaproxyPool.obsoleteMembers(pool_name_pattern, existing, items, members)
+    reconciler = HaproxyReconcile.Reconciler(apiconnection, check_mode=module.check_mode)
+
+    # 1. Create and update the servers of the pool
+    results = reconciler.reconcile('server', items)
+    failed = HaproxyReconcile.failedItems(results)
+
+    # 2. Link the pool to the backend, before obsolete servers get deleted
+    backend_changes = []
+    if pool_backend and not failed:
+        try:
+            backend = apiconnection.getObjectByName('backend', pool_backend)
+        except KeyError as e:
+            module.fail_json(msg=e.args[0], results=results, api_stats=apiconnection.getApiStats())
+        linked = HaproxySchema.currentValue(fields['linkedServers'], backend)
+        pool_uuids = []
+        for name in items:
+            uuid = apiconnection.findUuidByName('server', name)
+            # In check mode, new servers have no UUID yet
+            pool_uuids.append(uuid if uuid != '' else HaproxyReconcile.placeholder(name))
+        obsolete_uuids = set(existing[name] for name in obsolete)
+        desired = [uuid for uuid in linked if uuid not in obsolete_uuids and uuid not in pool_uuids] + pool_uuids
+        if not HaproxyDiff.isEqual(fields['linkedServers'], linked, desired):
+            backend_changes.append(HaproxyDiff.changeEntry(fields['linkedServers'], linked, desired))
+            if not module.check_mode:
+                # linkedActions have to be sent with every change, see HaproxySchema.ALWAYS_SEND
+                properties = {'linkedServers': ','.join(desired)}
+                for prop in HaproxySchema.ALWAYS_SEND['backend']:
+                    properties[prop] = ','.join(HaproxySchema.currentValue(fields[prop], backend))
+                apiconnection.updateObject('backend', pool_backend, properties)
+
+    # 3. Delete the servers which are not part of the pool anymore
+    if obsolete and not failed:
+        results.update(reconciler.reconcile('server', dict((name, {'state': 'absent'}) for name in obsolete)))
+        failed = HaproxyReconcile.failedItems(results)
+
+    changed = HaproxyReconcile.isChanged(results) or bool(backend_changes)
+    # Changes of only cosmetic fields (e.g. descriptions) don't need a reload
+    reload_required = HaproxyReconcile.needsReload(results) or bool(backend_changes)
+    additional_msg = []
+    if reload_required and haproxy_reload and not module.check_mode and not failed:
+        additional_msg.append(apiconnection.applyConfig())
+
+    # Report the API calls made by this run
+    api_stats = apiconnection.getApiStats()
+    if module.params['api_timeline']:
+        apiconnection.writeTimeline(module.params['api_timeline'])
+
+    summary = dict((action, len([name for name in results if results[name]['action'] == action]))
+                   for action in ('create', 'update', 'delete', 'none', 'failed'))
+    if failed:
+        module.fail_json(msg='Failed to manage servers of pool %s: %s' %(pool_name, ', '.join(failed)), changed=changed,
+                         results=results, summary=summary, backend_changes=backend_changes, api_stats=api_stats)
+    module.exit_json(changed=changed, msg=additional_msg, results=results, summary=summary, backend_changes=backend_changes,
+                     reload_required=reload_required, api_stats=api_stats)
+
+
+if __name__ == '__main__':
+    main()
@@ -11,6 +11,7 @@ short_description: Manage HAProxy users on Opnsense
 '''
 
 from ansible.module_utils.opnsense_utils import OpnsenseApi
+from ansible.module_utils.opnsense_utils import HaproxyDiff
 
 from ansible.module_utils.basic import AnsibleModule
 
@@ -28,6 +29,11 @@ def main():
             api_key=dict(type='str', required=True, no_log=True),
             api_secret=dict(type='str', required=True, no_log=True),
             api_ssl_verify=dict(type='bool', default=False),
+            api_timeline=dict(type='path'),
+            api_connect_timeout=dict(type='int', default=10),
+            api_read_timeout=dict(type='int', default=120),
+            api_retries=dict(type='int', default=3),
+            api_template_ttl=dict(type='int', default=60),
             user_name=dict(type='str', required=True),
             user_password=dict(type='str', default='', no_log=True),
             user_enabled=dict(type='bool', default=True),
@@ -48,45 +54,40 @@ def main():
     api_url = module.params['api_url']
     auth = (module.params['api_key'], module.params['api_secret'])
     api_ssl_verify = module.params['api_ssl_verify']
-    apiconnection = OpnsenseApi.Haproxy(api_url, auth, api_ssl_verify)
-
-    # Fetch list of users
-    users = apiconnection.listObjects('user')
+    apiconnection = OpnsenseApi.Haproxy(api_url, auth, api_ssl_verify,
+                                        connect_timeout=module.params['api_connect_timeout'],
+                                        read_timeout=module.params['api_read_timeout'],
+                                        retries=module.params['api_retries'],
+                                        template_ttl=module.params['api_template_ttl'])
 
     # Build dict with desired state
     desired_properties = {'password': user_password, 'enabled': user_enabled, 'description': user_description}
-    # Prepare dict with properties needing change
-    changed_properties = {}
     # Prepare result dict
     result = {}
     additional_msg = []
     # Initialize some control vars
     needs_change = False
-    uuid = ''
     # Check if user object with specified name exists
-    for user in users:
-        if user['name'] == user_name:
-            user_exists = True
-            uuid = user['uuid']
-            additional_msg.append(uuid)
-            break
+    uuid = apiconnection.findUuidByName('user', user_name)
+    if uuid != '':
+        additional_msg.append(uuid)
     user_exists = (uuid != '')
 
     if user_state == 'present':
         if user_exists:
             user = apiconnection.getObjectByName('user', user_name)
-            for prop in desired_properties.keys():
-                if user[prop] != desired_properties[prop]:
-                    needs_change = True
-                    changed_properties[prop] = desired_properties[prop]
-                    additional_msg.append('Changing %s: %s => %s' %(prop, user[prop], desired_properties[prop]))
+            changed_properties, changes = HaproxyDiff.diffObject('user', user, desired_properties)
+            needs_change = bool(changed_properties)
+            additional_msg.extend(HaproxyDiff.formatChanges(changes))
             if not needs_change:
                 result = {'changed': False, 'msg': ['User already present: %s' %user_name]}
             else:
+                # Changes of only cosmetic fields (e.g. descriptions) don't need a reload
+                reload = HaproxyDiff.reloadImpact('user', changes)
                 if not module.check_mode:
-                    additional_msg.append(apiconnection.updateObject('user', user_name, changed_properties))
-                    if haproxy_reload: additional_msg.append(apiconnection.applyConfig())
-                result = {'changed': True, 'msg': ['User %s must be changed.' %user_name, additional_msg]}
+                    additional_msg.append(apiconnection.updateObject('user', user_name, changed_properties, reload=reload['required']))
+                    if haproxy_reload and reload['required']: additional_msg.append(apiconnection.applyConfig())
+                result = {'changed': True, 'msg': ['User %s must be changed.' %user_name, additional_msg], 'changes': changes, 'reload': reload}
         else:
             if not module.check_mode:
                 additional_msg.append(apiconnection.createObject('user', user_name, desired_properties))
@@ -101,6 +102,10 @@ def main():
         else:
             result = {'changed': False, 'msg': ['User %s is not present.' %user_name]}
 
+    # Report the API calls made by this run
+    result['api_stats'] = apiconnection.getApiStats()
+    if module.params['api_timeline']:
+        apiconnection.writeTimeline(module.params['api_timeline'])
     module.exit_json(**result)
 
 
@@ -0,0 +1,77 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2019, Markus Joosten https://github.com/mj84
+from __future__ import absolute_import, division, print_function
+
+DOCUMENTATION =r'''
+---
+module: opnsense_haproxy_validate
+short_description: Check the HAProxy role variables against the objects on Opnsense without changing anything
+description:
+  - Takes the objects of every type, keyed by objecttype and shaped like the opnsense_haproxy_* role variables.
+  - Checks required properties and every reference against the existing plus the desired objects
+    and fails with all problems at once.
+'''
+
+from ansible.module_utils.opnsense_utils import OpnsenseApi
+from ansible.module_utils.opnsense_utils import HaproxyValidate
+
+from ansible.module_utils.basic import AnsibleModule
+
+# There will only be a single AnsibleModule object per module
+module = None
+
+
+def main():
+
+    global module
+    # Instantiate module
+    module = AnsibleModule(
+        argument_spec=dict(
+            api_url=dict(type='str', required=True),
+            api_key=dict(type='str', required=True, no_log=True),
+            api_secret=dict(type='str', required=True, no_log=True),
+            api_ssl_verify=dict(type='bool', default=False),
+            api_timeline=dict(type='path'),
+            api_connect_timeout=dict(type='int', default=10),
+            api_read_timeout=dict(type='int', default=120),
+            api_retries=dict(type='int', default=3),
+            api_snapshot_cache=dict(type='bool', default=False),
+            api_template_ttl=dict(type='int', default=60),
+            objects=dict(type='dict', default={}),
+            purge=dict(type='bool', default=False),
+            snapshot=dict(type='bool', default=True),
+        ),
+        supports_check_mode=True,
+    )
+    objects = dict((objecttype, items) for objecttype, items in module.params['objects'].items() if items)
+
+    # Instantiate API connection
+    api_url = module.params['api_url']
+    api_auth = (module.params['api_key'], module.params['api_secret'])
+    api_ssl_verify = module.params['api_ssl_verify']
+    apiconnection = OpnsenseApi.Haproxy(api_url, api_auth, api_ssl_verify,
+                                        connect_timeout=module.params['api_connect_timeout'],
+                                        read_timeout=module.params['api_read_timeout'],
+                                        retries=module.params['api_retries'],
+                                        template_ttl=module.params['api_template_ttl'],
+                                        snapshot_cache=module.params['api_snapshot_cache'])
+    # The names of all types are read with a single request
+    if module.params['snapshot']:
+        apiconnection.loadSnapshot()
+
+    problems = HaproxyValidate.validate(apiconnection, objects, purge=module.params['purge'])
+
+    # Report the API calls made by this run
+    api_stats = apiconnection.getApiStats()
+    if module.params['api_timeline']:
+        apiconnection.writeTimeline(module.params['api_timeline'])
+    if problems:
+        module.fail_json(msg='%d problems found: %s' %(len(problems), '; '.join(problem['msg'] for problem in problems)),
+                         problems=problems, api_stats=api_stats)
+    module.exit_json(changed=False, msg='%d objects checked.' % sum(len(items) for items in objects.values()), problems=problems, api_stats=api_stats)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2019, Markus Joosten https://github.com/mj84
+from __future__ import absolute_import, division, print_function
+
+# Compares desired properties (as sent to the API) with an object returned by get<objecttype>.
+# How each property is compared depends on its kind in HaproxySchema:
+# simple values and single selects by value, unordered multi selects as sets,
+# ordered multi selects (e.g. linkedActions) element by element.
+
+from collections import OrderedDict
+
+from ansible.module_utils.opnsense_utils import HaproxyMapfile
+from ansible.module_utils.opnsense_utils import HaproxySchema
+
+SECRET = '********'
+
+
+def getFieldsByProp(objecttype, item=None):
+    fields = {}
+    for field in HaproxySchema.getFields(objecttype, item):
+        # Several role keys may share a property, the first definition wins
+        if field.prop not in fields:
+            fields[field.prop] = field
+    return fields
+
+
+def digest(value, item=None):
+    # Digest of a map file content, sorted first if the item asks for it (see HaproxyMapfile.contentDigest)
+    return HaproxyMapfile.contentDigest(value, sort=bool((item or {}).get('sort', False)))[0]
+
+
+def isEqual(field, before, after, item=None):
+    # before is normalized by HaproxySchema.currentValue, after is the value sent to the API
+    if field.kind == HaproxySchema.DIGEST:
+        return digest(before, item) == digest(after, item)
+    if field.kind == HaproxySchema.ORDERED_MULTISELECT:
+        return before == HaproxySchema.toList(after)
+    if field.kind == HaproxySchema.MULTISELECT:
+        return set(before) == set(HaproxySchema.toList(after))
+    return before == after
+
+
+def changeEntry(field, before, after, item=None):
+    change = OrderedDict([('property', field.prop), ('kind', field.kind)])
+    if field.secret:
+        change['before'] = SECRET
+        change['after'] = SECRET
+    elif field.kind == HaproxySchema.DIGEST:
+        # Report the digests instead of the whole contents
+        change['before'] = digest(before, item)
+        change['after'] = digest(after, item)
+    elif field.kind in HaproxySchema.MULTISELECT_KINDS:
+        after = HaproxySchema.toList(after)
+        change['before'] = before
+        change['after'] = after
+        before_set = set(before)
+        after_set = set(after)
+        change['added'] = [value for value in after if value not in before_set]
+        change['removed'] = [value for value in before if value not in after_set]
+    else:
+        change['before'] = before
+        change['after'] = after
+    return change
+
+
+def diffObject(objecttype, current, desired, item=None):
+    # Returns the properties which need to be changed and a change log with one entry per changed property.
+    # Properties unknown to the schema are compared as simple values,
+    # properties depending on a disabled switch (e.g. SSL options while SSL is disabled) are ignored.
+    fields = getFieldsByProp(objecttype, item)
+    changed_properties = OrderedDict()
+    changes = []
+    for prop, after in desired.items():
+        field = fields.get(prop)
+        if field is None:
+            field = HaproxySchema.Field(prop)
+        if not HaproxySchema.isEnabled(field, desired):
+            continue
+        before = HaproxySchema.currentValue(field, current)
+        if not isEqual(field, before, after, item):
+            changed_properties[prop] = after
+            changes.append(changeEntry(field, before, after, item))
+    return changed_properties, changes
+
+
+def reloadImpact(objecttype, changes, item=None):
+    # Whether the changes need configtest and reconfigure, the most disruptive impact (see HaproxySchema.IMPACTS)
+    # and the properties with that impact. Without changes, nothing needs to be reloaded.
+    fields = getFieldsByProp(objecttype, item)
+    impact = None
+    properties = []
+    for change in changes:
+        field = fields.get(change['property'])
+        field_impact = field.impact if field is not None else HaproxySchema.CONFIG
+        if impact is None or HaproxySchema.IMPACTS.index(field_impact) > HaproxySchema.IMPACTS.index(impact):
+            impact = field_impact
+            properties = []
+        if field_impact == impact:
+            properties.append(change['property'])
+    return OrderedDict([('required', HaproxySchema.needsReload(impact)), ('impact', impact), ('properties', properties)])
+
+
+def formatChanges(changes):
+    return ['Changing %s: %s => %s' %(change['property'], change['before'], change['after']) for change in changes]
@@ -0,0 +1,103 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2019, Markus Joosten https://github.com/mj84
+from __future__ import absolute_import, division, print_function
+
+# Exports the objects on the firewall in the shape of the opnsense_haproxy_* role variables:
+# API properties are translated back to the keys of HaproxySchema, references from UUIDs to names,
+# booleans from '0'/'1' to false/true. Each object is converted as soon as it is read and the raw object dropped,
+# so the memory needed is the export plus the objects of one request.
+
+from collections import OrderedDict
+
+from ansible.module_utils.parsing.convert_bool import boolean
+
+from ansible.module_utils.opnsense_utils import HaproxySchema
+
+
+def roleVariable(objecttype):
+    # e.g. opnsense_haproxy_servers
+    return 'opnsense_haproxy_%ss' % objecttype
+
+
+def optionNames(value, keys, names):
+    # The names of the selected keys, from the option dict of the object itself or the names of the referenced type
+    result = []
+    for key in keys:
+        option = value.get(key) if isinstance(value, dict) else None
+        if isinstance(option, dict) and option.get('value') not in (None, ''):
+            result.append(option['value'])
+        else:
+            result.append(names.get(key, key))
+    return result
+
+
+def exportValue(field, obj, names):
+    # names maps the UUIDs of the objects of field.ref to their names
+    current = HaproxySchema.currentValue(field, obj)
+    value = obj.get(field.prop)
+    if field.kind == HaproxySchema.BOOLEAN:
+        return boolean(current) if current != '' else field.default
+    if field.kind in HaproxySchema.MULTISELECT_KINDS:
+        return optionNames(value, current, names) if field.ref is not None else current
+    if field.kind == HaproxySchema.SELECT and field.ref is not None and current != '':
+        return optionNames(value, [current], names)[0]
+    return current
+
+
+def exportObject(objecttype, obj, names, include_secrets=False, include_defaults=False):
+    # One item of the role variables for an object as returned by the API.
+    # names maps objecttype => UUID => name, for references the option dicts don't name.
+    item = OrderedDict()
+    typeitem = None
+    if objecttype == 'action':
+        typeitem = {'type': HaproxySchema.currentValue(HaproxySchema.Field('type', kind=HaproxySchema.SELECT), obj)}
+    parts = OrderedDict()
+    for field in HaproxySchema.getFields(objecttype, typeitem):
+        if field.key in item or (field.secret and not include_secrets):
+            continue
+        value = exportValue(field, obj, names.get(field.ref, {}))
+        if field.part is not None:
+            # 'first::second' values are stored in two properties
+            parts.setdefault(field.key, {})[field.part] = value
+            continue
+        # Values equal to the default of the role are left out, the role fills them in again
+        if not include_defaults and not field.required and value == HaproxySchema.defaultValue(field, item):
+            continue
+        item[field.key] = value
+    for key, values in parts.items():
+        item[key] = '::'.join(values[part] for part in sorted(values))
+    return item
+
+
+def referencedTypes(objecttypes):
+    types = set()
+    for objecttype in objecttypes:
+        fields = HaproxySchema.FIELDS[objecttype]
+        if objecttype == 'action':
+            fields = fields + HaproxySchema.actionValueFields('use_backend')
+        types.update(field.ref for field in fields if field.ref not in (None, 'ssl'))
+    return types
+
+
+def export(apiconnection, objecttypes, include_secrets=False, include_defaults=False, snapshot=True):
+    # Returns role variable => name => item for every objecttype.
+    # With snapshot, the whole model is read with a single request (settings/get), otherwise every type is listed
+    # page by page and every object fetched on its own, which needs more requests but holds only one object at a time.
+    if snapshot:
+        apiconnection.loadSnapshot()
+    names = {}
+    for objecttype in sorted(referencedTypes(objecttypes).union(objecttypes)):
+        names[objecttype] = dict((row['uuid'], row['name']) for row in apiconnection.listObjects(objecttype))
+    result = OrderedDict()
+    for objecttype in objecttypes:
+        items = OrderedDict()
+        for uuid, name in sorted(names[objecttype].items(), key=lambda entry: entry[1]):
+            obj = apiconnection.getObjectByUuid(objecttype, uuid)
+            if snapshot:
+                # Converted objects are not needed anymore
+                apiconnection.snapshot[objecttype].pop(uuid, None)
+            items[name] = exportObject(objecttype, obj, names, include_secrets=include_secrets, include_defaults=include_defaults)
+        result[roleVariable(objecttype)] = items
+    return result
@@ -0,0 +1,72 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2019, Markus Joosten https://github.com/mj84
+from __future__ import absolute_import, division, print_function
+
+# Fingerprints of map file contents, so large maps are compared by digest instead of as whole strings.
+# Lines are normalised before hashing: line endings and trailing whitespace are ignored, as are empty lines,
+# which HAProxy skips anyway. With sort, the order of the entries is ignored as well.
+
+import hashlib
+import io
+from collections import Counter
+
+
+def normalizeLines(lines):
+    for line in lines:
+        line = line.rstrip()
+        if line != '':
+            yield line
+
+
+def digestLines(lines, sort=False):
+    # Returns the sha256 hex digest and the number of (normalised) lines
+    lines = normalizeLines(lines)
+    if sort:
+        lines = sorted(lines)
+    digest = hashlib.sha256()
+    count = 0
+    for line in lines:
+        digest.update(line.encode('utf-8') + b'\n')
+        count += 1
+    return digest.hexdigest(), count
+
+
+def contentDigest(content, sort=False):
+    return digestLines(io.StringIO(content or u''), sort=sort)
+
+
+def fileDigest(path, sort=False):
+    # Reads the file line by line, without sort only one line is held in memory
+    with io.open(path, encoding='utf-8') as f:
+        return digestLines(f, sort=sort)
+
+
+def readFile(path):
+    with io.open(path, encoding='utf-8') as f:
+        return f.read()
+
+
+def diffLines(before, after, limit=100):
+    # Lines only in after (added) and only in before (removed), duplicates are counted.
+    # The lists are cut at limit lines, the counts are complete.
+    remaining = Counter(normalizeLines(io.StringIO(before or u'')))
+    added = []
+    added_count = 0
+    for line in normalizeLines(io.StringIO(after or u'')):
+        if remaining[line] > 0:
+            remaining[line] -= 1
+        else:
+            added_count += 1
+            if len(added) < limit:
+                added.append(line)
+    removed = []
+    removed_count = 0
+    for line in normalizeLines(io.StringIO(before or u'')):
+        if remaining[line] > 0:
+            remaining[line] -= 1
+            removed_count += 1
+            if len(removed) < limit:
+                removed.append(line)
+    return {'added': added_count, 'removed': removed_count, 'added_lines': added, 'removed_lines': removed}
@@ -0,0 +1,125 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2019, Markus Joosten https://github.com/mj84
+from __future__ import absolute_import, division, print_function
+
+# Indexes for the option dicts of the OPNsense API.
+# An option dict maps keys (UUIDs for references) to {'value': <name>, 'selected': 0|1},
+# e.g. the linkedServers of a backend. Looking up names by scanning the whole dict for every name
+# gets slow with hundreds of options and names, so every option dict is indexed once in both directions.
+
+
+def isSelected(option):
+    # The API reports selected options as 1, '1' or True
+    return isinstance(option, dict) and str(option.get('selected', 0)) in ('1', 'True')
+
+
+class OptionIndex:
+    def __init__(self, options, prop='option', refresh=None):
+        # prop is only used in error messages.
+        # refresh returns newer options (or None), it is called once when a value is missing,
+        # e.g. to fetch a template again which came from a cache and misses a recently created object.
+        self.prop = prop
+        self.refresh = refresh
+        self.index(options)
+
+    def index(self, options):
+        self.keybyvalue = {}
+        self.valuebykey = {}
+        self.selected = []
+        # Empty option dicts are sent as JSON lists
+        if not isinstance(options, dict):
+            options = {}
+        for key, option in options.items():
+            if not isinstance(option, dict):
+                continue
+            value = option.get('value')
+            self.valuebykey[key] = value
+            # Like a linear scan, the first key with a value wins
+            if value not in self.keybyvalue:
+                self.keybyvalue[value] = key
+            if isSelected(option):
+                self.selected.append(key)
+
+    def refreshMissing(self, values):
+        # Refresh the options once if any of values is missing
+        if self.refresh is None or all(value in self.keybyvalue for value in values):
+            return
+        refresh = self.refresh
+        self.refresh = None
+        options = refresh()
+        if options is not None:
+            self.index(options)
+
+    def __contains__(self, value):
+        self.refreshMissing([value])
+        return value in self.keybyvalue
+
+    def __len__(self):
+        return len(self.valuebykey)
+
+    def hasKey(self, key):
+        return key in self.valuebykey
+
+    def key(self, value):
+        self.refreshMissing([value])
+        if value not in self.keybyvalue:
+            raise KeyError('Unknown %s: %s' %(self.prop, value))
+        return self.keybyvalue[value]
+
+    def keys(self, values):
+        # Keys of all values in their order, every unknown value is reported at once
+        self.refreshMissing(values)
+        unknown = [value for value in values if value not in self.keybyvalue]
+        if unknown:
+            raise KeyError('Unknown %s: %s' %(self.prop, ', '.join(str(value) for value in unknown)))
+        return [self.keybyvalue[value] for value in values]
+
+    def value(self, key):
+        if key not in self.valuebykey:
+            raise KeyError('Unknown %s key: %s' %(self.prop, key))
+        return self.valuebykey[key]
+
+    def values(self, keys):
+        return [self.value(key) for key in keys]
+
+    def selectedKeys(self):
+        return list(self.selected)
+
+    def selectedValues(self):
+        return [self.valuebykey[key] for key in self.selected]
+
+
+class TemplateIndex:
+    # The option dicts of one template (an empty object, see OpnsenseApi.Haproxy.getTemplate),
+    # each indexed on first use and reused for every item resolved against the template.
+    # refresh returns a newer template (or None), it is called at most once, on the first name missing from an option dict.
+    def __init__(self, template, refresh=None):
+        self.template = template if template is not None else {}
+        self.indexes = {}
+        self.refresh = refresh
+
+    def get(self, prop, default=None):
+        return self.template.get(prop, default)
+
+    def refreshOptions(self, prop):
+        if self.refresh is None:
+            return None
+        refresh = self.refresh
+        self.refresh = None
+        template = refresh()
+        if template is None:
+            return None
+        # Indexes of the old template are dropped, the one asking is rebuilt by itself
+        self.template = template
+        self.indexes = dict((key, index) for key, index in self.indexes.items() if key == prop)
+        return template.get(prop)
+
+    def options(self, prop):
+        if prop not in self.indexes:
+            refresh = None
+            if self.refresh is not None:
+                refresh = lambda: self.refreshOptions(prop)
+            self.indexes[prop] = OptionIndex(self.template.get(prop), prop, refresh)
+        return self.indexes[prop]
@@ -0,0 +1,137 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2019, Markus Joosten https://github.com/mj84
+from __future__ import absolute_import, division, print_function
+
+# Plans for the whole role: the firewall state is read once (settings/get), all role variables are diffed against it
+# in memory (HaproxySchedule in check mode) and the resulting creates, updates and deletes are written to a plan.
+# Applying a plan converges exactly the planned objects, as long as the firewall state did not change since planning.
+# The plan holds a digest of the role variables of every planned object instead of the variables themselves,
+# so secrets (e.g. user passwords) never end up in the file, applying reads them from the variables again.
+
+import hashlib
+import json
+import os
+import tempfile
+import time
+from collections import OrderedDict
+
+from ansible.module_utils.opnsense_utils import HaproxyMapfile
+from ansible.module_utils.opnsense_utils import HaproxySchedule
+from ansible.module_utils.opnsense_utils import HaproxySchema
+from ansible.module_utils.opnsense_utils import HaproxyValidate
+
+PLAN_VERSION = 2
+# Planned deletions need no variables, objects removed by purge have none
+ABSENT = {'state': 'absent'}
+
+
+def stateDigest(apiconnection):
+    # Fingerprint of the snapshot loaded by apiconnection.loadSnapshot, used to detect stale plans
+    state = json.dumps(apiconnection.snapshot, sort_keys=True)
+    return hashlib.sha256(state.encode('utf-8')).hexdigest()
+
+
+def itemDigest(objecttype, item):
+    # Fingerprint of one item of the role variables, including the files named by it (e.g. src of map files)
+    data = {'item': item}
+    for field in HaproxySchema.getFields(objecttype, item):
+        if field.source is not None and item.get(field.source):
+            try:
+                data[field.source] = HaproxyMapfile.fileDigest(item[field.source])[0]
+            except (IOError, OSError, UnicodeDecodeError):
+                data[field.source] = None
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def makePlan(apiconnection, objects, purge=False, max_workers=4):
+    apiconnection.loadSnapshot()
+    digest = stateDigest(apiconnection)
+    summary = OrderedDict([('create', 0), ('update', 0), ('delete', 0), ('failed', 0)])
+    # One entry per object which has to be changed, in the order they will be applied
+    changes = []
+    # A plan with broken references can't be applied, it reports all of them instead of the changes
+    problems = HaproxyValidate.validate(apiconnection, objects, purge=purge)
+    summary['failed'] = len(problems)
+    if not problems:
+        scheduler = HaproxySchedule.Scheduler(apiconnection, check_mode=True, max_workers=max_workers)
+        results, schedule = scheduler.converge(objects, purge=purge)
+        for phase in ('converge', 'delete'):
+            for layer in schedule[phase]:
+                for objecttype, names in layer.items():
+                    for name in names:
+                        result = results[objecttype][name]
+                        if result['action'] == 'none':
+                            continue
+                        entry = OrderedDict([('objecttype', objecttype), ('name', name)])
+                        entry.update(result)
+                        changes.append(entry)
+                        summary[result['action']] += 1
+    # The digests of the role variables of the changed objects, applyPlan sends exactly these variables
+    planned = OrderedDict()
+    for entry in changes:
+        if entry['action'] == 'delete':
+            item = ABSENT
+        else:
+            item = objects[entry['objecttype']][entry['name']] or {}
+        planned.setdefault(entry['objecttype'], OrderedDict())[entry['name']] = itemDigest(entry['objecttype'], item)
+    return OrderedDict([
+        ('version', PLAN_VERSION),
+        ('api_url', apiconnection.url),
+        ('created', time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())),
+        ('state_digest', digest),
+        ('summary', summary),
+        ('changes', changes),
+        ('problems', problems),
+        ('objects', planned),
+    ])
+
+
+def plannedItems(plan, objects):
+    # The role variables of the planned objects, as long as they are the ones the plan was made from
+    items = OrderedDict()
+    for objecttype, digests in plan['objects'].items():
+        for name, digest in digests.items():
+            item = (objects.get(objecttype) or {}).get(name)
+            if digest == itemDigest(objecttype, ABSENT):
+                item = ABSENT
+            elif item is None or itemDigest(objecttype, item or {}) != digest:
+                raise ValueError('The variables of %s %s changed since the plan was made, plan again' %(objecttype, name))
+            items.setdefault(objecttype, OrderedDict())[name] = item or {}
+    return items
+
+
+def applyPlan(apiconnection, plan, objects, force=False, max_workers=4):
+    # objects are the role variables the plan was made from.
+    # Returns the results and the schedule like HaproxySchedule.Scheduler.converge
+    if plan.get('version') != PLAN_VERSION:
+        raise ValueError('Unsupported plan version %s' % plan.get('version'))
+    if plan['summary'].get('failed'):
+        raise ValueError('The plan contains %d failed objects' % plan['summary']['failed'])
+    if plan['api_url'] != apiconnection.url:
+        raise ValueError('The plan was made for %s, not for %s' %(plan['api_url'], apiconnection.url))
+    items = plannedItems(plan, objects)
+    apiconnection.loadSnapshot()
+    if not force and stateDigest(apiconnection) != plan['state_digest']:
+        raise ValueError('The HAProxy configuration changed since the plan was made, plan again')
+    scheduler = HaproxySchedule.Scheduler(apiconnection, max_workers=max_workers)
+    # Deletions are explicit in the plan, purge must not find anything else to delete
+    return scheduler.converge(items, purge=False)
+
+
+def writePlan(plan, path):
+    # mkstemp creates the file readable by its owner only, the rename replaces an older plan at once
+    fd, temppath = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix='.opnsense_haproxy_plan_')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(plan, f, indent=2)
+        os.rename(temppath, path)
+    except (IOError, OSError):
+        os.remove(temppath)
+        raise
+
+
+def readPlan(path):
+    with open(path) as f:
+        return json.load(f, object_pairs_hook=OrderedDict)
@@ -0,0 +1,118 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2019, Markus Joosten https://github.com/mj84
+from __future__ import absolute_import, division, print_function
+
+# Server pools: many servers which only differ in name and address, expanded from a name pattern
+# and a list of addresses or CIDR ranges into the items of HaproxyReconcile.
+
+import re
+import string
+from collections import OrderedDict
+
+try:
+    import ipaddress
+    HAS_IPADDRESS = True
+except ImportError:
+    # Python 2 without the ipaddress backport, only plain addresses can be given
+    HAS_IPADDRESS = False
+
+
+def expandAddresses(addresses):
+    # Addresses and CIDR ranges (e.g. 10.0.1.0/28, all usable host addresses) in the given order, without duplicates
+    expanded = OrderedDict()
+    for address in addresses:
+        address = str(address).strip()
+        if '/' in address:
+            if not HAS_IPADDRESS:
+                raise ValueError('Expanding the CIDR range %s requires the python ipaddress module' % address)
+            try:
+                network = ipaddress.ip_network(u'%s' % address, strict=False)
+            except ValueError as e:
+                raise ValueError('Invalid CIDR range %s: %s' %(address, e))
+            hosts = list(network.hosts()) or [network.network_address]
+            for host in hosts:
+                expanded[str(host)] = True
+        elif address != '':
+            expanded[address] = True
+    return list(expanded)
+
+
+def serverName(pattern, index, address):
+    # {index} counts from 1, {address} is the address with dots and colons replaced by dashes
+    try:
+        return pattern.format(index=index, address=address.replace('.', '-').replace(':', '-'))
+    except (KeyError, IndexError, ValueError) as e:
+        raise ValueError('Invalid name pattern %s: %s' %(pattern, e))
+
+
+# Addresses as serverName encodes them: IPv4 with dashes instead of dots, IPv6 with dashes instead of colons
+ENCODED_IPV4 = '[0-9]{1,3}(?:-[0-9]{1,3}){3}'
+ENCODED_IPV6 = '[0-9a-fA-F]{0,4}(?:-[0-9a-fA-F]{0,4}){2,7}'
+
+
+def patternRegex(pattern):
+    # Matches every name the pattern can produce, to find pool members which are no longer wanted.
+    # The first {index} and {address} are captured, repeated ones have to be the same.
+    regex = ''
+    for literal, field, spec, conversion in string.Formatter().parse(pattern):
+        regex += re.escape(literal)
+        if field is None:
+            continue
+        if field in ('index', 'address') and '(?P<%s>' % field in regex:
+            regex += '(?P=%s)' % field
+        elif field == 'index':
+            regex += '(?P<index>[0-9]+)'
+        elif field == 'address':
+            regex += '(?P<address>%s|%s)' %(ENCODED_IPV4, ENCODED_IPV6)
+        else:
+            raise ValueError('Invalid name pattern %s: unknown field %s' %(pattern, field))
+    return re.compile('^%s$' % regex)
+
+
+def isEncodedAddress(encoded):
+    # True if encoded is an address encoded by serverName, e.g. 10-0-1-5 or 2001-db8--1
+    if not HAS_IPADDRESS:
+        return True
+    for address in (encoded.replace('-', '.'), encoded.replace('-', ':')):
+        try:
+            ipaddress.ip_address(u'%s' % address)
+            return True
+        except ValueError:
+            pass
+    return False
+
+
+def matchesPattern(regex, name):
+    match = regex.match(name)
+    if match is None:
+        return False
+    return 'address' not in match.groupdict() or isEncodedAddress(match.group('address'))
+
+
+def poolItems(pattern, addresses, port, properties=None):
+    # name => server item (role variable shape) for every address
+    items = OrderedDict()
+    for index, address in enumerate(expandAddresses(addresses), 1):
+        item = dict(properties or {})
+        item['address'] = address
+        item['port'] = str(port)
+        name = serverName(pattern, index, address)
+        if name in items:
+            raise ValueError('The name pattern %s produces the name %s more than once' %(pattern, name))
+        items[name] = item
+    return items
+
+
+def candidates(pattern, existing, items):
+    # Names of existing servers which the pattern could have produced but which are not part of the pool anymore
+    regex = patternRegex(pattern)
+    return [name for name in existing if name not in items and matchesPattern(regex, name)]
+
+
+def obsoleteMembers(pattern, existing, items, members):
+    # Existing servers (name => uuid) which are not part of the pool anymore: the pattern could have produced
+    # their name and they are known pool members (uuid in members, e.g. linked to the pool's backend).
+    # A server with a fitting name alone is never deleted, it may belong to something else.
+    return [name for name in candidates(pattern, existing, items) if existing[name] in members]
@@ -0,0 +1,135 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2019, Markus Joosten https://github.com/mj84
+from __future__ import absolute_import, division, print_function
+
+# Converges all objects of one type in a single pass:
+# the current objects are listed once, creates, updates and deletes are computed in memory
+# and only the necessary API calls are sent.
+
+from collections import OrderedDict
+
+from ansible.module_utils.opnsense_utils import HaproxyDiff
+from ansible.module_utils.opnsense_utils import HaproxyOptions
+from ansible.module_utils.opnsense_utils import HaproxySchema
+
+
+class Reconciler:
+    def __init__(self, apiconnection, check_mode=False, max_workers=8, pending=None):
+        self.apiconnection = apiconnection
+        self.check_mode = check_mode
+        self.max_workers = max_workers
+        # objecttype => names of objects which a check mode run would have created,
+        # references to them resolve to a placeholder instead of failing
+        self.pending = pending if pending is not None else {}
+
+    def getTemplate(self, objecttype):
+        # An empty object contains the option dicts needed to resolve referenced names to UUIDs,
+        # it is fetched again on the first missing name (see OpnsenseApi.Haproxy.refreshTemplate)
+        def refresh():
+            template = self.apiconnection.refreshTemplate(objecttype)
+            return self.addPending(objecttype, template) if template is not None else None
+        return HaproxyOptions.TemplateIndex(self.addPending(objecttype, self.apiconnection.getTemplate(objecttype)), refresh)
+
+    def addPending(self, objecttype, template):
+        # Objects a check mode run would have created are listed under a placeholder key
+        fields = HaproxySchema.FIELDS[objecttype]
+        if objecttype == 'action':
+            fields = fields + HaproxySchema.actionValueFields('use_backend')
+        for field in fields:
+            if field.ref in self.pending and self.pending[field.ref]:
+                options = template.get(field.prop)
+                options = OrderedDict(options) if isinstance(options, dict) else OrderedDict()
+                for name in self.pending[field.ref]:
+                    options[placeholder(name)] = {'value': name, 'selected': 0}
+                template[field.prop] = options
+        return template
+
+    def reconcile(self, objecttype, items, purge=False):
+        # items is a dict of name => properties, shaped like the opnsense_haproxy_* role variables
+        rows = self.apiconnection.listObjects(objecttype)
+        existing = OrderedDict((row['name'], row['uuid']) for row in rows)
+        template = None
+        if HaproxySchema.hasReferences(objecttype):
+            template = self.getTemplate(objecttype)
+        # Fetch all existing objects which have to be compared in parallel
+        uuids = [existing[name] for name, item in items.items()
+                 if name in existing and (item or {}).get('state', 'present') != 'absent']
+        objects, errors = self.apiconnection.getObjectsByUuids(objecttype, uuids, max_workers=self.max_workers)
+        current = dict(zip(uuids, objects))
+        results = OrderedDict()
+        for name, item in items.items():
+            item = item or {}
+            try:
+                if item.get('state', 'present') == 'absent':
+                    results[name] = self.deleteItem(objecttype, name, existing)
+                elif name in existing and existing[name] in errors:
+                    results[name] = {'action': 'failed', 'msg': errors[existing[name]]}
+                elif name in existing:
+                    results[name] = self.updateItem(objecttype, name, item, current[existing[name]], template)
+                else:
+                    results[name] = self.createItem(objecttype, name, item, template)
+            except (KeyError, ValueError) as e:
+                results[name] = {'action': 'failed', 'msg': str(e)}
+        if purge:
+            for name in existing:
+                if name not in items:
+                    try:
+                        results[name] = self.deleteItem(objecttype, name, existing)
+                    except (KeyError, ValueError) as e:
+                        results[name] = {'action': 'failed', 'msg': str(e)}
+        return results
+
+    def createItem(self, objecttype, name, item, template):
+        desired = HaproxySchema.buildProperties(objecttype, item, template)
+        # Field level changes of a new object, compared against an empty one
+        changes = HaproxyDiff.diffObject(objecttype, {}, desired, item)[1]
+        if not self.check_mode:
+            self.apiconnection.createObject(objecttype, name, desired)
+        return {'action': 'create', 'changes': changes}
+
+    def updateItem(self, objecttype, name, item, current, template):
+        desired = HaproxySchema.buildProperties(objecttype, item, template)
+        changed_properties, changes = HaproxyDiff.diffObject(objecttype, current, desired, item)
+        if not changes:
+            return {'action': 'none'}
+        reload = HaproxyDiff.reloadImpact(objecttype, changes, item)
+        if not self.check_mode:
+            for prop in HaproxySchema.ALWAYS_SEND.get(objecttype, []):
+                changed_properties[prop] = desired[prop]
+            self.apiconnection.updateObject(objecttype, name, changed_properties, reload=reload['required'])
+        return {'action': 'update', 'changes': changes, 'reload': reload}
+
+    def deleteItem(self, objecttype, name, existing):
+        if name not in existing:
+            return {'action': 'none'}
+        if not self.check_mode:
+            self.apiconnection.deleteObject(objecttype, name)
+        return {'action': 'delete'}
+
+
+def placeholder(name):
+    # Stands in for the UUID of an object which is not created yet
+    return '<new %s>' % name
+
+
+def isChanged(results):
+    for result in results.values():
+        if result['action'] in ('create', 'update', 'delete'):
+            return True
+    return False
+
+
+def needsReload(results):
+    # Creates and deletes always need a reload, updates depending on the impact of their changes
+    for result in results.values():
+        if result['action'] in ('create', 'delete'):
+            return True
+        if result['action'] == 'update' and result['reload']['required']:
+            return True
+    return False
+
+
+def failedItems(results):
+    return [name for name, result in results.items() if result['action'] == 'failed']
@@ -0,0 +1,167 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2019, Markus Joosten https://github.com/mj84
+from __future__ import absolute_import, division, print_function
+
+# Client for the runtime API of HAProxy (the stats socket), to change the weight and state of servers
+# of the running HAProxy without configtest and reconfigure.
+# On Opnsense the socket is /var/run/haproxy.socket, use it when running on the firewall
+# or forward it to a TCP port (e.g. with socat) and use host:port.
+
+import socket
+
+from ansible.module_utils.opnsense_utils import HaproxyDiff
+from ansible.module_utils.opnsense_utils import HaproxySchema
+
+# Bits of srv_admin_state in "show servers state": forced, inherited, configured, resolver and DNS maintenance
+ADMIN_MAINT = 0x01 | 0x02 | 0x04 | 0x20 | 0x40
+# Forced and inherited drain
+ADMIN_DRAIN = 0x08 | 0x10
+# Columns of "show servers state" (format version 1) if the header is missing
+STATE_COLUMNS = ['be_id', 'be_name', 'srv_id', 'srv_name', 'srv_addr', 'srv_op_state', 'srv_admin_state', 'srv_uweight', 'srv_iweight']
+# Modes which can be switched at runtime, backup servers need a reload
+RUNTIME_MODES = ('active', 'disabled')
+
+
+def adminState(admin):
+    # ready, drain or maint for the srv_admin_state bit field
+    admin = int(admin)
+    if admin & ADMIN_MAINT:
+        return 'maint'
+    if admin & ADMIN_DRAIN:
+        return 'drain'
+    return 'ready'
+
+
+def desiredState(mode, drain=False, enabled=True):
+    if not enabled or mode == 'disabled':
+        return 'maint'
+    return 'drain' if drain else 'ready'
+
+
+def desiredWeight(weight):
+    # Servers without weight have the HAProxy default weight of 1
+    return int(weight) if str(weight) != '' else 1
+
+
+def isRuntimeChange(current, changed_properties):
+    # True if all changed properties of a server are cosmetic or can be applied at runtime (see HaproxySchema.RUNTIME)
+    fields = HaproxyDiff.getFieldsByProp('server')
+    for prop in changed_properties:
+        if prop not in fields or fields[prop].impact == HaproxySchema.CONFIG:
+            return False
+    if 'mode' in changed_properties:
+        mode = HaproxySchema.currentValue(fields['mode'], current)
+        if mode not in RUNTIME_MODES or changed_properties['mode'] not in RUNTIME_MODES:
+            return False
+    return True
+
+
+def linkedBackends(apiconnection, uuid):
+    # Names of the enabled backends linking the server, disabled backends are not part of the running HAProxy
+    fields = HaproxyDiff.getFieldsByProp('backend')
+    # One settings/get instead of one request per backend
+    if apiconnection.snapshot is None:
+        apiconnection.loadSnapshot()
+    backends = []
+    for row in apiconnection.listObjects('backend'):
+        backend = apiconnection.getObjectByUuid('backend', row['uuid'])
+        if uuid in HaproxySchema.currentValue(fields['linkedServers'], backend) \
+                and HaproxySchema.currentValue(fields['enabled'], backend) != '0':
+            backends.append(row['name'])
+    return backends
+
+
+class RuntimeApi:
+    def __init__(self, address, timeout=10):
+        # address is the path of a unix socket or host:port
+        self.address = address
+        self.timeout = timeout
+        self.connections = 0
+        self.commands = 0
+        if not address.startswith('/'):
+            host, sep, port = address.rpartition(':')
+            if not sep or not port.isdigit():
+                raise ValueError('Invalid runtime socket %s, expected a path or host:port' % address)
+            self.hostport = (host.strip('[]'), int(port))
+
+    def connect(self):
+        try:
+            if self.address.startswith('/'):
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                sock.settimeout(self.timeout)
+                sock.connect(self.address)
+            else:
+                sock = socket.create_connection(self.hostport, timeout=self.timeout)
+        except (socket.error, OSError) as e:
+            raise ValueError('Failed to connect to the HAProxy runtime socket %s: %s' %(self.address, e))
+        self.connections += 1
+        return sock
+
+    def execute(self, commands):
+        # HAProxy runs all commands of one line (separated by ;) and closes the connection after the output
+        sock = self.connect()
+        try:
+            sock.sendall((';'.join(commands) + '\n').encode('utf-8'))
+            self.commands += len(commands)
+            output = []
+            while True:
+                data = sock.recv(65536)
+                if not data:
+                    break
+                output.append(data)
+        except (socket.error, OSError) as e:
+            raise ValueError('HAProxy runtime socket %s: %s' %(self.address, e))
+        finally:
+            sock.close()
+        return b''.join(output).decode('utf-8', 'replace')
+
+    def serverStates(self, backend):
+        # server name => {'weight': <user weight>, 'state': ready|drain|maint} of one backend
+        output = self.execute(['show servers state %s' % backend])
+        lines = [line for line in output.splitlines() if line.strip() != '']
+        if not lines or not lines[0].strip().isdigit():
+            raise ValueError('Failed to read the servers of backend %s: %s' %(backend, output.strip()))
+        columns = STATE_COLUMNS
+        states = {}
+        for line in lines[1:]:
+            if line.startswith('#'):
+                columns = line[1:].split()
+                continue
+            values = dict(zip(columns, line.split()))
+            states[values['srv_name']] = {'weight': int(values['srv_uweight']), 'state': adminState(values['srv_admin_state'])}
+        return states
+
+    def setServer(self, backend, server, weight=None, state=None):
+        commands = []
+        if weight is not None:
+            commands.append('set server %s/%s weight %s' %(backend, server, weight))
+        if state is not None:
+            commands.append('set server %s/%s state %s' %(backend, server, state))
+        output = self.execute(commands).strip()
+        # Successful set commands don't print anything
+        if output != '':
+            raise ValueError('Failed to set server %s/%s: %s' %(backend, server, output))
+
+    def convergeServer(self, backend, server, weight, state, check_mode=False):
+        # Returns the change made to the running server, None if it was already in the desired state
+        states = self.serverStates(backend)
+        if server not in states:
+            raise ValueError('Server %s is not part of the running backend %s, a reload is required' %(server, backend))
+        current = states[server]
+        change = {'backend': backend, 'server': server}
+        if current['weight'] != weight:
+            change['weight'] = {'before': current['weight'], 'after': weight}
+        if current['state'] != state:
+            change['state'] = {'before': current['state'], 'after': state}
+        if len(change) == 2:
+            return None
+        if not check_mode:
+            self.setServer(backend, server,
+                           weight=weight if 'weight' in change else None,
+                           state=state if 'state' in change else None)
+        return change
+
+    def getStats(self):
+        return {'connections': self.connections, 'commands': self.commands}
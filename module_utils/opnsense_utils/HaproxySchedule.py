@@ -0,0 +1,178 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2019, Markus Joosten https://github.com/mj84
+from __future__ import absolute_import, division, print_function
+
+# Converges all object types at once, ordered by the references between the objects instead of a fixed type order.
+# Every object only waits for the objects it references (e.g. an action for its ACLs and its backend),
+# the objects of one layer are converged concurrently, one thread per object type.
+# Deletions run afterwards in reverse order, so no object is deleted while another one still references it.
+
+from collections import OrderedDict
+
+from ansible.module_utils.opnsense_utils import HaproxyReconcile
+from ansible.module_utils.opnsense_utils import HaproxySchema
+
+try:
+    from concurrent.futures import ThreadPoolExecutor
+    HAS_FUTURES = True
+except ImportError:
+    # Python 2 without the futures backport, the types of a layer are converged one after another
+    HAS_FUTURES = False
+
+
+def isAbsent(item):
+    return (item or {}).get('state', 'present') == 'absent'
+
+
+def desiredReferences(objecttype, item):
+    # (objecttype, name) of every object referenced by one item of the role variables
+    references = []
+    for field in HaproxySchema.getFields(objecttype, item):
+        if field.ref is None or field.ref == 'ssl' or field.key not in item:
+            continue
+        for name in HaproxySchema.toList(item[field.key]):
+            if name != '' and name != field.null:
+                references.append((field.ref, name))
+    return references
+
+
+def currentReferences(objecttype, obj):
+    # (objecttype, uuid) of every object referenced by an object as returned by the API
+    item = {'type': HaproxySchema.currentValue(HaproxySchema.Field('type', kind=HaproxySchema.SELECT), obj)} if objecttype == 'action' else None
+    references = []
+    for field in HaproxySchema.getFields(objecttype, item):
+        if field.ref is None or field.ref == 'ssl':
+            continue
+        value = HaproxySchema.currentValue(field, obj)
+        for uuid in value if isinstance(value, list) else [value]:
+            if uuid != '':
+                references.append((field.ref, uuid))
+    return references
+
+
+def layers(nodes, edges):
+    # Topological sort into layers: every node only depends on nodes of earlier layers.
+    # edges maps a node to the nodes it depends on, dependencies outside of nodes are ignored.
+    pending = OrderedDict((node, set(dep for dep in edges.get(node, ()) if dep in nodes and dep != node)) for node in nodes)
+    result = []
+    while pending:
+        layer = [node for node, deps in pending.items() if not deps]
+        if not layer:
+            raise ValueError('Circular references between %s' % ', '.join('%s %s' % node for node in pending))
+        for node in layer:
+            del pending[node]
+        for deps in pending.values():
+            deps.difference_update(layer)
+        result.append(layer)
+    return result
+
+
+def groupByType(layer):
+    grouped = OrderedDict()
+    for objecttype, name in layer:
+        grouped.setdefault(objecttype, []).append(name)
+    return grouped
+
+
+class Scheduler:
+    def __init__(self, apiconnection, check_mode=False, max_workers=4):
+        self.apiconnection = apiconnection
+        self.check_mode = check_mode
+        self.max_workers = max_workers
+        # In check mode, objecttype => names of the objects created by earlier layers (see HaproxyReconcile.Reconciler)
+        self.pending = {}
+
+    def planCreates(self, objects):
+        # Layers of (objecttype, name) for all present items, ordered by the references in the role variables
+        nodes = OrderedDict()
+        edges = {}
+        for objecttype, items in objects.items():
+            for name, item in items.items():
+                if not isAbsent(item):
+                    nodes[(objecttype, name)] = True
+                    edges[(objecttype, name)] = desiredReferences(objecttype, item or {})
+        return layers(nodes, edges)
+
+    def planDeletes(self, objects, purge=False):
+        # Layers of (objecttype, name) for all objects to be deleted, ordered by the references of the current objects:
+        # an object is only deleted after every other object to be deleted which references it
+        byuuid = {}
+        nodes = OrderedDict()
+        for objecttype, items in objects.items():
+            for row in self.apiconnection.listObjects(objecttype):
+                byuuid[(objecttype, row['uuid'])] = (objecttype, row['name'])
+                if row['name'] in items:
+                    delete = isAbsent(items[row['name']])
+                else:
+                    delete = purge
+                if delete:
+                    nodes[(objecttype, row['name'])] = row['uuid']
+        # The referenced objects have to be deleted last, so the edges point from referenced to referencing objects
+        edges = {}
+        for (objecttype, name), uuid in nodes.items():
+            obj = self.apiconnection.getObjectByUuid(objecttype, uuid)
+            for reference in currentReferences(objecttype, obj):
+                if reference in byuuid:
+                    edges.setdefault(byuuid[reference], []).append((objecttype, name))
+        return layers(nodes, edges)
+
+    def convergeType(self, objecttype, items):
+        reconciler = HaproxyReconcile.Reconciler(self.apiconnection, check_mode=self.check_mode, pending=self.pending)
+        return reconciler.reconcile(objecttype, items)
+
+    def deleteType(self, objecttype, names):
+        reconciler = HaproxyReconcile.Reconciler(self.apiconnection, check_mode=self.check_mode)
+        existing = OrderedDict((row['name'], row['uuid']) for row in self.apiconnection.listObjects(objecttype))
+        results = OrderedDict()
+        for name in names:
+            try:
+                results[name] = reconciler.deleteItem(objecttype, name, existing)
+            except (KeyError, ValueError) as e:
+                results[name] = {'action': 'failed', 'msg': str(e)}
+        return results
+
+    def runLayer(self, work):
+        # work is a list of (objecttype, function, argument), one entry per object type of the layer
+        if not HAS_FUTURES or self.max_workers <= 1 or len(work) == 1:
+            return [(objecttype, function(objecttype, argument)) for objecttype, function, argument in work]
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(work))) as executor:
+            futures = [(objecttype, executor.submit(function, objecttype, argument)) for objecttype, function, argument in work]
+            return [(objecttype, future.result()) for objecttype, future in futures]
+
+    def converge(self, objects, purge=False):
+        # objects maps objecttype => dict of name => properties, shaped like the opnsense_haproxy_* role variables.
+        # Returns the results per objecttype and name (see HaproxyReconcile) and the executed layers.
+        for objecttype in objects:
+            if objecttype not in HaproxySchema.FIELDS:
+                raise KeyError('Objecttype %s not supported!' % objecttype)
+        results = OrderedDict((objecttype, OrderedDict()) for objecttype in objects)
+        schedule = {'converge': [], 'delete': []}
+        for layer in self.planCreates(objects):
+            work = []
+            for objecttype, names in groupByType(layer).items():
+                work.append((objecttype, self.convergeType, OrderedDict((name, objects[objecttype][name] or {}) for name in names)))
+            schedule['converge'].append(OrderedDict((objecttype, list(items)) for objecttype, function, items in work))
+            for objecttype, typeresults in self.runLayer(work):
+                results[objecttype].update(typeresults)
+                if self.check_mode:
+                    self.pending.setdefault(objecttype, []).extend(name for name, result in typeresults.items() if result['action'] == 'create')
+            # Objects referencing a failed object would fail as well, stop before writing them
+            if self.hasFailed(results):
+                return results, schedule
+        # Deletions are planned after all updates, which may have removed references to the deleted objects
+        for layer in self.planDeletes(objects, purge=purge):
+            work = [(objecttype, self.deleteType, names) for objecttype, names in groupByType(layer).items()]
+            schedule['delete'].append(OrderedDict((objecttype, names) for objecttype, function, names in work))
+            for objecttype, typeresults in self.runLayer(work):
+                results[objecttype].update(typeresults)
+            if self.hasFailed(results):
+                break
+        return results, schedule
+
+    def hasFailed(self, results):
+        for typeresults in results.values():
+            if HaproxyReconcile.failedItems(typeresults):
+                return True
+        return False
@@ -0,0 +1,484 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2019, Markus Joosten https://github.com/mj84
+from __future__ import absolute_import, division, print_function
+
+# Field definitions for every HAProxy object type.
+# Each field maps a key of the role variables (e.g. opnsense_haproxy_backends.<name>.linked_servers)
+# to the property used by the OPNsense API (e.g. linkedServers) and describes how its value is stored.
+
+from ansible.module_utils.parsing.convert_bool import boolean
+
+from ansible.module_utils.opnsense_utils import HaproxyMapfile
+from ansible.module_utils.opnsense_utils import HaproxyOptions
+
+# Plain string value
+SIMPLE = 'simple'
+# Boolean stored as '0' or '1'
+BOOLEAN = 'boolean'
+# Option dict with a single selected key
+SELECT = 'select'
+# Option dict with any number of selected keys, order does not matter
+MULTISELECT = 'multiselect'
+# Option dict with any number of selected keys, order matters
+ORDERED_MULTISELECT = 'ordered_multiselect'
+
+# Long text of lines (map files) compared and reported by digest (see HaproxyMapfile),
+# with 'sort: true' in the item the order of the lines is ignored
+DIGEST = 'digest'
+
+MULTISELECT_KINDS = (MULTISELECT, ORDERED_MULTISELECT)
+
+# What a changed field needs to reach the running HAProxy:
+# Not part of the generated haproxy.conf (e.g. descriptions), nothing
+COSMETIC = 'cosmetic'
+# Can be applied to the running HAProxy through the runtime API (see HaproxyRuntime), otherwise a reload
+RUNTIME = 'runtime'
+# configtest and reconfigure
+CONFIG = 'config'
+# Ordered from the least to the most disruptive impact
+IMPACTS = (COSMETIC, RUNTIME, CONFIG)
+
+
+class Field:
+    def __init__(self, key, prop=None, kind=SIMPLE, default='', ref=None, when=(), required=False, secret=False, null=None, part=None, impact=CONFIG,
+                 fallback=(), source=None):
+        # key of the role variable
+        self.key = key
+        # property name in the OPNsense API
+        self.prop = prop if prop is not None else key
+        self.kind = kind
+        self.default = default
+        # objecttype (or 'ssl') referenced by name, resolved to UUIDs through the option dicts of an empty object
+        self.ref = ref
+        # API properties which must be enabled ('1') for this field to be compared
+        self.when = when
+        self.required = required
+        # secret values are never reported back
+        self.secret = secret
+        # value meaning "nothing selected", e.g. 'none' for defaultBackend
+        self.null = null
+        # some API properties are one part of a 'first::second' role value
+        self.part = part
+        # COSMETIC, RUNTIME or CONFIG
+        self.impact = impact
+        # role keys used instead, in this order, when key is missing or empty (same as tasks/items.yml),
+        # e.g. the checkport of a server defaults to its port
+        self.fallback = fallback
+        # role key with the path of a file on the executing node to read the value from instead, e.g. src of map files
+        self.source = source
+
+
+def _comparisonFields(names):
+    fields = []
+    for name in names:
+        fields.append(Field(name + '_comparison', kind=SELECT, default='gt'))
+        fields.append(Field(name))
+    return fields
+
+
+FIELDS = {
+    'acl': [
+        Field('description', impact=COSMETIC),
+        Field('expression', kind=SELECT, required=True),
+        Field('negate', kind=BOOLEAN, default=False),
+        Field('hdr_beg'),
+        Field('hdr_end'),
+        Field('hdr'),
+        Field('hdr_reg'),
+        Field('hdr_sub'),
+        Field('path_beg'),
+        Field('path_end'),
+        Field('path'),
+        Field('path_reg'),
+        Field('path_dir'),
+        Field('path_sub'),
+        Field('url_param'),
+        Field('url_param_value'),
+        Field('ssl_c_verify_code'),
+        Field('ssl_c_ca_commonname'),
+        Field('src'),
+    ] + _comparisonFields([
+        'src_bytes_in_rate',
+        'src_bytes_out_rate',
+        'src_conn_cnt',
+        'src_conn_rate',
+        'src_http_err_cnt',
+        'src_http_err_rate',
+        'src_http_req_rate',
+        'src_kbytes_in',
+        'src_kbytes_out',
+        'src_port',
+        'src_sess_cnt',
+    ]) + [
+        Field('nbsrv'),
+        Field('nbsrv_backend', kind=SELECT, ref='backend'),
+        Field('ssl_fc_sni'),
+        Field('ssl_sni'),
+        Field('ssl_sni_sub'),
+        Field('ssl_sni_beg'),
+        Field('ssl_sni_end'),
+        Field('ssl_sni_reg'),
+        Field('custom_acl'),
+        Field('value'),
+        Field('query_backend', 'queryBackend', kind=SELECT, ref='backend'),
+        Field('allowed_users', 'allowedUsers', kind=MULTISELECT, default=[], ref='user'),
+        Field('allowed_groups', 'allowedGroups', kind=MULTISELECT, default=[], ref='group'),
+    ],
+    'action': [
+        Field('description', impact=COSMETIC),
+        Field('test_type', 'testType', kind=SELECT, default='if'),
+        Field('operator', kind=SELECT, default='and'),
+        Field('type', kind=SELECT, required=True),
+        Field('linked_acls', 'linkedAcls', kind=MULTISELECT, default=[], ref='acl'),
+    ],
+    'backend': [
+        Field('enabled', kind=BOOLEAN, default=True),
+        Field('description', impact=COSMETIC),
+        Field('mode', kind=SELECT, default='http'),
+        Field('algorithm', kind=SELECT, default='source'),
+        Field('proxy_protocol', 'proxyProtocol', kind=SELECT),
+        Field('linked_servers', 'linkedServers', kind=MULTISELECT, default=[], ref='server'),
+        Field('source'),
+        Field('health_check_enabled', 'healthCheckEnabled', kind=BOOLEAN, default=True),
+        Field('health_check', 'healthCheck', kind=SELECT, ref='healthcheck', null='none'),
+        Field('health_check_log_status', 'healthCheckLogStatus', kind=BOOLEAN, default=False),
+        Field('check_interval', 'checkInterval'),
+        Field('check_down_interval', 'checkDownInterval'),
+        Field('health_check_fall', 'healthCheckFall'),
+        Field('health_check_rise', 'healthCheckRise'),
+        Field('persistence', kind=SELECT, default='sticktable'),
+        Field('persistence_cookie_mode', 'persistence_cookiemode', kind=SELECT, default='piggyback'),
+        Field('persistence_cookie_name', 'persistence_cookiename', default='SRVCOOKIE'),
+        Field('persistence_strip_quotes', 'persistence_stripquotes', kind=BOOLEAN, default=True),
+        Field('stickiness_pattern', kind=SELECT, default='sourceipv4'),
+        Field('stickiness_data_types', 'stickiness_dataTypes', kind=MULTISELECT, default=[]),
+        Field('stickiness_expire', default='30m'),
+        Field('stickiness_size', default='50k'),
+        Field('stickiness_cookie_name', 'stickiness_cookiename'),
+        Field('stickiness_cookie_length', 'stickiness_cookielength'),
+        Field('stickiness_conn_rate_period', 'stickiness_connRatePeriod', default='10s'),
+        Field('stickiness_sess_rate_period', 'stickiness_sessRatePeriod', default='10s'),
+        Field('stickiness_http_req_rate_period', 'stickiness_httpReqRatePeriod', default='10s'),
+        Field('stickiness_http_err_rate_period', 'stickiness_httpErrRatePeriod', default='10s'),
+        Field('stickiness_bytes_in_rate_period', 'stickiness_bytesInRatePeriod', default='1m'),
+        Field('stickiness_bytes_out_rate_period', 'stickiness_bytesOutRatePeriod', default='1m'),
+        Field('basic_auth_enabled', 'basicAuthEnabled', kind=BOOLEAN, default=False),
+        Field('basic_auth_users', 'basicAuthUsers', kind=MULTISELECT, default=[], ref='user', when=('basicAuthEnabled',)),
+        Field('basic_auth_groups', 'basicAuthGroups', kind=MULTISELECT, default=[], ref='group', when=('basicAuthEnabled',)),
+        Field('tuning_timeout_connect', 'tuning_timeoutConnect'),
+        Field('tuning_timeout_check', 'tuning_timeoutCheck'),
+        Field('tuning_timeout_server', 'tuning_timeoutServer'),
+        Field('tuning_retries', fallback=('backend_tuning_retries',)),
+        Field('custom_options', 'customOptions'),
+        Field('tuning_default_server', 'tuning_defaultserver'),
+        Field('tuning_no_port', 'tuning_noport', kind=BOOLEAN, default=False),
+        Field('tuning_http_reuse', 'tuning_httpreuse', kind=SELECT, default='never'),
+        Field('linked_actions', 'linkedActions', kind=ORDERED_MULTISELECT, default=[], ref='action'),
+        Field('linked_errorfiles', 'linkedErrorfiles', kind=MULTISELECT, default=[], ref='errorfile'),
+    ],
+    'cpu': [
+        Field('enabled', kind=BOOLEAN, default=True),
+        Field('process_id', kind=SELECT, default='all'),
+        Field('thread_id', kind=SELECT, default='all'),
+        Field('cpu_id', kind=MULTISELECT, default=['all']),
+    ],
+    'errorfile': [
+        Field('code', kind=SELECT, required=True),
+        Field('description', impact=COSMETIC),
+        Field('content'),
+    ],
+    'frontend': [
+        Field('enabled', kind=BOOLEAN, default=True),
+        Field('description', impact=COSMETIC),
+        Field('bind', kind=MULTISELECT, required=True),
+        Field('bind_options', 'bindOptions'),
+        Field('mode', kind=SELECT, default='http'),
+        Field('default_backend', 'defaultBackend', kind=SELECT, default='none', ref='backend', null='none'),
+        Field('ssl_enabled', kind=BOOLEAN, default=False),
+        Field('ssl_certificates', kind=MULTISELECT, default=[], ref='ssl', when=('ssl_enabled',)),
+        Field('ssl_default_certificate', kind=SELECT, ref='ssl', when=('ssl_enabled',)),
+        Field('ssl_custom_options', 'ssl_customOptions', when=('ssl_enabled',)),
+        Field('ssl_advanced_enabled', 'ssl_advancedEnabled', kind=BOOLEAN, default=False, when=('ssl_enabled',)),
+        Field('ssl_bind_options', 'ssl_bindOptions', kind=MULTISELECT, default=[], when=('ssl_enabled', 'ssl_advancedEnabled')),
+        Field('ssl_cipher_list', 'ssl_cipherList', default='ECDHE-ECDSA-AES256-GCM-SHA384:ECDHE-RSA-AES256-GCM-SHA384:ECDHE-ECDSA-CHACHA20-POLY1305:ECDHE-RSA-CHACHA20-POLY1305:ECDHE-ECDSA-AES128-GCM-SHA256:ECDHE-RSA-AES128-GCM-SHA256:ECDHE-ECDSA-AES256-SHA384:ECDHE-RSA-AES256-SHA384:ECDHE-ECDSA-AES128-SHA256:ECDHE-RSA-AES128-SHA256', when=('ssl_enabled', 'ssl_advancedEnabled')),
+        Field('ssl_http2_enabled', 'ssl_http2Enabled', kind=BOOLEAN, default=False, when=('ssl_enabled', 'ssl_advancedEnabled')),
+        Field('ssl_hsts_enabled', 'ssl_hstsEnabled', kind=BOOLEAN, default=True, when=('ssl_enabled', 'ssl_advancedEnabled')),
+        Field('ssl_hsts_include_sub_domains', 'ssl_hstsIncludeSubDomains', kind=BOOLEAN, default=False, when=('ssl_enabled', 'ssl_advancedEnabled')),
+        Field('ssl_hsts_preload', 'ssl_hstsPreload', kind=BOOLEAN, default=False, when=('ssl_enabled', 'ssl_advancedEnabled')),
+        Field('ssl_hsts_max_age', 'ssl_hstsMaxAge', default='15768000', when=('ssl_enabled', 'ssl_advancedEnabled')),
+        Field('ssl_client_auth_enabled', 'ssl_clientAuthEnabled', kind=BOOLEAN, default=False, when=('ssl_enabled',)),
+        Field('ssl_client_auth_verify', 'ssl_clientAuthVerify', kind=SELECT, default='none', when=('ssl_enabled', 'ssl_clientAuthEnabled')),
+        Field('ssl_client_auth_cas', 'ssl_clientAuthCAs', kind=MULTISELECT, default=[], ref='ssl', when=('ssl_enabled', 'ssl_clientAuthEnabled')),
+        Field('ssl_client_auth_crls', 'ssl_clientAuthCRLs', kind=MULTISELECT, default=[], ref='ssl', when=('ssl_enabled', 'ssl_clientAuthEnabled')),
+        Field('basic_auth_enabled', 'basicAuthEnabled', kind=BOOLEAN, default=False),
+        Field('basic_auth_users', 'basicAuthUsers', kind=MULTISELECT, default=[], ref='user', when=('basicAuthEnabled',)),
+        Field('basic_auth_groups', 'basicAuthGroups', kind=MULTISELECT, default=[], ref='group', when=('basicAuthEnabled',)),
+        Field('tuning_max_connections', 'tuning_maxConnections'),
+        Field('tuning_timeout_client', 'tuning_timeoutClient'),
+        Field('tuning_timeout_http_req', 'tuning_timeoutHttpReq'),
+        Field('tuning_timeout_http_keep_alive', 'tuning_timeoutHttpKeepAlive'),
+        Field('linked_cpu_affinity_rules', 'linkedCpuAffinityRules', kind=MULTISELECT, default=[], ref='cpu'),
+        Field('logging_dont_log_null', 'logging_dontLogNull', kind=BOOLEAN, default=False),
+        Field('logging_dont_log_normal', 'logging_dontLogNormal', kind=BOOLEAN, default=False),
+        Field('logging_log_separate_errors', 'logging_logSeparateErrors', kind=BOOLEAN, default=False),
+        Field('logging_detailed_log', 'logging_detailedLog', kind=BOOLEAN, default=False),
+        Field('logging_socket_stats', 'logging_socketStats', kind=BOOLEAN, default=False),
+        Field('stickiness_pattern', kind=SELECT, default='ipv4'),
+        Field('stickiness_data_types', 'stickiness_dataTypes', kind=MULTISELECT, default=[]),
+        Field('stickiness_expire', default='30m'),
+        Field('stickiness_size', default='50k'),
+        Field('stickiness_counter', kind=BOOLEAN, default=True),
+        Field('stickiness_counter_key', default='src'),
+        Field('stickiness_length'),
+        Field('stickiness_conn_rate_period', 'stickiness_connRatePeriod', default='10s'),
+        Field('stickiness_sess_rate_period', 'stickiness_sessRatePeriod', default='10s'),
+        Field('stickiness_http_req_rate_period', 'stickiness_httpReqRatePeriod', default='10s'),
+        Field('stickiness_http_err_rate_period', 'stickiness_httpErrRatePeriod', default='10s'),
+        Field('stickiness_bytes_in_rate_period', 'stickiness_bytesInRatePeriod', default='1m'),
+        Field('stickiness_bytes_out_rate_period', 'stickiness_bytesOutRatePeriod', default='1m'),
+        Field('forward_for', 'forwardFor', kind=BOOLEAN, default=False),
+        Field('connection_behaviour', 'connectionBehaviour', kind=SELECT, default='http-keep-alive'),
+        Field('custom_options', 'customOptions'),
+        Field('linked_actions', 'linkedActions', kind=ORDERED_MULTISELECT, default=[], ref='action'),
+        Field('linked_errorfiles', 'linkedErrorfiles', kind=MULTISELECT, default=[], ref='errorfile'),
+    ],
+    'group': [
+        Field('enabled', kind=BOOLEAN, default=True),
+        Field('description', impact=COSMETIC),
+        Field('members', kind=MULTISELECT, default=[], ref='user'),
+    ],
+    'healthcheck': [
+        Field('description', impact=COSMETIC),
+        Field('type', kind=SELECT, default='http'),
+        Field('interval', default='2s'),
+        Field('force_ssl', kind=BOOLEAN, default=False),
+        Field('checkport'),
+        Field('http_method', kind=SELECT, default='options'),
+        Field('http_uri', default='/'),
+        Field('http_version', kind=SELECT, default='http10'),
+        Field('http_host', default='localhost'),
+        Field('http_expression_enabled', 'http_expressionEnabled', kind=BOOLEAN, default=False),
+        Field('http_expression', kind=SELECT),
+        Field('http_negate', kind=BOOLEAN, default=False),
+        Field('http_value'),
+        Field('tcp_enabled', kind=BOOLEAN, default=False),
+        Field('tcp_send_value', 'tcp_sendValue'),
+        Field('tcp_match_type', 'tcp_matchType', kind=SELECT),
+        Field('tcp_negate', kind=BOOLEAN, default=False),
+        Field('tcp_match_value', 'tcp_matchValue'),
+        Field('agent_port', 'agentPort'),
+        # One user for the mysql and pgsql checks
+        Field('db_user', 'dbUser', fallback=('mysql_user', 'pgsql_user')),
+        Field('mysql_post41', kind=BOOLEAN, default=False),
+        # One domain for the smtp and esmtp checks
+        Field('smtp_domain', 'smtpDomain', fallback=('esmtp_domain',)),
+    ],
+    'lua': [
+        Field('enabled', kind=BOOLEAN, default=True),
+        Field('description', impact=COSMETIC),
+        Field('content'),
+    ],
+    'mapfile': [
+        Field('description', impact=COSMETIC),
+        Field('content', kind=DIGEST, source='src'),
+    ],
+    'server': [
+        # A disabled server is set to maint in the running HAProxy
+        Field('enabled', kind=BOOLEAN, default=True, impact=RUNTIME),
+        Field('description', impact=COSMETIC),
+        Field('address', required=True),
+        Field('port', required=True),
+        Field('checkport', fallback=('port',)),
+        Field('mode', kind=SELECT, default='active', impact=RUNTIME),
+        Field('ssl', kind=BOOLEAN, default=False),
+        Field('ssl_verify', 'sslVerify', kind=BOOLEAN, default=True),
+        Field('ssl_ca', 'sslCA', kind=MULTISELECT, default=[], ref='ssl'),
+        Field('ssl_crl', 'sslCRL', kind=SELECT, ref='ssl'),
+        Field('ssl_client_certificate', 'sslClientCertificate', kind=SELECT, ref='ssl'),
+        Field('weight', impact=RUNTIME),
+        Field('check_interval', 'checkInterval'),
+        Field('check_down_interval', 'checkDownInterval'),
+        Field('source'),
+        Field('advanced'),
+    ],
+    'user': [
+        Field('password', required=True, secret=True),
+        Field('enabled', kind=BOOLEAN, default=True),
+        Field('description', impact=COSMETIC),
+    ],
+}
+
+# Properties which have to be sent with every update, even if unchanged.
+# Workaround for https://github.com/opnsense/plugins/issues/1494:
+# any change must include the linkedActions to maintain the correct order
+ALWAYS_SEND = {
+    'backend': ['linkedActions'],
+    'frontend': ['linkedActions'],
+}
+
+
+def needsReload(impact):
+    return impact in (RUNTIME, CONFIG)
+
+
+def actionValueFields(action_type):
+    # The value of an action is stored in properties named after its type (dashes replaced by underscores).
+    # Several http actions split their value 'first::second' into two properties.
+    action_type_key = action_type.replace('-', '_')
+    if 'http' in action_type and 'header' in action_type:
+        # del only needs the name of the HTTP header to delete
+        if 'del' in action_type:
+            return [Field('value', action_type_key + '_name', required=True)]
+        if 'replace' in action_type:
+            return [
+                Field('value', action_type_key + '_name', required=True, part=0),
+                Field('value', action_type_key + '_regex', required=True, part=1),
+            ]
+        return [
+            Field('value', action_type_key + '_name', required=True, part=0),
+            Field('value', action_type_key + '_content', required=True, part=1),
+        ]
+    if 'http' in action_type and 'value' in action_type:
+        return [
+            Field('value', action_type_key + '_name', required=True, part=0),
+            Field('value', action_type_key + '_regex', required=True, part=1),
+        ]
+    if 'http' in action_type and 'status' in action_type:
+        return [
+            Field('value', action_type_key + '_code', required=True, part=0),
+            Field('value', action_type_key + '_reason', required=True, part=1),
+        ]
+    if action_type == 'use_backend':
+        return [Field('value', action_type_key, kind=SELECT, required=True, ref='backend')]
+    return [Field('value', action_type_key, required=True)]
+
+
+def getFields(objecttype, item=None):
+    if objecttype not in FIELDS:
+        raise KeyError('Objecttype %s not supported!' % objecttype)
+    fields = FIELDS[objecttype]
+    if objecttype == 'action' and item is not None and item.get('type'):
+        fields = fields + actionValueFields(item['type'])
+    return fields
+
+
+def hasReferences(objecttype):
+    for field in FIELDS[objecttype]:
+        if field.ref is not None:
+            return True
+    # use_backend actions reference a backend
+    return objecttype == 'action'
+
+
+def referencingTypes(objecttype):
+    # Objecttypes whose empty object lists the objects of objecttype as options,
+    # e.g. a new server shows up in the linkedServers of an empty backend
+    types = []
+    for othertype, fields in FIELDS.items():
+        if othertype == 'action':
+            fields = fields + actionValueFields('use_backend')
+        if [field for field in fields if field.ref == objecttype]:
+            types.append(othertype)
+    return sorted(types)
+
+
+def toList(value):
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        return [str(v) for v in value]
+    value = str(value)
+    if value == '':
+        return []
+    return value.split(',')
+
+
+def isSelected(option):
+    return HaproxyOptions.isSelected(option)
+
+
+def resolveReference(field, template, name, objecttype):
+    # template is a HaproxyOptions.TemplateIndex, so every option dict gets indexed only once
+    options = template.options(field.prop)
+    if name not in options:
+        raise KeyError('%s %s references unknown %s %s' % (objecttype, field.prop, field.ref, name))
+    return options.key(name)
+
+
+def defaultValue(field, item):
+    # The value of a missing key: the first non-empty fallback key, otherwise the default
+    for key in field.fallback:
+        if item.get(key) not in (None, ''):
+            return item[key]
+    return field.default
+
+
+def itemValue(objecttype, field, item):
+    if field.source is not None and item.get(field.source):
+        try:
+            value = HaproxyMapfile.readFile(item[field.source])
+        except (IOError, OSError, UnicodeDecodeError) as e:
+            raise ValueError('%s cannot read %s %s: %s' % (objecttype, field.source, item[field.source], e))
+    elif field.key in item and item[field.key] is not None and not (field.fallback and item[field.key] == ''):
+        value = item[field.key]
+    elif field.required:
+        raise KeyError('%s requires property %s' % (objecttype, field.key))
+    else:
+        value = defaultValue(field, item)
+    if field.part is not None:
+        parts = str(value).split('::')
+        if len(parts) <= field.part:
+            raise ValueError('%s property %s must look like "first::second"' % (objecttype, field.key))
+        value = parts[field.part]
+    return value
+
+
+def buildProperties(objecttype, item, template=None):
+    # Translate one item of the role variables into the properties expected by the API.
+    # template is the empty object of objecttype, preferably wrapped in a HaproxyOptions.TemplateIndex.
+    if not isinstance(template, HaproxyOptions.TemplateIndex):
+        template = HaproxyOptions.TemplateIndex(template)
+    properties = {}
+    for field in getFields(objecttype, item):
+        value = itemValue(objecttype, field, item)
+        if field.kind == BOOLEAN:
+            properties[field.prop] = str(int(boolean(value)))
+        elif field.kind in MULTISELECT_KINDS:
+            values = toList(value)
+            if field.ref is not None:
+                values = [resolveReference(field, template, v, objecttype) for v in values]
+            properties[field.prop] = ','.join(values)
+        else:
+            value = '' if value is None else str(value)
+            if field.null is not None and value == field.null:
+                value = ''
+            if field.kind == SELECT and field.ref is not None and value != '':
+                value = resolveReference(field, template, value, objecttype)
+            properties[field.prop] = value
+    return properties
+
+
+def currentValue(field, obj):
+    # Normalize the value of a property as returned by get<objecttype>
+    value = obj.get(field.prop, '')
+    if field.kind == SELECT:
+        if isinstance(value, dict):
+            for key, option in value.items():
+                if isSelected(option):
+                    return key
+            return ''
+        return '' if value is None else str(value)
+    if field.kind in MULTISELECT_KINDS:
+        if isinstance(value, dict):
+            return [key for key, option in value.items() if isSelected(option)]
+        return toList(value)
+    return '' if value is None else str(value)
+
+
+def isEnabled(field, properties):
+    for prop in field.when:
+        if properties.get(prop) != '1':
+            return False
+    return True
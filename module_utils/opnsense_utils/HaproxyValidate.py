@@ -0,0 +1,109 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2019, Markus Joosten https://github.com/mj84
+from __future__ import absolute_import, division, print_function
+
+# Checks the role variables before anything is written: required properties, 'first::second' values
+# and every reference (linked ACLs, actions, servers, errorfiles, CPU rules, users, groups, health checks, backends
+# and SSL objects) against the existing objects plus the desired ones. All problems are reported at once,
+# instead of failing partway through a run at the first unknown name.
+
+from collections import OrderedDict
+
+from ansible.module_utils.opnsense_utils import HaproxySchema
+
+
+def isAbsent(item):
+    return (item or {}).get('state', 'present') == 'absent'
+
+
+def problem(objecttype, name, key, msg):
+    return OrderedDict([('objecttype', objecttype), ('name', name), ('property', key), ('msg', msg)])
+
+
+def referencedTypes(objects):
+    # Objecttypes (and 'ssl') referenced by any field of the given types
+    types = set()
+    for objecttype in objects:
+        if objecttype not in HaproxySchema.FIELDS:
+            continue
+        fields = HaproxySchema.FIELDS[objecttype]
+        if objecttype == 'action':
+            fields = fields + HaproxySchema.actionValueFields('use_backend')
+        types.update(field.ref for field in fields if field.ref is not None)
+    return types
+
+
+def knownNames(apiconnection, objects, objecttypes, purge=False):
+    # objecttype => names which will exist after the run: the existing objects plus the desired ones,
+    # without the ones to be deleted. Also returns the names of the objects to be deleted.
+    names = {}
+    deleted = {}
+    for objecttype in objecttypes:
+        present = set(row['name'] for row in apiconnection.listObjects(objecttype))
+        deleted[objecttype] = set()
+        if purge and objects.get(objecttype):
+            # Purge deletes every object of a managed type which is not desired
+            deleted[objecttype] = present.difference(objects[objecttype])
+            present = present.difference(deleted[objecttype])
+        for name, item in objects.get(objecttype, {}).items():
+            if isAbsent(item):
+                present.discard(name)
+                deleted[objecttype].add(name)
+            else:
+                present.add(name)
+        names[objecttype] = present
+    return names, deleted
+
+
+def validate(apiconnection, objects, purge=False):
+    # objects maps objecttype => dict of name => properties, shaped like the opnsense_haproxy_* role variables.
+    # Returns a list of problems, empty if the variables are consistent. Only reads from the API.
+    problems = []
+    for objecttype in objects:
+        if objecttype not in HaproxySchema.FIELDS:
+            problems.append(problem(objecttype, '', '', 'Objecttype %s not supported!' % objecttype))
+    objects = dict((objecttype, items or {}) for objecttype, items in objects.items() if objecttype in HaproxySchema.FIELDS)
+    reftypes = referencedTypes(objects)
+    names, deleted = knownNames(apiconnection, objects, [objecttype for objecttype in reftypes if objecttype != 'ssl'], purge=purge)
+    # The SSL objects (certificates, CAs, CRLs) and the action types are only listed in the option dicts of the templates
+    templates = {}
+
+    def template(objecttype):
+        if objecttype not in templates:
+            templates[objecttype] = apiconnection.getTemplateIndex(objecttype)
+        return templates[objecttype]
+
+    for objecttype in sorted(objects):
+        for name, item in objects[objecttype].items():
+            item = item or {}
+            if isAbsent(item):
+                continue
+            if objecttype == 'action' and item.get('type') and len(template('action').options('type')) \
+                    and not template('action').options('type').hasKey(item['type']):
+                problems.append(problem(objecttype, name, 'type', 'action %s has unknown type %s' %(name, item['type'])))
+                continue
+            for field in HaproxySchema.getFields(objecttype, item):
+                try:
+                    value = HaproxySchema.itemValue(objecttype, field, item)
+                except (KeyError, ValueError) as e:
+                    problems.append(problem(objecttype, name, field.key, '%s %s: %s' %(objecttype, name, e.args[0])))
+                    continue
+                if field.ref is None:
+                    continue
+                for refname in HaproxySchema.toList(value):
+                    if refname == '' or refname == field.null:
+                        continue
+                    if field.ref == 'ssl':
+                        known = refname in template(objecttype).options(field.prop)
+                    else:
+                        known = refname in names[field.ref]
+                    if known:
+                        continue
+                    if field.ref != 'ssl' and refname in deleted[field.ref]:
+                        msg = '%s %s: %s references %s %s, which is to be deleted' %(objecttype, name, field.key, field.ref, refname)
+                    else:
+                        msg = '%s %s: %s references unknown %s %s' %(objecttype, name, field.key, field.ref, refname)
+                    problems.append(problem(objecttype, name, field.key, msg))
+    return problems
@@ -5,11 +5,99 @@
 from __future__ import absolute_import, division, print_function
 
 import requests
+import errno
+import hashlib
 import json
+import os
+import random
+import re
+import tempfile
+import threading
+import time
 from collections import OrderedDict
+from requests.adapters import HTTPAdapter
+
+from ansible.module_utils.opnsense_utils import HaproxyOptions
+from ansible.module_utils.opnsense_utils import HaproxySchema
+
+try:
+    from concurrent.futures import ThreadPoolExecutor
+    HAS_FUTURES = True
+except ImportError:
+    # Python 2 without the futures backport, objects get fetched one after another
+    HAS_FUTURES = False
+
+# HTTP status codes worth retrying: the firewall is busy (e.g. configd during a reconfigure) or restarting
+RETRY_STATUS = (429, 500, 502, 503, 504)
+# POST endpoints which may be sent again without side effects, settings add/set/del are never retried
+RETRY_ENDPOINTS = ('/api/haproxy/service/configtest', '/api/haproxy/service/reconfigure')
+# Lists the backups of config.xml, one per saved change, so the newest one identifies the current revision
+REVISION_ENDPOINT = '/api/core/backup/backups/this'
+
+
+def getStateDir():
+    # Private directory of the current user in the temp dir, for the state shared between module invocations.
+    # Other users of the node can neither read it (snapshots contain secrets) nor plant files in it.
+    statedir = os.path.join(tempfile.gettempdir(), 'opnsense_haproxy_%d' % os.getuid())
+    try:
+        os.mkdir(statedir, 0o700)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    # An existing directory must be a real directory owned by us and closed to others, otherwise use a new one
+    status = os.lstat(statedir)
+    if not os.path.isdir(statedir) or os.path.islink(statedir) or status.st_uid != os.getuid() or status.st_mode & 0o077:
+        statedir = tempfile.mkdtemp(prefix='opnsense_haproxy_')
+    return statedir
+
+
+def getReloadMarker(url, statedir):
+    # One marker file per firewall, so several module invocations (and clients) can share a single reload
+    urlhash = hashlib.sha1(url.encode('utf-8')).hexdigest()
+    return os.path.join(statedir, 'opnsense_haproxy_reload_%s' % urlhash)
+
+
+def getEndpointTemplate(baseurl, url):
+    # /api/haproxy/settings/getserver/<uuid>?x=y => /api/haproxy/settings/getserver/{uuid}
+    path = url[len(baseurl):] if url.startswith(baseurl) else url
+    path = path.split('?')[0]
+    return re.sub(r'^(/api/haproxy/settings/[a-z]+)/[^/]+$', r'\1/{uuid}', path)
+
+
+def summarizeCalls(calls):
+    # Totals and per endpoint numbers of a list of call records (see Haproxy.recordRequest)
+    by_endpoint = OrderedDict()
+    total_ms = 0.0
+    total_bytes = 0
+    for call in calls:
+        key = '%s %s' %(call['method'], call['endpoint'])
+        if key not in by_endpoint:
+            by_endpoint[key] = OrderedDict([('requests', 0), ('total_ms', 0.0), ('bytes', 0), ('errors', 0)])
+        stats = by_endpoint[key]
+        stats['requests'] += 1
+        stats['total_ms'] = round(stats['total_ms'] + call['ms'], 1)
+        stats['bytes'] += call['bytes']
+        if call['status'] is None or call['status'] >= 400:
+            stats['errors'] += 1
+        total_ms += call['ms']
+        total_bytes += call['bytes']
+    return OrderedDict([
+        ('requests', len(calls)),
+        ('total_ms', round(total_ms, 1)),
+        ('bytes', total_bytes),
+        ('by_endpoint', by_endpoint),
+    ])
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    # Raised without contacting the API after too many consecutive failures
+    pass
+
 
 class Haproxy:
-    def __init__(self, url, auth, ssl_verify):
+    def __init__(self, url, auth, ssl_verify, connect_timeout=10, read_timeout=120, pool_maxsize=10, statedir=None,
+                 retries=3, backoff=0.5, backoff_max=10, breaker_threshold=5, breaker_reset=30, page_size=1000,
+                 template_ttl=60, snapshot_cache=False):
         self.url = url
         self.auth = auth
         self.ssl_verify = ssl_verify
@@ -17,15 +105,198 @@ class Haproxy:
         if not self.ssl_verify:
             import urllib3
             urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+        # Explicit (connect, read) timeouts, so a busy firewall cannot stall a run forever
+        self.timeout = (connect_timeout, read_timeout)
+        # All API calls share one session, so TCP connections and their TLS handshake get reused (keep-alive)
+        self.session = requests.Session()
+        self.session.auth = self.auth
+        self.session.verify = self.ssl_verify
+        self.pool_maxsize = pool_maxsize
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.requestcount = 0
+        # Requests may be sent from several threads, see getObjectsByUuids
+        self.lock = threading.Lock()
+        # One record per API call (see recordRequest), callables in requesthooks get every record as well
+        self.calls = []
+        self.requesthooks = []
+        self.started = time.time()
+        # Idempotent requests get retried with jittered exponential backoff (see sendRequest)
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.retrycount = 0
+        self.timeoutcount = 0
+        # Circuit breaker: after breaker_threshold consecutive failures requests fail immediately (open).
+        # breaker_reset seconds after the last failure a single request probes the API (half-open),
+        # the others still fail immediately. Its success closes the circuit, its failure opens it again.
+        self.breaker_threshold = breaker_threshold
+        self.breaker_reset = breaker_reset
+        self.consecutivefailures = 0
+        self.lastfailure = 0
+        self.probing = False
+        # Index of (objecttype, name) => uuid, filled by listObjects and kept current by create/update/delete,
+        # so name based lookups don't need to fetch search<type>s again
+        self.uuidindex = {}
+        self.indexedtypes = set()
+        # Rows per search<type>s request, see iterObjects
+        self.page_size = page_size
+        # Full model as returned by settings/get, see loadSnapshot. None while not loaded.
+        self.snapshot = None
+        # Directory for state shared between module invocations, e.g. the pending reload marker
+        self.statedir = statedir if statedir is not None else getStateDir()
+        # Empty objects (see getTemplate) are cached for template_ttl seconds, in memory and in statedir
+        self.template_ttl = template_ttl
+        self.templates = {}
+        # Types whose template in templates was fetched by this client, not read from the cache
+        self.fetchedtemplates = set()
+        # Counts invalidateTemplates calls, a template fetched before one of them is not cached (see getTemplate)
+        self.templategeneration = 0
+        self.templatehits = 0
+        self.templatemisses = 0
+        # Snapshots (see loadSnapshot) are cached in statedir together with the config revision they were read at
+        self.snapshot_cache = snapshot_cache
+        self.snapshothits = 0
+        self.snapshotmisses = 0
+        self.revision = None
+
+    def getConnectionStats(self):
+        # urllib3 counts every newly opened connection per pool, every other request reused one
+        connections = 0
+        for adapter in set(self.session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                connections += pools[key].num_connections
+        return {
+            'requests': self.requestcount,
+            'connections': connections,
+            'connections_reused': max(self.requestcount - connections, 0),
+        }
+
+    def close(self):
+        self.session.close()
+
+    def addRequestHook(self, hook):
+        self.requesthooks.append(hook)
+
+    def getEndpointTemplate(self, url):
+        return getEndpointTemplate(self.url, url)
+
+    def recordRequest(self, method, url, response, started):
+        finished = time.time()
+        call = OrderedDict([
+            ('method', method),
+            ('endpoint', self.getEndpointTemplate(url)),
+            ('status', response.status_code if response is not None else None),
+            ('bytes', len(response.content) if response is not None else 0),
+            ('start_ms', round((started - self.started) * 1000, 1)),
+            ('ms', round((finished - started) * 1000, 1)),
+        ])
+        with self.lock:
+            self.requestcount += 1
+            self.calls.append(call)
+        for hook in self.requesthooks:
+            hook(call)
+
+    def getApiStats(self):
+        with self.lock:
+            calls = list(self.calls)
+        api_stats = summarizeCalls(calls)
+        api_stats['retries'] = self.retrycount
+        api_stats['timeouts'] = self.timeoutcount
+        api_stats['circuit_open'] = self.isCircuitOpen()
+        api_stats['template_cache'] = OrderedDict([('hits', self.templatehits), ('misses', self.templatemisses)])
+        if self.snapshot_cache:
+            api_stats['snapshot_cache'] = OrderedDict([('hits', self.snapshothits), ('misses', self.snapshotmisses), ('revision', self.revision)])
+        api_stats.update(self.getConnectionStats())
+        return api_stats
+
+    def writeTimeline(self, path):
+        # Raw per-call timeline for debugging, start_ms is relative to the creation of this client
+        with self.lock:
+            calls = list(self.calls)
+        with open(path, 'w') as f:
+            json.dump({'url': self.url, 'calls': calls}, f, indent=2)
+
+    def getBackoff(self, attempt):
+        # Full jitter: a random delay up to the exponential backoff, so parallel clients don't retry in lockstep
+        return random.uniform(0, min(self.backoff_max, self.backoff * (2 ** (attempt - 1))))
+
+    def isCircuitOpen(self):
+        with self.lock:
+            return self.consecutivefailures >= self.breaker_threshold \
+                and (self.probing or time.time() - self.lastfailure < self.breaker_reset)
+
+    def allowRequest(self):
+        # False while the circuit is open, True for the single probe of a half-open circuit
+        with self.lock:
+            if self.consecutivefailures < self.breaker_threshold:
+                return True
+            if self.probing or time.time() - self.lastfailure < self.breaker_reset:
+                return False
+            self.probing = True
+            return True
+
+    def recordFailure(self, error=None):
+        with self.lock:
+            self.probing = False
+            self.consecutivefailures += 1
+            self.lastfailure = time.time()
+            if isinstance(error, requests.exceptions.Timeout):
+                self.timeoutcount += 1
+
+    def recordSuccess(self):
+        with self.lock:
+            self.probing = False
+            self.consecutivefailures = 0
+
+    def sendRequest(self, method, url, data=None):
+        # GETs and the endpoints in RETRY_ENDPOINTS are retried on connection errors, timeouts and RETRY_STATUS
+        retry = method == 'GET' or self.getEndpointTemplate(url) in RETRY_ENDPOINTS
+        attempt = 0
+        while True:
+            if not self.allowRequest():
+                raise CircuitOpenError('%d consecutive API errors, not contacting %s for %ss' %(self.consecutivefailures, self.url, self.breaker_reset))
+            started = time.time()
+            try:
+                if method == 'GET':
+                    r = self.session.get(url, timeout=self.timeout)
+                else:
+                    r = self.session.post(url, json=data, timeout=self.timeout)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                self.recordRequest(method, url, None, started)
+                self.recordFailure(e)
+                if not retry or attempt >= self.retries:
+                    raise
+            except Exception:
+                # Any other error decides nothing, the next request may probe again
+                with self.lock:
+                    self.probing = False
+                raise
+            else:
+                self.recordRequest(method, url, r, started)
+                if r.status_code not in RETRY_STATUS:
+                    self.recordSuccess()
+                    return r
+                self.recordFailure()
+                if not retry:
+                    return r
+                if attempt >= self.retries:
+                    r.raise_for_status()
+            attempt += 1
+            with self.lock:
+                self.retrycount += 1
+            time.sleep(self.getBackoff(attempt))
 
     def getRequest(self, url):
-        r = requests.get(url, auth=self.auth, verify=self.ssl_verify)
+        r = self.sendRequest('GET', url)
         # We need to parse the JSON response as an OrderedDict, so we can preserve the order of some properties
         r_ordered = json.loads(r.content, object_pairs_hook=OrderedDict)
         return r_ordered
 
     def postRequest(self, url, data):
-        r = requests.post(url, auth=self.auth, verify=self.ssl_verify, json=data)
+        r = self.sendRequest('POST', url, data)
         r_json = r.json()
         #print(data)
         # maybe need some better status checking here
@@ -38,25 +309,39 @@ class Haproxy:
             raise KeyError('Objecttype %s not supported!' % objecttype)
         if name == '':
             return ''
-        objects = []
-        objects = self.listObjects(objecttype)
-        for obj in objects:
-            if obj['name'] == name:
-                return obj['uuid']
+        if (objecttype, name) in self.uuidindex:
+            return self.uuidindex[(objecttype, name)]
+        if objecttype not in self.indexedtypes:
+            # Ask the firewall for matching rows only (searchPhrase also matches substrings and descriptions),
+            # no matching row means there is no such object
+            rows = []
+            unmatched = False
+            for row in self.iterObjects(objecttype, phrase=name):
+                if row['name'] == name:
+                    self.uuidindex[(objecttype, name)] = row['uuid']
+                    return row['uuid']
+                rows.append(row)
+                unmatched = unmatched or (name.lower() not in row['name'].lower() and name.lower() not in row.get('description', '').lower())
+            # Rows not containing the name and as many rows as without searchPhrase: an API version ignoring searchPhrase
+            # sent all of them, which indexes the type without listing it again
+            if unmatched and self.countObjects(objecttype) == len(rows):
+                self.indexObjects(objecttype, rows)
         raise KeyError('Found no object of type %s with name %s!' %(objecttype, name))
 
+    def findUuidByName(self, objecttype, name):
+        # Like getUuidByName, but returns '' if there is no object with this name
+        if objecttype not in self.objecttypes:
+            raise KeyError('Objecttype %s not supported!' % objecttype)
+        try:
+            return self.getUuidByName(objecttype, name)
+        except KeyError:
+            return ''
+
     def getSslObjectKeys(self, ssl_objects, names):
-        ssl_object_keys = []
-        for name in names:
-            ssl_object_key = self.findValueInDict(ssl_objects, name)
-            if ssl_object_key == '':
-                raise KeyError('No SSL object with name %s', name)
-            else:
-                ssl_object_keys.append(ssl_object_key)
-        return ssl_object_keys
+        return HaproxyOptions.OptionIndex(ssl_objects, 'SSL object').keys(names)
 
     def getSelected(self, valuesdict, retval='key'):
-        for key, value in valuesdict.iteritems():
+        for key, value in valuesdict.items():
             if value['selected'] == 1:
                 if retval == 'key':
                     return key
@@ -71,7 +356,7 @@ class Haproxy:
         # Catch empty list, which is specified as an actual JSON list
         if type(valuesdict) == list and valuesdict == []:
             return []
-        for key, value in valuesdict.iteritems():
+        for key, value in valuesdict.items():
             if value['selected'] == 1:
                 if retval == 'key':
                     selected_items.append(key)
@@ -82,7 +367,7 @@ class Haproxy:
         return selected_items
 
     def findValueInDict(self, valuesdict, searchvalue, prop='value', retval='key'):
-        for key, value in valuesdict.iteritems():
+        for key, value in valuesdict.items():
             if prop in value and value[prop] == searchvalue:
                 if retval == 'key':
                     return key
@@ -95,20 +380,10 @@ class Haproxy:
     def compareLists(self, list_one, list_two, order_sensitive=False):
         # This function compares if two lists contain the same elements.
         # If necessary, the order can be checked as well.
-        lists_match = True
-        # Check if list_two contains elements not in list_one
-        for item in list_two:
-            if item not in list_one:
-                lists_match = False
-        # Check if list_one contains elements not in list_two
-        for item in list_one:
-            if item not in list_two:
-                lists_match = False
-        # If order is relevant, check if both lists are identical
-        if lists_match and order_sensitive:
-            if list_one != list_two:
-                lists_match = False
-        return lists_match
+        if order_sensitive:
+            return list(list_one) == list(list_two)
+        # Membership is checked via sets, duplicate elements are not significant
+        return set(list_one) == set(list_two)
 
     def getUuidsFromNames(self, objecttype, names):
         uuid_list = []
@@ -119,7 +394,7 @@ class Haproxy:
 
     def getSelectedKeysFromDict(self, objs):
         selected_items = []
-        for key, value in objs.iteritems():
+        for key, value in objs.items():
             if 'selected' in value and value['selected'] == '1':
                 selected_items.append(key)
         return selected_items
@@ -130,10 +405,106 @@ class Haproxy:
         configtest = self.postRequest(configtesturl, {})
         if 'is valid' in configtest['result']:
             reconfigure = self.postRequest(reconfigureurl, {})
+            self.clearReloadPending()
             return configtest, reconfigure
         else:
             raise ValueError('Configtest did not succeed!')
 
+    def getReloadMarker(self):
+        return getReloadMarker(self.url, self.statedir)
+
+    def markReloadPending(self):
+        # Created exclusively, an existing marker already records the pending reload and is never followed or overwritten
+        try:
+            fd = os.open(self.getReloadMarker(), os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except OSError as e:
+            if e.errno == errno.EEXIST:
+                return
+            raise
+        with os.fdopen(fd, 'w') as marker:
+            marker.write('%s\n' % time.time())
+
+    def isReloadPending(self):
+        return os.path.exists(self.getReloadMarker())
+
+    def clearReloadPending(self):
+        try:
+            os.remove(self.getReloadMarker())
+        except OSError:
+            pass
+
+    def getTemplateCache(self, objecttype):
+        urlhash = hashlib.sha1(self.url.encode('utf-8')).hexdigest()
+        return os.path.join(self.statedir, 'opnsense_haproxy_template_%s_%s.json' %(urlhash, objecttype))
+
+    def getTemplate(self, objecttype):
+        # An empty object of objecttype, its option dicts map the names of referenced objects to their UUIDs.
+        # The same template is needed by every module invocation, so it is shared through a file in statedir
+        # until template_ttl has passed or one of the listed objects gets created, renamed or deleted.
+        if objecttype not in self.objecttypes:
+            raise KeyError('Objecttype %s not supported!' % objecttype)
+        now = time.time()
+        if self.template_ttl > 0:
+            if objecttype not in self.templates:
+                try:
+                    with open(self.getTemplateCache(objecttype)) as f:
+                        cached = json.load(f, object_pairs_hook=OrderedDict)
+                    self.templates[objecttype] = (cached['fetched'], cached['template'])
+                except (IOError, OSError, ValueError, KeyError):
+                    pass
+            if objecttype in self.templates and 0 <= now - self.templates[objecttype][0] < self.template_ttl:
+                self.templatehits += 1
+                return dict(self.templates[objecttype][1])
+        self.templatemisses += 1
+        with self.lock:
+            generation = self.templategeneration
+        template = self.getObjectByUuid(objecttype, '')
+        if self.template_ttl > 0:
+            # Another thread may have changed objects while the template was fetched, then it is used once but not cached
+            with self.lock:
+                if generation == self.templategeneration:
+                    self.templates[objecttype] = (now, template)
+                    self.fetchedtemplates.add(objecttype)
+                    # Written to a temporary file first, so parallel invocations never read a partial file
+                    try:
+                        fd, temppath = tempfile.mkstemp(dir=self.statedir, prefix='opnsense_haproxy_template_')
+                        with os.fdopen(fd, 'w') as f:
+                            json.dump({'fetched': now, 'template': template}, f)
+                        os.rename(temppath, self.getTemplateCache(objecttype))
+                    except (IOError, OSError):
+                        pass
+        return dict(template)
+
+    def refreshTemplate(self, objecttype):
+        # Called when a name is missing from the option dicts of a template (see getTemplateIndex).
+        # A cached template may predate objects created elsewhere, e.g. a certificate added in System/Trust
+        # or an object created by another client within template_ttl, so it is dropped and fetched again.
+        # None if this client fetched the template itself, it is as current as a new one.
+        if objecttype in self.fetchedtemplates:
+            return None
+        with self.lock:
+            self.dropTemplate(objecttype)
+        return self.getTemplate(objecttype)
+
+    def getTemplateIndex(self, objecttype):
+        # The template wrapped in a HaproxyOptions.TemplateIndex which fetches it again on the first missing name
+        return HaproxyOptions.TemplateIndex(self.getTemplate(objecttype), lambda: self.refreshTemplate(objecttype))
+
+    def dropTemplate(self, objecttype):
+        self.templates.pop(objecttype, None)
+        self.fetchedtemplates.discard(objecttype)
+        try:
+            os.remove(self.getTemplateCache(objecttype))
+        except OSError:
+            pass
+
+    def invalidateTemplates(self, objecttype):
+        # Called after objects of objecttype got created, renamed or deleted
+        with self.lock:
+            self.templategeneration += 1
+            for othertype in HaproxySchema.referencingTypes(objecttype):
+                self.dropTemplate(othertype)
+
     def createObject(self, objecttype, objectname, properties):
         properties['name'] = objectname
         if objecttype not in self.objecttypes:
@@ -141,6 +512,15 @@ class Haproxy:
         url = self.url + '/api/haproxy/settings/add' + objecttype
         obj = {objecttype: properties}
         response = self.postRequest(url, obj)
+        self.markReloadPending()
+        self.invalidateTemplates(objecttype)
+        if 'uuid' in response:
+            self.uuidindex[(objecttype, objectname)] = response['uuid']
+            if self.snapshot is not None:
+                self.snapshot[objecttype][response['uuid']] = None
+        else:
+            # Without the new uuid the index is incomplete, list this type again on next lookup
+            self.indexedtypes.discard(objecttype)
         #return 'createObject sending object data: %s' % obj, 'to url: %s' % url, 'createObject received response: ', response
         return response
 
@@ -150,34 +530,229 @@ class Haproxy:
         uuid = self.getUuidByName(objecttype, objectname)
         url = self.url + '/api/haproxy/settings/del' + objecttype + '/' + uuid
         response = self.postRequest(url, {})
+        self.markReloadPending()
+        self.invalidateTemplates(objecttype)
+        self.uuidindex.pop((objecttype, objectname), None)
+        if self.snapshot is not None:
+            self.snapshot[objecttype].pop(uuid, None)
         return response
 
+    def loadSnapshot(self):
+        # Fetch the whole HAProxy model with a single request and index it by type, uuid and name.
+        # Afterwards listObjects, getUuidByName, getObjectByName and getObjectByUuid are answered from memory,
+        # changes are still written through the add/set/del endpoints.
+        # With snapshot_cache, a snapshot read at the current config revision is reused instead.
+        if self.snapshot_cache:
+            # Read before the snapshot, so a change in between makes the cached snapshot stale instead of the revision
+            self.revision = self.getConfigRevision()
+            cached = self.readSnapshotCache(self.revision)
+            if cached is not None:
+                self.snapshothits += 1
+                return self.indexSnapshot(cached)
+            self.snapshotmisses += 1
+        url = self.url + '/api/haproxy/settings/get'
+        model = self.getRequest(url)['haproxy']
+        snapshot = OrderedDict()
+        for objecttype in self.objecttypes:
+            # Objects of each type live in <objecttype>s.<objecttype>, empty containers are sent as JSON lists
+            container = model.get(objecttype + 's')
+            objects = container.get(objecttype) if isinstance(container, dict) else None
+            if not isinstance(objects, dict):
+                objects = OrderedDict()
+            snapshot[objecttype] = OrderedDict((uuid, dict(obj)) for uuid, obj in objects.items())
+        if self.snapshot_cache and self.revision is not None:
+            self.writeSnapshotCache(self.revision, snapshot)
+        return self.indexSnapshot(snapshot)
+
+    def indexSnapshot(self, snapshot):
+        self.snapshot = snapshot
+        for objecttype in self.objecttypes:
+            self.indexObjects(objecttype, [{'uuid': uuid, 'name': obj['name']} for uuid, obj in snapshot[objecttype].items()])
+        return self.snapshot
+
+    def getConfigRevision(self):
+        # Identifier of the current config.xml revision, None if the API user may not list the backups
+        try:
+            r = self.sendRequest('GET', self.url + REVISION_ENDPOINT)
+            items = r.json().get('items') if r.status_code == 200 else None
+        except (requests.exceptions.RequestException, ValueError):
+            return None
+        if not items:
+            return None
+        newest = max(items, key=lambda item: float(item.get('time', 0)))
+        return str(newest.get('id') or newest.get('time'))
+
+    def getSnapshotCache(self):
+        urlhash = hashlib.sha1(self.url.encode('utf-8')).hexdigest()
+        return os.path.join(self.statedir, 'opnsense_haproxy_snapshot_%s.json' % urlhash)
+
+    def readSnapshotCache(self, revision):
+        if revision is None:
+            return None
+        try:
+            with open(self.getSnapshotCache()) as f:
+                cached = json.load(f, object_pairs_hook=OrderedDict)
+        except (IOError, OSError, ValueError):
+            return None
+        if cached.get('url') != self.url or cached.get('revision') != revision or set(cached.get('snapshot', {})) != set(self.objecttypes):
+            return None
+        return cached['snapshot']
+
+    def writeSnapshotCache(self, revision, snapshot):
+        # The snapshot contains secrets (e.g. user passwords), mkstemp creates the file readable by its owner only
+        try:
+            fd, temppath = tempfile.mkstemp(dir=self.statedir, prefix='opnsense_haproxy_snapshot_')
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'url': self.url, 'revision': revision, 'fetched': time.time(), 'snapshot': snapshot}, f)
+            os.rename(temppath, self.getSnapshotCache())
+        except (IOError, OSError):
+            pass
+
     def listObjects(self, objecttype):
         if objecttype not in self.objecttypes:
             raise KeyError('%s is no valid object type!' % objecttype)
-        url = self.url + '/api/haproxy/settings/search' + str(objecttype) + 's'
-        #objs = self.getRequest(url)
-        objs = dict(self.getRequest(url))
-        return objs['rows']
+        if self.snapshot is not None and objecttype in self.indexedtypes:
+            # The index is kept current by create/update/delete, so it lists the same objects as search<type>s
+            # Copied first, other threads may index other types meanwhile (see HaproxySchedule)
+            return [{'uuid': uuid, 'name': name} for (indexedtype, name), uuid in list(self.uuidindex.items()) if indexedtype == objecttype]
+        rows = list(self.iterObjects(objecttype))
+        self.indexObjects(objecttype, rows)
+        return rows
+
+    def iterObjects(self, objecttype, page_size=None, phrase=''):
+        # Yields the rows of search<type>s one page (current/rowCount) at a time,
+        # so only a single page is held in memory and callers can stop early.
+        # With phrase, the firewall only returns rows matching it (searchPhrase).
+        if objecttype not in self.objecttypes:
+            raise KeyError('%s is no valid object type!' % objecttype)
+        page_size = page_size or self.page_size
+        current = 1
+        while True:
+            url = self.url + '/api/haproxy/settings/search%ss?current=%d&rowCount=%d' %(objecttype, current, page_size)
+            if phrase:
+                url += '&searchPhrase=' + requests.utils.quote(phrase, safe='')
+            page = self.getRequest(url)
+            rows = page.get('rows', [])
+            for row in rows:
+                yield row
+            # A short page is the last one. More rows than requested means the API ignored the paging and sent everything.
+            if len(rows) != page_size or current * page_size >= int(page.get('total', 0)):
+                return
+            current += 1
+
+    def countObjects(self, objecttype):
+        # Number of objects of objecttype, from a search<type>s request for a single row
+        url = self.url + '/api/haproxy/settings/search%ss?current=1&rowCount=1' % objecttype
+        return int(self.getRequest(url).get('total', 0))
+
+    def indexObjects(self, objecttype, rows):
+        # (Re)build the name index of one objecttype from a complete list of rows
+        for key in [key for key in list(self.uuidindex) if key[0] == objecttype]:
+            del self.uuidindex[key]
+        for row in rows:
+            self.uuidindex[(objecttype, row['name'])] = row['uuid']
+        self.indexedtypes.add(objecttype)
 
     def getObjectByName(self, objecttype, name):
         uuid = self.getUuidByName(objecttype, name)
-        url = self.url + '/api/haproxy/settings/get' + objecttype + '/' + uuid
-        #obj = self.getRequest(url)[objecttype]
-        obj = dict(self.getRequest(url)[objecttype])
-        return obj
+        return self.getObjectByUuid(objecttype, uuid)
 
     def getObjectByUuid(self, objecttype, uuid):
+        # Objects changed since loadSnapshot are stored as None and fetched again
+        if self.snapshot is not None and uuid != '' and self.snapshot[objecttype].get(uuid) is not None:
+            return dict(self.snapshot[objecttype][uuid])
         url = self.url + '/api/haproxy/settings/get' + objecttype + '/' + uuid
         #obj = self.getRequest(url)[objecttype]
         obj = dict(self.getRequest(url)[objecttype])
-        return obj
+        if self.snapshot is not None and uuid != '':
+            self.snapshot[objecttype][uuid] = obj
+        return dict(obj)
+
+    def getObjectsByUuids(self, objecttype, uuids, max_workers=8):
+        # Fetch many objects in parallel over the pooled session.
+        # Returns the objects in the order of uuids (None for failed requests) and a dict uuid => error message,
+        # so a single failing request does not abort the whole batch.
+        if objecttype not in self.objecttypes:
+            raise KeyError('Objecttype %s not supported!' % objecttype)
+        uuids = list(uuids)
+        errors = OrderedDict()
+        # Objects already in the snapshot need no request
+        if self.snapshot is not None:
+            missing = [uuid for uuid in uuids if self.snapshot[objecttype].get(uuid) is None]
+            if not missing:
+                return [self.getObjectByUuid(objecttype, uuid) for uuid in uuids], errors
+
+        def fetch(uuid):
+            try:
+                return self.getObjectByUuid(objecttype, uuid)
+            except Exception as e:
+                errors[uuid] = '%s: %s' % (type(e).__name__, e)
+                return None
 
-    def updateObject(self, objecttype, objectname, obj):
+        # More threads than pooled connections would open throwaway connections
+        max_workers = max(1, min(max_workers, self.pool_maxsize, len(uuids)))
+        if not HAS_FUTURES or max_workers == 1:
+            objects = [fetch(uuid) for uuid in uuids]
+        else:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                objects = list(executor.map(fetch, uuids))
+        return objects, errors
+
+    def updateObject(self, objecttype, objectname, obj, reload=True):
+        # Without reload, the change doesn't mark a reload as pending (see HaproxyDiff.reloadImpact)
         if objecttype not in self.objecttypes:
             raise KeyError('Objecttype %s not supported!' % objecttype)
         uuid = self.getUuidByName(objecttype, objectname)
         url = self.url + '/api/haproxy/settings/set' + objecttype + '/' + uuid
         objdict = {objecttype: obj}
         response = self.postRequest(url, objdict)
+        if reload:
+            self.markReloadPending()
+        if self.snapshot is not None:
+            self.snapshot[objecttype][uuid] = None
+        # Keep the index current when an object gets renamed
+        if 'name' in obj and obj['name'] != objectname:
+            self.uuidindex.pop((objecttype, objectname), None)
+            self.uuidindex[(objecttype, obj['name'])] = uuid
+            self.invalidateTemplates(objecttype)
         return  response
+
+
+class HaproxyTargets:
+    # Several firewalls managed the same way: one Haproxy connection (with its own snapshot, caches and reload marker)
+    # per target, the same work runs on up to max_targets of them concurrently.
+    # targets is a list of dicts with name, url, auth and ssl_verify, kwargs are passed to every connection.
+    def __init__(self, targets, max_targets=4, max_reloads=1, **kwargs):
+        self.connections = OrderedDict()
+        for target in targets:
+            name = target.get('name') or target['url']
+            if name in self.connections:
+                raise ValueError('Target %s given more than once!' % name)
+            self.connections[name] = Haproxy(target['url'], target['auth'], target.get('ssl_verify', False), **kwargs)
+        self.max_targets = max_targets
+        # At most max_reloads firewalls run configtest and reconfigure at the same time, e.g. 1 to reload the members of a pair in turn
+        self.reloads = threading.BoundedSemaphore(max(1, max_reloads))
+
+    def applyConfig(self, name):
+        with self.reloads:
+            return self.connections[name].applyConfig()
+
+    def run(self, function):
+        # Calls function(name, apiconnection) for every target.
+        # Returns name => (result, None) or (None, error message), a failing target doesn't stop the others.
+        def call(name):
+            try:
+                return function(name, self.connections[name]), None
+            except Exception as e:
+                return None, '%s: %s' % (type(e).__name__, e)
+
+        names = list(self.connections)
+        if not HAS_FUTURES or self.max_targets <= 1 or len(names) <= 1:
+            outcomes = [call(name) for name in names]
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.max_targets, len(names))) as executor:
+                outcomes = list(executor.map(call, names))
+        return OrderedDict(zip(names, outcomes))
+
+    def getApiStats(self):
+        return OrderedDict((name, apiconnection.getApiStats()) for name, apiconnection in self.connections.items())
@@ -0,0 +1,315 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2019, Markus Joosten https://github.com/mj84
+from __future__ import absolute_import, division, print_function
+
+# asyncio based client for the OPNsense HAProxy API with the same surface as OpnsenseApi.Haproxy
+# (listObjects, getObjectByUuid, createObject, updateObject, deleteObject, applyConfig, ...).
+# Up to concurrency requests per firewall are in flight at once over a shared pool of keep-alive connections,
+# which makes reading thousands of objects one by one a lot faster than sending the requests in sequence.
+# Modules use it through HaproxySync, which runs the coroutines on its own event loop.
+# Requires aiohttp (Python 3 only).
+
+import asyncio
+import base64
+import errno
+import functools
+import json
+import os
+import random
+import time
+from collections import OrderedDict
+
+from ansible.module_utils.opnsense_utils import OpnsenseApi
+
+try:
+    import aiohttp
+    HAS_AIOHTTP = True
+except ImportError:
+    HAS_AIOHTTP = False
+
+
+class HaproxyAsync:
+    def __init__(self, url, auth, ssl_verify, concurrency=16, connect_timeout=10, read_timeout=120, statedir=None,
+                 retries=3, backoff=0.5, backoff_max=10):
+        if not HAS_AIOHTTP:
+            raise ImportError('The asyncio API client requires the python aiohttp package')
+        self.url = url
+        self.auth = auth
+        self.ssl_verify = ssl_verify
+        self.objecttypes = ['acl', 'action', 'cpu', 'backend', 'errorfile', 'frontend', 'group', 'healthcheck', 'lua', 'mapfile', 'server', 'user']
+        self.concurrency = concurrency
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        # The session and the semaphore belong to the event loop they are created in, see getSession
+        self.session = None
+        self.semaphore = None
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.retrycount = 0
+        self.timeoutcount = 0
+        self.requestcount = 0
+        self.connections = 0
+        # One record per API call, same format as OpnsenseApi.Haproxy.calls
+        self.calls = []
+        self.started = time.time()
+        # Index of (objecttype, name) => uuid, see OpnsenseApi.Haproxy.uuidindex
+        self.uuidindex = {}
+        self.indexedtypes = set()
+        # Shares the private state dir, and with it the pending reload marker, with OpnsenseApi.Haproxy
+        self.statedir = statedir if statedir is not None else OpnsenseApi.getStateDir()
+
+    async def getSession(self):
+        if self.session is None:
+            # The connector never opens more than concurrency connections and keeps them alive between requests
+            connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.concurrency,
+                                             ssl=None if self.ssl_verify else False)
+            timeout = aiohttp.ClientTimeout(sock_connect=self.connect_timeout, sock_read=self.read_timeout)
+            # Count newly opened connections, every other request reused one
+            trace = aiohttp.TraceConfig()
+            trace.on_connection_create_end.append(self.onConnectionCreated)
+            # Basic auth as a header, newer aiohttp versions deprecate the auth parameter
+            credentials = base64.b64encode(('%s:%s' % self.auth).encode('utf-8')).decode('ascii')
+            self.session = aiohttp.ClientSession(connector=connector, timeout=timeout, trace_configs=[trace],
+                                                 headers={'Authorization': 'Basic ' + credentials})
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+        return self.session
+
+    async def onConnectionCreated(self, session, context, params):
+        self.connections += 1
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def recordRequest(self, method, url, status, size, started):
+        finished = time.time()
+        self.requestcount += 1
+        self.calls.append(OrderedDict([
+            ('method', method),
+            ('endpoint', OpnsenseApi.getEndpointTemplate(self.url, url)),
+            ('status', status),
+            ('bytes', size),
+            ('start_ms', round((started - self.started) * 1000, 1)),
+            ('ms', round((finished - started) * 1000, 1)),
+        ]))
+
+    def getApiStats(self):
+        api_stats = OpnsenseApi.summarizeCalls(self.calls)
+        api_stats['retries'] = self.retrycount
+        api_stats['timeouts'] = self.timeoutcount
+        api_stats['connections'] = self.connections
+        api_stats['connections_reused'] = max(self.requestcount - self.connections, 0)
+        api_stats['concurrency'] = self.concurrency
+        return api_stats
+
+    def writeTimeline(self, path):
+        with open(path, 'w') as f:
+            json.dump({'url': self.url, 'calls': self.calls}, f, indent=2)
+
+    def getBackoff(self, attempt):
+        return random.uniform(0, min(self.backoff_max, self.backoff * (2 ** (attempt - 1))))
+
+    async def sendRequest(self, method, url, data=None):
+        # Same retry rules as OpnsenseApi.Haproxy.sendRequest: only GETs and OpnsenseApi.RETRY_ENDPOINTS are sent again
+        retry = method == 'GET' or OpnsenseApi.getEndpointTemplate(self.url, url) in OpnsenseApi.RETRY_ENDPOINTS
+        session = await self.getSession()
+        attempt = 0
+        while True:
+            started = time.time()
+            try:
+                async with self.semaphore:
+                    async with session.request(method, url, json=data) as r:
+                        body = await r.read()
+                        status = r.status
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                self.recordRequest(method, url, None, 0, started)
+                if isinstance(e, asyncio.TimeoutError):
+                    self.timeoutcount += 1
+                if not retry or attempt >= self.retries:
+                    raise
+            else:
+                self.recordRequest(method, url, status, len(body), started)
+                if status not in OpnsenseApi.RETRY_STATUS or not retry:
+                    return status, body
+                if attempt >= self.retries:
+                    raise ValueError('API request %s %s failed with HTTP %s' %(method, url, status))
+            attempt += 1
+            self.retrycount += 1
+            await asyncio.sleep(self.getBackoff(attempt))
+
+    async def getRequest(self, url):
+        status, body = await self.sendRequest('GET', url)
+        if status >= 400:
+            raise ValueError('API request GET %s failed with HTTP %s' %(url, status))
+        # Keep the order of properties, see OpnsenseApi.Haproxy.getRequest
+        return json.loads(body.decode('utf-8'), object_pairs_hook=OrderedDict)
+
+    async def postRequest(self, url, data):
+        status, body = await self.sendRequest('POST', url, data)
+        r_json = json.loads(body.decode('utf-8'))
+        if ('result' in r_json and 'failed' in r_json['result']) or 'errorMessage' in r_json:
+            raise ValueError('API threw an error: %s' % r_json)
+        return r_json
+
+    def checkObjecttype(self, objecttype):
+        if objecttype not in self.objecttypes:
+            raise KeyError('Objecttype %s not supported!' % objecttype)
+
+    def indexObjects(self, objecttype, rows):
+        for key in [key for key in self.uuidindex if key[0] == objecttype]:
+            del self.uuidindex[key]
+        for row in rows:
+            self.uuidindex[(objecttype, row['name'])] = row['uuid']
+        self.indexedtypes.add(objecttype)
+
+    async def listObjects(self, objecttype):
+        self.checkObjecttype(objecttype)
+        url = self.url + '/api/haproxy/settings/search' + objecttype + 's'
+        objs = await self.getRequest(url)
+        self.indexObjects(objecttype, objs['rows'])
+        return objs['rows']
+
+    async def getUuidByName(self, objecttype, name):
+        self.checkObjecttype(objecttype)
+        if name == '':
+            return ''
+        if objecttype not in self.indexedtypes:
+            await self.listObjects(objecttype)
+        if (objecttype, name) in self.uuidindex:
+            return self.uuidindex[(objecttype, name)]
+        raise KeyError('Found no object of type %s with name %s!' %(objecttype, name))
+
+    async def getObjectByName(self, objecttype, name):
+        uuid = await self.getUuidByName(objecttype, name)
+        return await self.getObjectByUuid(objecttype, uuid)
+
+    async def getObjectByUuid(self, objecttype, uuid):
+        self.checkObjecttype(objecttype)
+        url = self.url + '/api/haproxy/settings/get' + objecttype + '/' + uuid
+        obj = await self.getRequest(url)
+        return dict(obj[objecttype])
+
+    async def getObjectsByUuids(self, objecttype, uuids):
+        # Like OpnsenseApi.Haproxy.getObjectsByUuids: objects in the order of uuids (None for failed requests)
+        # and a dict uuid => error message
+        uuids = list(uuids)
+        errors = OrderedDict()
+
+        async def fetch(uuid):
+            try:
+                return await self.getObjectByUuid(objecttype, uuid)
+            except Exception as e:
+                errors[uuid] = '%s: %s' % (type(e).__name__, e)
+                return None
+
+        objects = await asyncio.gather(*[fetch(uuid) for uuid in uuids])
+        return list(objects), errors
+
+    async def getAllObjects(self, objecttype):
+        # Full state of one type: list it, then fetch every object concurrently.
+        # Returns an OrderedDict uuid => object in listing order and the errors of getObjectsByUuids.
+        rows = await self.listObjects(objecttype)
+        uuids = [row['uuid'] for row in rows]
+        objects, errors = await self.getObjectsByUuids(objecttype, uuids)
+        return OrderedDict(zip(uuids, objects)), errors
+
+    async def createObject(self, objecttype, objectname, properties):
+        self.checkObjecttype(objecttype)
+        properties['name'] = objectname
+        url = self.url + '/api/haproxy/settings/add' + objecttype
+        response = await self.postRequest(url, {objecttype: properties})
+        self.markReloadPending()
+        if 'uuid' in response:
+            self.uuidindex[(objecttype, objectname)] = response['uuid']
+        else:
+            self.indexedtypes.discard(objecttype)
+        return response
+
+    async def updateObject(self, objecttype, objectname, obj, reload=True):
+        self.checkObjecttype(objecttype)
+        uuid = await self.getUuidByName(objecttype, objectname)
+        url = self.url + '/api/haproxy/settings/set' + objecttype + '/' + uuid
+        response = await self.postRequest(url, {objecttype: obj})
+        if reload:
+            self.markReloadPending()
+        if 'name' in obj and obj['name'] != objectname:
+            self.uuidindex.pop((objecttype, objectname), None)
+            self.uuidindex[(objecttype, obj['name'])] = uuid
+        return response
+
+    async def deleteObject(self, objecttype, objectname):
+        self.checkObjecttype(objecttype)
+        uuid = await self.getUuidByName(objecttype, objectname)
+        url = self.url + '/api/haproxy/settings/del' + objecttype + '/' + uuid
+        response = await self.postRequest(url, {})
+        self.markReloadPending()
+        self.uuidindex.pop((objecttype, objectname), None)
+        return response
+
+    async def applyConfig(self):
+        configtest = await self.postRequest(self.url + '/api/haproxy/service/configtest', {})
+        if 'is valid' in configtest['result']:
+            reconfigure = await self.postRequest(self.url + '/api/haproxy/service/reconfigure', {})
+            self.clearReloadPending()
+            return configtest, reconfigure
+        else:
+            raise ValueError('Configtest did not succeed!')
+
+    # The pending reload marker is shared with OpnsenseApi.Haproxy
+
+    def markReloadPending(self):
+        # Created exclusively like OpnsenseApi.Haproxy.markReloadPending
+        try:
+            fd = os.open(OpnsenseApi.getReloadMarker(self.url, self.statedir), os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except OSError as e:
+            if e.errno == errno.EEXIST:
+                return
+            raise
+        with os.fdopen(fd, 'w') as marker:
+            marker.write('%s\n' % time.time())
+
+    def isReloadPending(self):
+        return os.path.exists(OpnsenseApi.getReloadMarker(self.url, self.statedir))
+
+    def clearReloadPending(self):
+        try:
+            os.remove(OpnsenseApi.getReloadMarker(self.url, self.statedir))
+        except OSError:
+            pass
+
+
+class HaproxySync:
+    # Blocking wrapper around HaproxyAsync for AnsibleModule code:
+    # every coroutine method of the client is run to completion on an event loop owned by this wrapper,
+    # e.g. HaproxySync(url, auth, False).getAllObjects('server')
+    def __init__(self, url, auth, ssl_verify, **kwargs):
+        self.client = HaproxyAsync(url, auth, ssl_verify, **kwargs)
+        self.loop = asyncio.new_event_loop()
+
+    def run(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    def __getattr__(self, name):
+        attribute = getattr(self.client, name)
+        if not asyncio.iscoroutinefunction(attribute):
+            return attribute
+
+        @functools.wraps(attribute)
+        def wrapper(*args, **kwargs):
+            return self.run(attribute(*args, **kwargs))
+        return wrapper
+
+    def close(self):
+        if not self.loop.is_closed():
+            self.run(self.client.close())
+            self.loop.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
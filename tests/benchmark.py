@@ -0,0 +1,208 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2019, Markus Joosten https://github.com/mj84
+from __future__ import absolute_import, division, print_function
+
+# Runs every module in library/ against the local mock API (tests/mock_opnsense.py)
+# with a growing number of existing objects and reports wall time, HTTP requests and peak memory.
+# Like with Ansible, every module run gets its own process, the mock runs in another one.
+#
+# Usage: python tests/benchmark.py [--sizes 10,1000,10000] [--latency 0.005] [--json results.json]
+
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+# Importing the mock makes the role's module_utils importable
+import mock_opnsense
+
+from ansible.module_utils import basic
+from ansible.module_utils._text import to_bytes
+from ansible.module_utils.opnsense_utils import OpnsenseApi
+
+LIBRARY_DIR = os.path.join(mock_opnsense.ROLE_DIR, 'library')
+MOCK = os.path.abspath(mock_opnsense.__file__).replace('.pyc', '.py')
+
+
+# Runs of a scenario: the first one changes the firewall, the last one must find nothing to change
+PHASES = [('converge', {}), ('noop', {})]
+
+
+def scenarios(size, workdir):
+    # (name, module, arguments, number of objects managed by the run, phases with their extra arguments)
+    # Objects named *0 and *1 are created by Model.populate
+    servers = dict(('server%d' % i, {'address': '10.0.%d.%d' % (i // 250, i % 250 + 1), 'port': '80'}) for i in range(size))
+
+    def newServers(prefix):
+        return dict(('%s%d' % (prefix, i), {'address': '10.1.%d.%d' % (i // 250, i % 250 + 1), 'port': '80'}) for i in range(size))
+
+    converge = {'server': newServers('bench_converge'), 'backend': {'bench_converge': {'linked_servers': ['bench_converge0']}}}
+    plan = {'server': newServers('bench_plan'), 'backend': {'bench_plan': {'linked_servers': ['bench_plan0']}}}
+    addresses = ['10.2.%d.%d' % (i // 250, i % 250 + 1) for i in range(size)]
+    scenarios = [
+        ('acl', 'opnsense_haproxy_acl', {'acl_name': 'bench_acl', 'acl_expression': 'hdr', 'acl_hdr': 'bench.example.com',
+                                         'acl_allowed_users': ['user0']}, 1),
+        ('action', 'opnsense_haproxy_action', {'action_name': 'bench_action', 'action_type': 'use_backend',
+                                               'action_value': 'backend0', 'action_linked_acls': ['acl0', 'acl1']}, 1),
+        ('backend', 'opnsense_haproxy_backend', {'backend_name': 'bench_backend', 'backend_linked_servers': ['server0', 'server1']}, 1),
+        ('cpu', 'opnsense_haproxy_cpu', {'cpu_name': 'bench_cpu', 'cpu_cpu_id': ['x1', 'x2']}, 1),
+        ('errorfile', 'opnsense_haproxy_errorfile', {'errorfile_name': 'bench_errorfile', 'errorfile_code': '503',
+                                                     'errorfile_content': 'HTTP/1.0 503 Service Unavailable'}, 1),
+        ('frontend', 'opnsense_haproxy_frontend', {'frontend_name': 'bench_frontend', 'frontend_bind': ['0.0.0.0:80'],
+                                                   'frontend_default_backend': 'backend0'}, 1),
+        ('group', 'opnsense_haproxy_group', {'group_name': 'bench_group', 'group_members': ['user0', 'user1']}, 1),
+        ('healthcheck', 'opnsense_haproxy_healthcheck', {'healthcheck_name': 'bench_healthcheck'}, 1),
+        ('lua', 'opnsense_haproxy_lua', {'lua_name': 'bench_lua', 'lua_content': 'core.Info("bench")'}, 1),
+        ('mapfile', 'opnsense_haproxy_mapfile', {'mapfile_name': 'bench_mapfile', 'mapfile_content': 'bench.example.com backend0'}, 1),
+        ('server', 'opnsense_haproxy_server', {'server_name': 'bench_server', 'server_address': '192.0.2.1', 'server_port': '80'}, 1),
+        ('user', 'opnsense_haproxy_user', {'user_name': 'bench_user', 'user_password': 'benchpassword'}, 1),
+        ('bulk server snapshot', 'opnsense_haproxy_bulk', {'objecttype': 'server', 'items': servers, 'snapshot': True}, size),
+        ('bulk server', 'opnsense_haproxy_bulk', {'objecttype': 'server', 'items': servers, 'snapshot': False}, size),
+        ('converge', 'opnsense_haproxy_converge', {'objects': converge}, size + 1),
+        # The plan is applied in between, so the second plan is empty
+        ('plan', 'opnsense_haproxy_plan', {'objects': plan, 'plan_file': os.path.join(workdir, 'plan.json')}, size + 1,
+         [('plan', {'mode': 'plan'}), ('apply', {'mode': 'apply'}), ('noop', {'mode': 'plan'})]),
+        ('validate', 'opnsense_haproxy_validate', {'objects': converge}, size + 1),
+        ('server_pool', 'opnsense_haproxy_server_pool', {'pool_name': 'bench_pool', 'pool_addresses': addresses, 'pool_port': '80',
+                                                          'pool_backend': 'backend0'}, size),
+        # The targets carry their own credentials
+        ('multi', 'opnsense_haproxy_multi', {'targets': [{'name': 'bench'}], 'objects': {'server': newServers('bench_multi')}}, size),
+        # Model.populate fills four types
+        ('facts', 'opnsense_haproxy_facts', {}, 4 * size),
+        # Forced configtest and reconfigure, then nothing is pending
+        ('apply', 'opnsense_haproxy_apply', {}, 1, [('converge', {'force': True}), ('noop', {})]),
+    ]
+    return [scenario if len(scenario) == 5 else scenario + (PHASES,) for scenario in scenarios]
+
+
+def runModule(module, args):
+    # Run a module in-process the way Ansible would, return its JSON result
+    basic._ANSIBLE_ARGS = to_bytes(json.dumps({'ANSIBLE_MODULE_ARGS': args}))
+    # Newer ansible-core versions also expect the serialization profile set by the module wrapper
+    basic._ANSIBLE_PROFILE = 'legacy'
+    spec = importlib.util.spec_from_file_location(module, os.path.join(LIBRARY_DIR, module + '.py'))
+    code = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(code)
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        try:
+            code.main()
+        except SystemExit:
+            pass
+    return json.loads(output.getvalue())
+
+
+class Mock:
+    # The mock runs in its own process, so its CPU time and memory don't show up in the measurements
+    def __init__(self, size, latency):
+        self.process = subprocess.Popen([sys.executable, MOCK, '--port', '0', '--objects', str(size), '--latency', str(latency)],
+                                        stdout=subprocess.PIPE, universal_newlines=True)
+        line = self.process.stdout.readline()
+        if not line:
+            raise RuntimeError('Mock OPNsense API did not start')
+        self.url = line.split()[-1]
+
+    def requestCount(self):
+        return requests.get(self.url + '/mock/stats').json()['requests']
+
+    def stop(self):
+        self.process.terminate()
+        self.process.wait()
+        self.process.stdout.close()
+
+
+def measure(mock, module, args):
+    before = mock.requestCount()
+    child = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--run', module],
+                             stdin=subprocess.PIPE, stdout=subprocess.PIPE, universal_newlines=True)
+    run = json.loads(child.communicate(json.dumps(args))[0])
+    return run['result'], run['wall'], mock.requestCount() - before, run['peak_rss_kib']
+
+
+def runChild(module):
+    # Child process: run one module with the arguments from stdin
+    args = json.load(sys.stdin)
+    start = time.time()
+    result = runModule(module, args)
+    wall = time.time() - start
+    # ru_maxrss is in KiB on Linux (bytes on macOS) and includes the interpreter and Ansible itself
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    sys.stdout.write(json.dumps({'result': result, 'wall': wall, 'peak_rss_kib': peak}))
+
+
+def benchmark(size, latency):
+    mock = Mock(size, latency)
+    credentials = {'api_url': mock.url, 'api_key': 'benchkey', 'api_secret': 'benchsecret'}
+    workdir = tempfile.mkdtemp()
+    results = []
+    try:
+        for name, module, args, objects, phases in scenarios(size, workdir):
+            if 'targets' in args:
+                args = dict(args, targets=[dict(target, **credentials) for target in args['targets']])
+            else:
+                args = dict(args, **credentials)
+            for phase, extra in phases:
+                result, wall, requestcount, peak = measure(mock, module, dict(args, **extra))
+                results.append({
+                    'size': size,
+                    'scenario': name,
+                    'phase': phase,
+                    'failed': bool(result.get('failed')),
+                    'changed': bool(result.get('changed')),
+                    'wall_s': round(wall, 3),
+                    'requests': requestcount,
+                    'requests_per_object': round(requestcount / float(objects), 2),
+                    'peak_rss_kib': peak,
+                })
+    finally:
+        # Don't leave a pending reload marker for the mock behind
+        OpnsenseApi.Haproxy(mock.url, (credentials['api_key'], credentials['api_secret']), False).clearReloadPending()
+        mock.stop()
+        shutil.rmtree(workdir)
+    return results
+
+
+def report(results):
+    columns = ['size', 'scenario', 'phase', 'wall_s', 'requests', 'requests_per_object', 'peak_rss_kib', 'changed', 'failed']
+    widths = dict((column, max(len(column), max(len(str(row[column])) for row in results))) for column in columns)
+    lines = ['  '.join(column.ljust(widths[column]) for column in columns)]
+    for row in results:
+        lines.append('  '.join(str(row[column]).ljust(widths[column]) for column in columns))
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the opnsense_haproxy modules against the mock API')
+    parser.add_argument('--sizes', default='10,1000,10000', help='comma separated numbers of objects per type')
+    parser.add_argument('--latency', type=float, default=0.005, help='seconds added to every request')
+    parser.add_argument('--json', help='also write the results to this file')
+    parser.add_argument('--run', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.run:
+        return runChild(args.run)
+    results = []
+    for size in [int(size) for size in args.sizes.split(',')]:
+        results.extend(benchmark(size, args.latency))
+    sys.stdout.write(report(results) + '\n')
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    # A failed or non idempotent module run is a regression as well
+    return 1 if [row for row in results if row['failed'] or (row['phase'] == 'noop' and row['changed'])] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2019, Markus Joosten https://github.com/mj84
+from __future__ import absolute_import, division, print_function
+
+# Fixtures shared by the tests: a mock OPNsense API per test (tests/mock_opnsense.py)
+# and a private temp dir, so reload markers, snapshot caches and plans don't leak between tests.
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+# Importing the mock makes the role's module_utils importable
+import mock_opnsense
+import benchmark
+
+
+@pytest.fixture(autouse=True)
+def tempdir(tmp_path, monkeypatch):
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmp_path))
+    monkeypatch.setenv('TMPDIR', str(tmp_path))
+    return tmp_path
+
+
+@pytest.fixture
+def mock():
+    server = mock_opnsense.MockServer().start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def api(mock):
+    # Connection arguments of every module
+    return {'api_url': mock.url, 'api_key': 'key', 'api_secret': 'secret'}
+
+
+@pytest.fixture
+def run_module():
+    # Run a module from library/ in-process, return its result
+    return benchmark.runModule
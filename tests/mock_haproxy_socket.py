@@ -0,0 +1,148 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2019, Markus Joosten https://github.com/mj84
+from __future__ import absolute_import, division, print_function
+
+# Local stand-in for the HAProxy runtime API (stats socket) on TCP.
+# Implements "show servers state [<backend>]" and "set server <backend>/<server> weight|state",
+# several commands per line separated by ;. With a mock_opnsense.Model, the running servers are
+# the servers linked to the enabled backends of the model at its last reconfigure.
+#
+# Usage: python tests/mock_haproxy_socket.py [--port 9999] [--api-port 8080]
+
+import argparse
+import sys
+import threading
+from collections import OrderedDict
+
+try:
+    from socketserver import StreamRequestHandler, TCPServer, ThreadingMixIn
+except ImportError:
+    from SocketServer import StreamRequestHandler, TCPServer, ThreadingMixIn
+
+STATES = {'ready': 0, 'drain': 0x08, 'maint': 0x01}
+HEADER = '# be_id be_name srv_id srv_name srv_addr srv_op_state srv_admin_state srv_uweight srv_iweight'
+
+
+class Handler(StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline().decode('utf-8').strip()
+        output = []
+        for command in line.split(';'):
+            output.append(self.server.execute(command.strip()))
+        self.wfile.write(''.join(output).encode('utf-8'))
+
+
+class MockRuntimeSocket(ThreadingMixIn, TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address=('127.0.0.1', 0), model=None):
+        TCPServer.__init__(self, address, Handler)
+        self.model = model
+        self.lock = threading.Lock()
+        # backend => server => {'weight': int, 'admin': int}
+        self.backends = OrderedDict()
+        self.commands = []
+        self.reloads = None
+
+    @property
+    def address(self):
+        return '%s:%d' % self.server_address[:2]
+
+    def reload(self):
+        # Rebuild the running servers from the model, like a reconfigure does
+        backends = OrderedDict()
+        with self.model.lock:
+            for backend in self.model.objects['backend'].values():
+                if backend.get('enabled', '1') == '0':
+                    continue
+                servers = OrderedDict()
+                for uuid in [uuid for uuid in backend.get('linkedServers', '').split(',') if uuid != '']:
+                    server = self.model.objects['server'].get(uuid)
+                    if server is None:
+                        continue
+                    weight = int(server.get('weight') or 1)
+                    disabled = server.get('mode') == 'disabled' or server.get('enabled') == '0'
+                    servers[server['name']] = {'weight': weight, 'admin': 0x05 if disabled else 0,
+                                               'address': server.get('address', '')}
+                backends[backend['name']] = servers
+            self.reloads = self.model.reloads
+        self.backends = backends
+
+    def addServer(self, backend, server, weight=1, admin=0, address='127.0.0.1'):
+        with self.lock:
+            self.backends.setdefault(backend, OrderedDict())[server] = {'weight': weight, 'admin': admin, 'address': address}
+
+    def execute(self, command):
+        with self.lock:
+            if self.model is not None and self.model.reloads != self.reloads:
+                self.reload()
+            self.commands.append(command)
+            words = command.split()
+            if words[:3] == ['show', 'servers', 'state']:
+                return self.showState(words[3:])
+            if words[:2] == ['set', 'server'] and len(words) == 5:
+                return self.setServer(words[2], words[3], words[4])
+            return 'Unknown command.\n'
+
+    def showState(self, args):
+        if args and args[0] not in self.backends:
+            return "Can't find backend.\n"
+        lines = ['1', HEADER]
+        for be_id, (backend, servers) in enumerate(self.backends.items(), 1):
+            if args and args[0] != backend:
+                continue
+            for srv_id, (name, server) in enumerate(servers.items(), 1):
+                lines.append('%d %s %d %s %s %d %d %d %d' % (be_id, backend, srv_id, name, server['address'],
+                                                               0 if server['admin'] & 0x05 else 2, server['admin'],
+                                                               server['weight'], server['weight']))
+        return '\n'.join(lines) + '\n\n'
+
+    def setServer(self, target, prop, value):
+        backend, sep, name = target.partition('/')
+        if backend not in self.backends:
+            return 'No such backend.\n'
+        if name not in self.backends[backend]:
+            return 'No such server.\n'
+        server = self.backends[backend][name]
+        if prop == 'weight':
+            if not value.isdigit() or int(value) > 256:
+                return 'Absolute weight can only be between 0 and 256 inclusive.\n'
+            server['weight'] = int(value)
+            return ''
+        if prop == 'state':
+            if value not in STATES:
+                return "'set server <srv> state' expects 'ready', 'drain' and 'maint'.\n"
+            # ready and drain leave the configured maintenance, like HAProxy does for forced states
+            server['admin'] = STATES[value]
+            return ''
+        return "'set server <srv>' only supports 'agent', 'health', 'state', 'weight', 'addr', 'fqdn' and 'check-port'.\n"
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in for the HAProxy runtime API')
+    parser.add_argument('--port', type=int, default=9999, help='0 picks a free port')
+    parser.add_argument('--api-port', type=int, help='also serve a mock OPNsense API on this port and mirror its servers')
+    args = parser.parse_args()
+    model = None
+    if args.api_port is not None:
+        import mock_opnsense
+        api = mock_opnsense.MockServer(('127.0.0.1', args.api_port)).start()
+        model = api.model
+        sys.stdout.write('Serving mock OPNsense HAProxy API on %s\n' % api.url)
+    server = MockRuntimeSocket(('127.0.0.1', args.port), model=model)
+    sys.stdout.write('Serving mock HAProxy runtime API on %s\n' % server.address)
+    sys.stdout.flush()
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
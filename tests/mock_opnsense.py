@@ -0,0 +1,626 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2019, Markus Joosten https://github.com/mj84
+from __future__ import absolute_import, division, print_function
+
+# Local stand-in for the OPNsense HAProxy API.
+# Implements /api/haproxy/settings/{search,get,add,set,del}<type>, /api/haproxy/service/{configtest,reconfigure}
+# and /api/core/backup/backups/this (the config revision), and renders objects the way OPNsense does, including the option dicts with 'selected' markers.
+# Object types, properties, defaults and option lists follow the OPNsense HAProxy model (HAProxy.xml), not the role's HaproxySchema.
+# GET /mock/stats returns the number of API requests served so far (for tests/benchmark.py).
+#
+# Usage: python tests/mock_opnsense.py [--port 8080] [--latency 0.02] [--objects 1000] [--error-rate 0.1]
+
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid as uuidlib
+from collections import OrderedDict
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qsl
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qsl
+
+# Make the role's module_utils importable as ansible.module_utils.opnsense_utils
+import ansible.module_utils
+ROLE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if os.path.join(ROLE_DIR, 'module_utils') not in ansible.module_utils.__path__:
+    ansible.module_utils.__path__.append(os.path.join(ROLE_DIR, 'module_utils'))
+
+OBJECTTYPES = ['acl', 'action', 'backend', 'cpu', 'errorfile', 'frontend', 'group', 'healthcheck', 'lua', 'mapfile', 'server', 'user']
+
+# Name of each type's container in settings/get
+CONTAINERS = dict((objecttype, objecttype + 's') for objecttype in OBJECTTYPES)
+
+# Field types of the OPNsense model (HAProxy.xml), as far as they change how a property is stored and rendered:
+# TextField, IntegerField and friends
+TEXT = 'text'
+# BooleanField, '0' or '1'
+BOOLEAN = 'boolean'
+# OptionField, one key of a fixed list
+OPTION = 'option'
+# OptionField with Multiple, comma separated keys
+OPTIONS = 'options'
+# CSVListField, free values rendered like selected options
+LIST = 'list'
+# ModelRelationField, the UUID of another object (or several with Multiple)
+RELATION = 'relation'
+RELATIONS = 'relations'
+# CertificateField, the refid of a certificate, CA or CRL (or several)
+CERTIFICATE = 'certificate'
+CERTIFICATES = 'certificates'
+
+SELECT_TYPES = (OPTION, RELATION, CERTIFICATE)
+MULTIPLE_TYPES = (OPTIONS, LIST, RELATIONS, CERTIFICATES)
+
+COMPARISONS = ['', 'gt', 'ge', 'eq', 'lt', 'le']
+PROCESSES = ['all', 'odd', 'even'] + ['x%d' % i for i in range(64)]
+DATA_TYPES = ['conn_cnt', 'conn_cur', 'conn_rate', 'sess_cnt', 'sess_rate', 'http_req_cnt', 'http_req_rate',
+              'http_err_cnt', 'http_err_rate', 'bytes_in_cnt', 'bytes_in_rate', 'bytes_out_cnt', 'bytes_out_rate']
+CIPHERS = 'ECDHE-ECDSA-AES256-GCM-SHA384:ECDHE-RSA-AES256-GCM-SHA384:ECDHE-ECDSA-CHACHA20-POLY1305:ECDHE-RSA-CHACHA20-POLY1305:' \
+          'ECDHE-ECDSA-AES128-GCM-SHA256:ECDHE-RSA-AES128-GCM-SHA256:ECDHE-ECDSA-AES256-SHA384:ECDHE-RSA-AES256-SHA384:' \
+          'ECDHE-ECDSA-AES128-SHA256:ECDHE-RSA-AES128-SHA256'
+
+# Types of actions, OPNsense returns the value properties of all of them for every action
+ACTION_TYPES = ['use_backend', 'use_server', 'map_use_backend', 'http-request_allow', 'http-request_deny', 'http-request_tarpit',
+                'http-request_auth', 'http-request_redirect', 'http-request_lua', 'http-request_use-service',
+                'http-request_add-header', 'http-request_set-header', 'http-request_del-header', 'http-request_replace-header',
+                'http-request_replace-value', 'http-request_set-path', 'http-response_allow', 'http-response_deny',
+                'http-response_lua', 'http-response_add-header', 'http-response_set-header', 'http-response_del-header',
+                'http-response_replace-header', 'http-response_replace-value', 'http-response_set-status',
+                'tcp-request_connection_accept', 'tcp-request_connection_reject', 'tcp-request_content_accept',
+                'tcp-request_content_reject', 'tcp-request_content_lua', 'tcp-request_content_use-service',
+                'tcp-request_inspect-delay', 'tcp-response_content_accept', 'tcp-response_content_reject',
+                'tcp-response_content_lua', 'tcp-response_inspect-delay', 'custom']
+
+# Value properties of the actions
+ACTION_VALUES = ['use_server', 'map_use_backend', 'http_request_allow', 'http_request_deny', 'http_request_tarpit', 'http_request_auth',
+                 'http_request_redirect', 'http_request_lua', 'http_request_use_service',
+                 'http_request_add_header_name', 'http_request_add_header_content',
+                 'http_request_set_header_name', 'http_request_set_header_content', 'http_request_del_header_name',
+                 'http_request_replace_header_name', 'http_request_replace_header_regex',
+                 'http_request_replace_value_name', 'http_request_replace_value_regex', 'http_request_set_path',
+                 'http_response_allow', 'http_response_deny', 'http_response_lua',
+                 'http_response_add_header_name', 'http_response_add_header_content',
+                 'http_response_set_header_name', 'http_response_set_header_content', 'http_response_del_header_name',
+                 'http_response_replace_header_name', 'http_response_replace_header_regex',
+                 'http_response_replace_value_name', 'http_response_replace_value_regex',
+                 'http_response_set_status_code', 'http_response_set_status_reason',
+                 'tcp_request_connection_accept', 'tcp_request_connection_reject', 'tcp_request_content_accept',
+                 'tcp_request_content_reject', 'tcp_request_content_lua', 'tcp_request_content_use_service',
+                 'tcp_request_inspect_delay', 'tcp_response_content_accept', 'tcp_response_content_reject',
+                 'tcp_response_content_lua', 'tcp_response_inspect_delay', 'custom']
+
+# SSL objects (certificates, CAs, CRLs) live outside of HAProxy and are only offered as options
+SSL_OBJECTS = OrderedDict([
+    ('5d6d1e7b4c1a1', 'Web GUI certificate'),
+    ('5d6d1e7b4c1a2', 'Internal CA'),
+    ('5d6d1e7b4c1a3', 'Internal CRL'),
+    ('5d6d1e7b4c1a4', 'Client certificate'),
+])
+
+
+def prop(name, fieldtype=TEXT, default='', choices=None):
+    # choices is the list of keys of an option field or the objecttype of a relation
+    return (name, fieldtype, default, choices)
+
+
+def comparisons(names):
+    props = []
+    for name in names:
+        props.append(prop(name + '_comparison', OPTION, 'gt', COMPARISONS))
+        props.append(prop(name))
+    return props
+
+
+# Properties of every object type besides name, with their type, the default of a new object and their choices
+MODEL = {
+    'acl': [
+        prop('description'),
+        prop('expression', OPTION, '', ['http_auth', 'hdr_beg', 'hdr_end', 'hdr', 'hdr_reg', 'hdr_sub', 'path_beg', 'path_end', 'path',
+                                        'path_reg', 'path_dir', 'path_sub', 'url_param', 'ssl_c_verify', 'ssl_c_ca_commonname', 'src',
+                                        'nbsrv', 'ssl_fc', 'ssl_fc_sni', 'ssl_sni', 'ssl_sni_sub', 'ssl_sni_beg', 'ssl_sni_end',
+                                        'ssl_sni_reg', 'custom_acl']),
+        prop('negate', BOOLEAN, '0'),
+    ] + [prop(name) for name in ('hdr_beg', 'hdr_end', 'hdr', 'hdr_reg', 'hdr_sub', 'path_beg', 'path_end', 'path', 'path_reg',
+                                 'path_dir', 'path_sub', 'url_param', 'url_param_value', 'ssl_c_verify_code', 'ssl_c_ca_commonname', 'src')]
+    + comparisons(['src_bytes_in_rate', 'src_bytes_out_rate', 'src_conn_cnt', 'src_conn_rate', 'src_http_err_cnt', 'src_http_err_rate',
+                   'src_http_req_rate', 'src_kbytes_in', 'src_kbytes_out', 'src_port', 'src_sess_cnt']) + [
+        prop('nbsrv'),
+        prop('nbsrv_backend', RELATION, '', 'backend'),
+    ] + [prop(name) for name in ('ssl_fc_sni', 'ssl_sni', 'ssl_sni_sub', 'ssl_sni_beg', 'ssl_sni_end', 'ssl_sni_reg', 'custom_acl', 'value')] + [
+        prop('queryBackend', RELATION, '', 'backend'),
+        prop('allowedUsers', RELATIONS, '', 'user'),
+        prop('allowedGroups', RELATIONS, '', 'group'),
+    ],
+    'action': [
+        prop('description'),
+        prop('testType', OPTION, 'if', ['if', 'unless']),
+        prop('linkedAcls', RELATIONS, '', 'acl'),
+        prop('operator', OPTION, 'and', ['and', 'or']),
+        prop('type', OPTION, '', ACTION_TYPES),
+        prop('use_backend', RELATION, '', 'backend'),
+    ] + [prop(name) for name in ACTION_VALUES],
+    'backend': [
+        prop('enabled', BOOLEAN, '1'),
+        prop('description'),
+        prop('mode', OPTION, 'http', ['http', 'tcp']),
+        prop('algorithm', OPTION, 'source', ['source', 'roundrobin', 'static-rr', 'leastconn', 'uri']),
+        prop('proxyProtocol', OPTION, '', ['', 'v1', 'v2']),
+        prop('linkedServers', RELATIONS, '', 'server'),
+        prop('source'),
+        prop('healthCheckEnabled', BOOLEAN, '1'),
+        prop('healthCheck', RELATION, '', 'healthcheck'),
+        prop('healthCheckLogStatus', BOOLEAN, '0'),
+        prop('checkInterval'),
+        prop('checkDownInterval'),
+        prop('healthCheckFall'),
+        prop('healthCheckRise'),
+        prop('persistence', OPTION, 'sticktable', ['', 'sticktable', 'cookie']),
+        prop('persistence_cookiemode', OPTION, 'piggyback', ['piggyback', 'new']),
+        prop('persistence_cookiename', TEXT, 'SRVCOOKIE'),
+        prop('persistence_stripquotes', BOOLEAN, '1'),
+        prop('stickiness_pattern', OPTION, 'sourceipv4', ['', 'sourceipv4', 'sourceipv6', 'cookievalue', 'rdpcookie']),
+        prop('stickiness_dataTypes', OPTIONS, '', DATA_TYPES),
+        prop('stickiness_expire', TEXT, '30m'),
+        prop('stickiness_size', TEXT, '50k'),
+        prop('stickiness_cookiename'),
+        prop('stickiness_cookielength'),
+        prop('stickiness_connRatePeriod', TEXT, '10s'),
+        prop('stickiness_sessRatePeriod', TEXT, '10s'),
+        prop('stickiness_httpReqRatePeriod', TEXT, '10s'),
+        prop('stickiness_httpErrRatePeriod', TEXT, '10s'),
+        prop('stickiness_bytesInRatePeriod', TEXT, '1m'),
+        prop('stickiness_bytesOutRatePeriod', TEXT, '1m'),
+        prop('basicAuthEnabled', BOOLEAN, '0'),
+        prop('basicAuthUsers', RELATIONS, '', 'user'),
+        prop('basicAuthGroups', RELATIONS, '', 'group'),
+        prop('tuning_timeoutConnect'),
+        prop('tuning_timeoutCheck'),
+        prop('tuning_timeoutServer'),
+        prop('tuning_retries'),
+        prop('customOptions'),
+        prop('tuning_defaultserver'),
+        prop('tuning_noport', BOOLEAN, '0'),
+        prop('tuning_httpreuse', OPTION, 'never', ['', 'never', 'safe', 'aggressive', 'always']),
+        prop('linkedActions', RELATIONS, '', 'action'),
+        prop('linkedErrorfiles', RELATIONS, '', 'errorfile'),
+    ],
+    'cpu': [
+        prop('enabled', BOOLEAN, '1'),
+        prop('process_id', OPTION, 'all', PROCESSES),
+        prop('thread_id', OPTION, 'all', PROCESSES),
+        prop('cpu_id', OPTIONS, 'all', PROCESSES),
+    ],
+    'errorfile': [
+        prop('code', OPTION, '', ['200', '400', '403', '405', '408', '429', '500', '502', '503', '504']),
+        prop('description'),
+        prop('content'),
+    ],
+    'frontend': [
+        prop('enabled', BOOLEAN, '1'),
+        prop('description'),
+        prop('bind', LIST),
+        prop('bindOptions'),
+        prop('mode', OPTION, 'http', ['http', 'ssl', 'tcp']),
+        prop('defaultBackend', RELATION, '', 'backend'),
+        prop('ssl_enabled', BOOLEAN, '0'),
+        prop('ssl_certificates', CERTIFICATES),
+        prop('ssl_default_certificate', CERTIFICATE),
+        prop('ssl_customOptions'),
+        prop('ssl_advancedEnabled', BOOLEAN, '0'),
+        prop('ssl_bindOptions', OPTIONS, '', ['no-sslv3', 'no-tlsv10', 'no-tlsv11', 'no-tlsv12', 'no-tls-tickets', 'force-sslv3',
+                                              'force-tlsv10', 'force-tlsv11', 'force-tlsv12', 'strict-sni']),
+        prop('ssl_cipherList', TEXT, CIPHERS),
+        prop('ssl_http2Enabled', BOOLEAN, '0'),
+        prop('ssl_hstsEnabled', BOOLEAN, '1'),
+        prop('ssl_hstsIncludeSubDomains', BOOLEAN, '0'),
+        prop('ssl_hstsPreload', BOOLEAN, '0'),
+        prop('ssl_hstsMaxAge', TEXT, '15768000'),
+        prop('ssl_clientAuthEnabled', BOOLEAN, '0'),
+        prop('ssl_clientAuthVerify', OPTION, 'none', ['none', 'optional', 'required']),
+        prop('ssl_clientAuthCAs', CERTIFICATES),
+        prop('ssl_clientAuthCRLs', CERTIFICATES),
+        prop('basicAuthEnabled', BOOLEAN, '0'),
+        prop('basicAuthUsers', RELATIONS, '', 'user'),
+        prop('basicAuthGroups', RELATIONS, '', 'group'),
+        prop('tuning_maxConnections'),
+        prop('tuning_timeoutClient'),
+        prop('tuning_timeoutHttpReq'),
+        prop('tuning_timeoutHttpKeepAlive'),
+        prop('linkedCpuAffinityRules', RELATIONS, '', 'cpu'),
+        prop('logging_dontLogNull', BOOLEAN, '0'),
+        prop('logging_dontLogNormal', BOOLEAN, '0'),
+        prop('logging_logSeparateErrors', BOOLEAN, '0'),
+        prop('logging_detailedLog', BOOLEAN, '0'),
+        prop('logging_socketStats', BOOLEAN, '0'),
+        prop('stickiness_pattern', OPTION, 'ipv4', ['', 'ipv4', 'ipv6', 'integer', 'string', 'binary']),
+        prop('stickiness_dataTypes', OPTIONS, '', DATA_TYPES),
+        prop('stickiness_expire', TEXT, '30m'),
+        prop('stickiness_size', TEXT, '50k'),
+        prop('stickiness_counter', BOOLEAN, '1'),
+        prop('stickiness_counter_key', TEXT, 'src'),
+        prop('stickiness_length'),
+        prop('stickiness_connRatePeriod', TEXT, '10s'),
+        prop('stickiness_sessRatePeriod', TEXT, '10s'),
+        prop('stickiness_httpReqRatePeriod', TEXT, '10s'),
+        prop('stickiness_httpErrRatePeriod', TEXT, '10s'),
+        prop('stickiness_bytesInRatePeriod', TEXT, '1m'),
+        prop('stickiness_bytesOutRatePeriod', TEXT, '1m'),
+        prop('forwardFor', BOOLEAN, '0'),
+        prop('connectionBehaviour', OPTION, 'http-keep-alive', ['http-keep-alive', 'http-tunnel', 'httpclose', 'http-server-close',
+                                                                'forceclose']),
+        prop('customOptions'),
+        prop('linkedActions', RELATIONS, '', 'action'),
+        prop('linkedErrorfiles', RELATIONS, '', 'errorfile'),
+    ],
+    'group': [
+        prop('enabled', BOOLEAN, '1'),
+        prop('description'),
+        prop('members', RELATIONS, '', 'user'),
+    ],
+    'healthcheck': [
+        prop('description'),
+        prop('type', OPTION, 'http', ['tcp', 'http', 'agent', 'ldap', 'mysql', 'pgsql', 'redis', 'smtp', 'esmtp', 'ssl']),
+        prop('interval', TEXT, '2s'),
+        prop('force_ssl', BOOLEAN, '0'),
+        prop('checkport'),
+        prop('http_method', OPTION, 'options', ['options', 'head', 'get', 'put', 'post', 'delete', 'trace']),
+        prop('http_uri', TEXT, '/'),
+        prop('http_version', OPTION, 'http10', ['http10', 'http11']),
+        prop('http_host', TEXT, 'localhost'),
+        prop('http_expressionEnabled', BOOLEAN, '0'),
+        prop('http_expression', OPTION, '', ['', 'status', 'rstatus', 'string', 'rstring']),
+        prop('http_negate', BOOLEAN, '0'),
+        prop('http_value'),
+        prop('tcp_enabled', BOOLEAN, '0'),
+        prop('tcp_sendValue'),
+        prop('tcp_matchType', OPTION, '', ['', 'string', 'rstring', 'binary']),
+        prop('tcp_negate', BOOLEAN, '0'),
+        prop('tcp_matchValue'),
+        prop('agentPort'),
+        prop('dbUser'),
+        prop('mysql_post41', BOOLEAN, '0'),
+        prop('smtpDomain'),
+    ],
+    'lua': [
+        prop('enabled', BOOLEAN, '1'),
+        prop('description'),
+        prop('content'),
+    ],
+    'mapfile': [
+        prop('description'),
+        prop('content'),
+    ],
+    'server': [
+        prop('enabled', BOOLEAN, '1'),
+        prop('description'),
+        prop('address'),
+        prop('port'),
+        prop('checkport'),
+        prop('mode', OPTION, 'active', ['active', 'backup', 'disabled']),
+        prop('ssl', BOOLEAN, '0'),
+        prop('sslVerify', BOOLEAN, '1'),
+        prop('sslCA', CERTIFICATES),
+        prop('sslCRL', CERTIFICATE),
+        prop('sslClientCertificate', CERTIFICATE),
+        prop('weight'),
+        prop('checkInterval'),
+        prop('checkDownInterval'),
+        prop('source'),
+        prop('advanced'),
+    ],
+    'user': [
+        prop('enabled', BOOLEAN, '1'),
+        prop('description'),
+        prop('password'),
+    ],
+}
+
+
+def toList(value):
+    return [key for key in value.split(',') if key != ''] if value else []
+
+
+class Model:
+    # In-memory HAProxy model of one firewall
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.objects = dict((objecttype, OrderedDict()) for objecttype in OBJECTTYPES)
+        self.names = dict((objecttype, {}) for objecttype in OBJECTTYPES)
+        self.revision = time.time()
+        self.reloads = 0
+        # Options per (objecttype, property), dropped whenever an object changes
+        self.options = {}
+        # (objecttype, property) of every property sent to add/set which the model doesn't know, OPNsense ignores them
+        self.ignored = set()
+
+    def choices(self, objecttype, fieldtype, choices):
+        # (key, value) of every option of a property
+        if fieldtype in (CERTIFICATE, CERTIFICATES):
+            return list(SSL_OBJECTS.items())
+        if fieldtype in (RELATION, RELATIONS):
+            return [(uuid, obj['name']) for uuid, obj in self.objects[choices].items()]
+        return [(key, key) for key in choices or []]
+
+    def changed(self):
+        self.revision = time.time()
+        self.options = {}
+
+    def optionList(self, objecttype, name, fieldtype, choices):
+        if (objecttype, name) not in self.options:
+            options = self.choices(objecttype, fieldtype, choices)
+            self.options[(objecttype, name)] = (options, dict(options))
+        return self.options[(objecttype, name)]
+
+    def render(self, objecttype, obj, unselected=True):
+        # Render an object like get<objecttype> does, option dicts for option, list, relation and certificate fields.
+        # Without unselected, relations only list their selected objects: every object listing
+        # every other object would make settings/get quadratic in the number of objects.
+        rendered = OrderedDict([('name', obj.get('name', ''))])
+        for name, fieldtype, default, choices in MODEL[objecttype]:
+            value = obj.get(name, '')
+            if fieldtype not in SELECT_TYPES + MULTIPLE_TYPES:
+                rendered[name] = value
+                continue
+            selected = toList(value)
+            options = OrderedDict()
+            if fieldtype in (RELATION, CERTIFICATE):
+                options[''] = OrderedDict([('value', 'none'), ('selected', 1 if not selected else 0)])
+            # OPNsense lists the selected options of ordered relations first, in their stored order
+            keys, names = self.optionList(objecttype, name, fieldtype, choices)
+            for key in selected:
+                options[key] = OrderedDict([('value', names.get(key, key)), ('selected', 1)])
+            if fieldtype in (RELATION, RELATIONS) and not unselected:
+                keys = []
+            for key, option in keys:
+                if key not in options:
+                    options[key] = OrderedDict([('value', option), ('selected', 0)])
+            if fieldtype == OPTION and not options:
+                options[''] = OrderedDict([('value', ''), ('selected', 1)])
+            rendered[name] = options
+        return rendered
+
+    def row(self, uuid, obj):
+        return OrderedDict([('uuid', uuid), ('name', obj.get('name', '')), ('description', obj.get('description', ''))])
+
+    def search(self, objecttype, current=1, rowcount=-1, phrase=''):
+        with self.lock:
+            rows = [self.row(uuid, obj) for uuid, obj in self.objects[objecttype].items()
+                    if phrase == '' or phrase.lower() in obj.get('name', '').lower() or phrase.lower() in obj.get('description', '').lower()]
+        total = len(rows)
+        if rowcount > 0:
+            rows = rows[(current - 1) * rowcount:current * rowcount]
+        return OrderedDict([('rows', rows), ('rowCount', len(rows)), ('total', total), ('current', current)])
+
+    def get(self, objecttype, uuid):
+        with self.lock:
+            if uuid == '':
+                return {objecttype: self.render(objecttype, self.defaults(objecttype))}
+            if uuid not in self.objects[objecttype]:
+                return {}
+            return {objecttype: self.render(objecttype, self.objects[objecttype][uuid])}
+
+    def defaults(self, objecttype):
+        return OrderedDict((name, default) for name, fieldtype, default, choices in MODEL[objecttype])
+
+    def validate(self, objecttype, properties):
+        # Validation messages like OPNsense returns them, keyed by <objecttype>.<property>
+        validations = OrderedDict()
+        fields = dict((field[0], field) for field in MODEL[objecttype])
+        for name, value in properties.items():
+            if name not in fields:
+                continue
+            fieldtype, choices = fields[name][1], fields[name][3]
+            if fieldtype == BOOLEAN and value not in ('0', '1'):
+                validations[objecttype + '.' + name] = 'Value should be a boolean (0,1).'
+            elif fieldtype in SELECT_TYPES + MULTIPLE_TYPES and fieldtype != LIST:
+                keys = toList(value)
+                if fieldtype in SELECT_TYPES and len(keys) > 1:
+                    validations[objecttype + '.' + name] = 'Option not in list.'
+                elif fieldtype in (RELATION, RELATIONS) and [key for key in keys if key not in self.objects[choices]]:
+                    validations[objecttype + '.' + name] = 'Related item not found.'
+                elif fieldtype not in (RELATION, RELATIONS):
+                    known = dict(self.choices(objecttype, fieldtype, choices))
+                    if [key for key in keys if key not in known]:
+                        validations[objecttype + '.' + name] = 'Option not in list.'
+        return validations
+
+    def store(self, objecttype, obj, properties):
+        known = set(field[0] for field in MODEL[objecttype])
+        for name, value in properties.items():
+            if name == 'name' or name in known:
+                obj[name] = value if isinstance(value, str) else str(value)
+            else:
+                self.ignored.add((objecttype, name))
+
+    def add(self, objecttype, properties, uuid=None):
+        with self.lock:
+            properties = dict((name, value if isinstance(value, str) else str(value)) for name, value in properties.items())
+            name = properties.get('name', '')
+            if name == '' or name in self.names[objecttype]:
+                return {'result': 'failed', 'validations': {objecttype + '.name': 'Should be a unique value.'}}
+            validations = self.validate(objecttype, properties)
+            if validations:
+                return {'result': 'failed', 'validations': validations}
+            uuid = uuid or str(uuidlib.uuid4())
+            # New objects start with the defaults of the model
+            obj = self.defaults(objecttype)
+            self.store(objecttype, obj, properties)
+            self.objects[objecttype][uuid] = obj
+            self.names[objecttype][name] = uuid
+            self.changed()
+            return {'result': 'saved', 'uuid': uuid}
+
+    def set(self, objecttype, uuid, properties):
+        with self.lock:
+            if uuid not in self.objects[objecttype]:
+                return {'result': 'failed'}
+            properties = dict((name, value if isinstance(value, str) else str(value)) for name, value in properties.items())
+            validations = self.validate(objecttype, properties)
+            if validations:
+                return {'result': 'failed', 'validations': validations}
+            obj = self.objects[objecttype][uuid]
+            if 'name' in properties and properties['name'] != obj.get('name'):
+                del self.names[objecttype][obj['name']]
+                self.names[objecttype][properties['name']] = uuid
+            self.store(objecttype, obj, properties)
+            self.changed()
+            return {'result': 'saved'}
+
+    def delete(self, objecttype, uuid):
+        with self.lock:
+            if uuid not in self.objects[objecttype]:
+                return {'result': 'not found'}
+            obj = self.objects[objecttype].pop(uuid)
+            self.names[objecttype].pop(obj.get('name'), None)
+            self.changed()
+            return {'result': 'deleted'}
+
+    def settings(self):
+        with self.lock:
+            haproxy = OrderedDict([('general', OrderedDict([('enabled', '1')]))])
+            for objecttype in OBJECTTYPES:
+                objects = OrderedDict((uuid, self.render(objecttype, obj, unselected=False)) for uuid, obj in self.objects[objecttype].items())
+                haproxy[CONTAINERS[objecttype]] = OrderedDict([(objecttype, objects)])
+            return {'haproxy': haproxy}
+
+    def populate(self, count):
+        # Fill the model with count objects of every type, servers and backends reference each other
+        for i in range(count):
+            self.add('acl', {'name': 'acl%d' % i, 'expression': 'hdr', 'hdr': 'host%d.example.com' % i})
+            self.add('server', {'name': 'server%d' % i, 'address': '10.0.%d.%d' % (i // 250, i % 250 + 1), 'port': '80', 'mode': 'active', 'enabled': '1'})
+            self.add('user', {'name': 'user%d' % i, 'password': 'secret', 'enabled': '1'})
+        for i in range(count):
+            self.add('backend', {'name': 'backend%d' % i, 'mode': 'http', 'algorithm': 'roundrobin',
+                                 'linkedServers': self.names['server']['server%d' % i]})
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately, don't let Nagle delay keep-alive responses
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def reply(self, payload, status=200):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length == 0:
+            return {}
+        return json.loads(self.rfile.read(length).decode('utf-8') or '{}')
+
+    def route(self, method):
+        model = self.server.model
+        path = self.path.split('?')[0]
+        # Counters for benchmarks running the mock in another process, not counted themselves
+        if path == '/mock/stats':
+            return self.reply({'requests': len(self.server.requests), 'reloads': model.reloads})
+        self.server.count(method, self.path)
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        # Simulate a busy firewall
+        if self.server.error_rate and random.random() < self.server.error_rate:
+            if method == 'POST':
+                self.body()
+            return self.reply({'errorMessage': 'Service Unavailable'}, status=503)
+        data = self.body() if method == 'POST' else {}
+        if path == '/api/haproxy/settings/get':
+            return self.reply(model.settings())
+        if path == '/api/core/backup/backups/this':
+            # Every change saves a backup of config.xml, the newest one is the current revision
+            return self.reply({'items': [{'id': 'config-%.6f.xml' % model.revision, 'time': '%.6f' % model.revision,
+                                          'description': '/api/haproxy/settings made changes'}]})
+        if path == '/api/haproxy/service/configtest':
+            return self.reply({'result': 'Configuration file is valid\n\n\n'})
+        if path == '/api/haproxy/service/reconfigure':
+            model.reloads += 1
+            return self.reply({'status': 'ok'})
+        match = re.match(r'^/api/haproxy/settings/(search|get|add|set|del)([a-z]+?)(s?)(?:/(.*))?$', path)
+        if match is None or match.group(2) not in OBJECTTYPES:
+            return self.reply({'errorMessage': 'Endpoint not found'}, status=404)
+        action, objecttype, uuid = match.group(1), match.group(2), match.group(4) or ''
+        if action == 'search':
+            query = dict(parse_qsl(self.path.partition('?')[2]))
+            query.update(data)
+            return self.reply(model.search(objecttype, int(query.get('current', 1)), int(query.get('rowCount', -1)),
+                                           str(query.get('searchPhrase', ''))))
+        if action == 'get':
+            return self.reply(model.get(objecttype, uuid))
+        if action == 'add':
+            return self.reply(model.add(objecttype, data.get(objecttype, {})))
+        if action == 'set':
+            return self.reply(model.set(objecttype, uuid, data.get(objecttype, {})))
+        return self.reply(model.delete(objecttype, uuid))
+
+    def do_GET(self):
+        self.route('GET')
+
+    def do_POST(self):
+        self.route('POST')
+
+
+class MockServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), latency=0.0, verbose=False, error_rate=0.0):
+        HTTPServer.__init__(self, address, Handler)
+        self.model = Model()
+        self.latency = latency
+        self.error_rate = error_rate
+        self.verbose = verbose
+        self.requests = []
+        self.requests_lock = threading.Lock()
+
+    @property
+    def url(self):
+        return 'http://%s:%d' % self.server_address[:2]
+
+    def count(self, method, path):
+        with self.requests_lock:
+            self.requests.append((method, path))
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in for the OPNsense HAProxy API')
+    parser.add_argument('--port', type=int, default=8080, help='0 picks a free port')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every request')
+    parser.add_argument('--objects', type=int, default=0, help='number of objects per type to create at startup')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests answered with 503')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+    server = MockServer(('127.0.0.1', args.port), latency=args.latency, verbose=args.verbose, error_rate=args.error_rate)
+    server.model.populate(args.objects)
+    sys.stdout.write('Serving mock OPNsense HAProxy API on %s\n' % server.url)
+    sys.stdout.flush()
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2019, Markus Joosten https://github.com/mj84
+from __future__ import absolute_import, division, print_function
+
+import json
+
+from ansible.module_utils.opnsense_utils import OpnsenseApi
+
+
+def test_stats_shape(mock):
+    mock.model.populate(2)
+    apiconnection = OpnsenseApi.Haproxy(mock.url, ('key', 'secret'), False, retries=0)
+    uuid = apiconnection.getUuidByName('server', 'server1')
+    apiconnection.getObjectByUuid('server', uuid)
+    apiconnection.getObjectByUuid('server', mock.model.names['server']['server0'])
+    apiconnection.updateObject('server', 'server1', {'port': '8080'})
+    stats = apiconnection.getApiStats()
+    assert list(stats)[:4] == ['requests', 'total_ms', 'bytes', 'by_endpoint']
+    assert stats['requests'] == len(mock.requests)
+    assert stats['total_ms'] > 0 and stats['bytes'] > 0
+    # Object uuids are folded into one endpoint template
+    getserver = stats['by_endpoint']['GET /api/haproxy/settings/getserver/{uuid}']
+    assert list(getserver) == ['requests', 'total_ms', 'bytes', 'errors']
+    assert (getserver['requests'], getserver['errors']) == (2, 0)
+    assert stats['by_endpoint']['POST /api/haproxy/settings/setserver/{uuid}']['requests'] == 1
+    assert sum(endpoint['requests'] for endpoint in stats['by_endpoint'].values()) == stats['requests']
+    assert (stats['retries'], stats['timeouts'], stats['circuit_open']) == (0, 0, False)
+    assert set(stats['template_cache']) == {'hits', 'misses'}
+    assert 'snapshot_cache' not in stats
+    assert stats['connections'] >= 1 and stats['connections'] + stats['connections_reused'] == stats['requests']
+
+
+def test_errors_are_counted(mock):
+    apiconnection = OpnsenseApi.Haproxy(mock.url, ('key', 'secret'), False, retries=0)
+    calls = []
+    apiconnection.addRequestHook(calls.append)
+    assert apiconnection.getConfigRevision() is not None
+    apiconnection.sendRequest('GET', mock.url + '/api/haproxy/settings/getnothing/x')
+    assert [(call['endpoint'], call['status']) for call in calls] == [
+        (OpnsenseApi.REVISION_ENDPOINT, 200), ('/api/haproxy/settings/getnothing/{uuid}', 404)]
+    by_endpoint = apiconnection.getApiStats()['by_endpoint']
+    assert by_endpoint['GET /api/haproxy/settings/getnothing/{uuid}']['errors'] == 1
+    assert by_endpoint['GET ' + OpnsenseApi.REVISION_ENDPOINT]['errors'] == 0
+
+
+def test_timeline(mock, tmp_path):
+    mock.model.populate(2)
+    apiconnection = OpnsenseApi.Haproxy(mock.url, ('key', 'secret'), False)
+    apiconnection.loadSnapshot()
+    apiconnection.updateObject('server', 'server0', {'port': '8080'})
+    path = tmp_path / 'timeline.json'
+    apiconnection.writeTimeline(str(path))
+    timeline = json.loads(path.read_text())
+    assert timeline['url'] == mock.url
+    assert [(call['method'], call['endpoint'], call['status']) for call in timeline['calls']] == [
+        ('GET', '/api/haproxy/settings/get', 200), ('POST', '/api/haproxy/settings/setserver/{uuid}', 200)]
+    for call in timeline['calls']:
+        assert set(call) == {'method', 'endpoint', 'status', 'bytes', 'start_ms', 'ms'}
+        assert call['bytes'] > 0 and call['ms'] >= 0
+    assert timeline['calls'][0]['start_ms'] <= timeline['calls'][1]['start_ms']
+
+
+def test_module_result(mock, api, run_module, tmp_path):
+    path = tmp_path / 'timeline.json'
+    result = run_module('opnsense_haproxy_server', dict(api, server_name='web', server_address='192.0.2.1', server_port='80',
+                                                        api_timeline=str(path)))
+    assert result['changed']
+    assert result['api_stats']['requests'] == len(mock.requests)
+    assert 'POST /api/haproxy/settings/addserver' in result['api_stats']['by_endpoint']
+    assert len(json.loads(path.read_text())['calls']) == result['api_stats']['requests']
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2019, Markus Joosten https://github.com/mj84
+from __future__ import absolute_import, division, print_function
+
+import pytest
+
+pytest.importorskip('aiohttp')
+
+from ansible.module_utils.opnsense_utils import OpnsenseApi
+from ansible.module_utils.opnsense_utils import OpnsenseApiAsync
+
+
+def test_sync_wrapper_manages_objects(mock):
+    with OpnsenseApiAsync.HaproxySync(mock.url, ('key', 'secret'), False, concurrency=4) as apiconnection:
+        for i in range(20):
+            apiconnection.createObject('server', 'web%d' % i, {'address': '192.0.2.%d' % i, 'port': '80'})
+        apiconnection.updateObject('server', 'web0', {'port': '8080'})
+        apiconnection.deleteObject('server', 'web1')
+        objects, errors = apiconnection.getAllObjects('server')
+        assert errors == {}
+        assert [obj['name'] for obj in objects.values()] == ['web%d' % i for i in range(20) if i != 1]
+        assert apiconnection.getObjectByName('server', 'web0')['port'] == '8080'
+        with pytest.raises(KeyError):
+            apiconnection.getUuidByName('server', 'web1')
+        stats = apiconnection.getApiStats()
+    # Requests beyond the first concurrency ones reuse the kept alive connections
+    assert stats['connections'] <= 4
+    assert stats['connections_reused'] >= stats['requests'] - 4
+
+
+def test_failed_fetches_are_collected(mock):
+    with OpnsenseApiAsync.HaproxySync(mock.url, ('key', 'secret'), False, retries=0) as apiconnection:
+        apiconnection.createObject('server', 'web', {'address': '192.0.2.1'})
+        uuid = apiconnection.getUuidByName('server', 'web')
+        objects, errors = apiconnection.getObjectsByUuids('server', ['missing', uuid])
+    assert objects[0] is None and objects[1]['name'] == 'web'
+    assert list(errors) == ['missing']
+
+
+def test_api_errors_raise(mock):
+    with OpnsenseApiAsync.HaproxySync(mock.url, ('key', 'secret'), False) as apiconnection:
+        apiconnection.createObject('server', 'web', {'address': '192.0.2.1'})
+        with pytest.raises(ValueError):
+            apiconnection.createObject('server', 'web', {'address': '192.0.2.2'})
+
+
+def test_reload_marker_is_shared(mock):
+    sync = OpnsenseApi.Haproxy(mock.url, ('key', 'secret'), False)
+    with OpnsenseApiAsync.HaproxySync(mock.url, ('key', 'secret'), False) as apiconnection:
+        apiconnection.createObject('lua', 'script', {'content': 'core.Info("x")'})
+        assert sync.isReloadPending()
+        apiconnection.applyConfig()
+    assert not sync.isReloadPending()
+    assert mock.model.reloads == 1
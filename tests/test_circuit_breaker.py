@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2019, Markus Joosten https://github.com/mj84
+from __future__ import absolute_import, division, print_function
+
+import threading
+import time
+
+import pytest
+import requests
+
+from ansible.module_utils.opnsense_utils import OpnsenseApi
+
+
+def test_half_open_circuit(mock):
+    apiconnection = OpnsenseApi.Haproxy(mock.url, ('key', 'secret'), False, retries=0, breaker_threshold=2, breaker_reset=0.2)
+    url = mock.url + '/api/haproxy/settings/searchservers'
+    mock.error_rate = 1.0
+    for attempt in range(2):
+        with pytest.raises(requests.exceptions.HTTPError):
+            apiconnection.getRequest(url)
+    # Open: failing without contacting the API
+    with pytest.raises(OpnsenseApi.CircuitOpenError):
+        apiconnection.getRequest(url)
+    assert len(mock.requests) == 2
+
+    # Half-open: one probe, every other request fails while it runs
+    time.sleep(0.25)
+    mock.latency = 0.3
+    errors = []
+
+    def probe():
+        try:
+            apiconnection.getRequest(url)
+        except Exception as e:
+            errors.append(e)
+    thread = threading.Thread(target=probe)
+    thread.start()
+    time.sleep(0.1)
+    with pytest.raises(OpnsenseApi.CircuitOpenError):
+        apiconnection.getRequest(url)
+    assert apiconnection.isCircuitOpen()
+    thread.join()
+    assert len(mock.requests) == 3
+    # The failed probe opens the circuit again
+    assert isinstance(errors[0], requests.exceptions.HTTPError)
+    with pytest.raises(OpnsenseApi.CircuitOpenError):
+        apiconnection.getRequest(url)
+
+    # A successful probe closes it
+    time.sleep(0.25)
+    mock.latency = 0.0
+    mock.error_rate = 0.0
+    apiconnection.getRequest(url)
+    assert not apiconnection.isCircuitOpen()
+    apiconnection.getRequest(url)
+    apiconnection.getRequest(url)
+    assert len(mock.requests) == 6
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2019, Markus Joosten https://github.com/mj84
+from __future__ import absolute_import, division, print_function
+
+from ansible.module_utils.opnsense_utils import HaproxyDiff
+from ansible.module_utils.opnsense_utils import HaproxySchema
+
+
+def test_unordered_lists_compare_as_sets():
+    current = {'linkedServers': {'a': {'value': 'web1', 'selected': 1}, 'b': {'value': 'web2', 'selected': 1}}}
+    assert HaproxyDiff.diffObject('backend', current, {'linkedServers': 'b,a'}) == ({}, [])
+    changed, changes = HaproxyDiff.diffObject('backend', current, {'linkedServers': 'b,c'})
+    assert changed == {'linkedServers': 'b,c'}
+    assert changes[0]['added'] == ['c'] and changes[0]['removed'] == ['a']
+
+
+def test_ordered_lists_compare_in_order():
+    current = {'linkedActions': {'a': {'value': 'first', 'selected': 1}, 'b': {'value': 'second', 'selected': 1}}}
+    assert HaproxyDiff.diffObject('backend', current, {'linkedActions': 'a,b'}) == ({}, [])
+    changes = HaproxyDiff.diffObject('backend', current, {'linkedActions': 'b,a'})[1]
+    assert changes[0]['kind'] == HaproxySchema.ORDERED_MULTISELECT
+    assert changes[0]['added'] == changes[0]['removed'] == []
+
+
+def test_secrets_are_masked():
+    changed, changes = HaproxyDiff.diffObject('user', {'name': 'alice', 'password': 'old secret'}, {'password': 'new secret'})
+    assert changed == {'password': 'new secret'}
+    assert changes[0]['before'] == changes[0]['after'] == HaproxyDiff.SECRET
+    assert 'secret' not in ' '.join(HaproxyDiff.formatChanges(changes))
+
+
+def test_unchanged_secret():
+    assert HaproxyDiff.diffObject('user', {'password': 'secret'}, {'password': 'secret'}) == ({}, [])
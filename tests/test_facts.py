@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2019, Markus Joosten https://github.com/mj84
+from __future__ import absolute_import, division, print_function
+
+import json
+
+import pytest
+
+from ansible.module_utils.opnsense_utils import HaproxyFacts
+
+OBJECTS = {
+    'acl': {'acl_host': {'expression': 'hdr', 'hdr': 'www.example.com', 'description': 'Host'}},
+    'user': {'alice': {'password': 'correct horse battery staple', 'description': 'Alice'}},
+    'group': {'admins': {'members': ['alice']}},
+    'healthcheck': {'http': {'http_uri': '/health'}},
+    'server': {
+        'web1': {'address': '192.0.2.1', 'port': '8080'},
+        'web2': {'address': '192.0.2.2', 'port': '8080', 'checkport': '8081', 'weight': '20'},
+    },
+    'backend': {'web': {'linked_servers': ['web2', 'web1'], 'health_check': 'http', 'basic_auth_groups': ['admins']}},
+    'action': {'to_web': {'type': 'use_backend', 'value': 'web', 'linked_acls': ['acl_host']}},
+    'frontend': {'public': {'bind': ['0.0.0.0:80'], 'default_backend': 'web', 'linked_actions': ['to_web']}},
+}
+
+
+def exported(result):
+    facts = result['ansible_facts']['opnsense_haproxy_facts']
+    return dict((objecttype, facts[HaproxyFacts.roleVariable(objecttype)]) for objecttype in OBJECTS)
+
+
+@pytest.mark.parametrize('options', [{}, {'include_defaults': True}, {'snapshot': False}])
+def test_round_trip(mock, api, run_module, options):
+    assert run_module('opnsense_haproxy_converge', dict(api, objects=OBJECTS))['changed']
+    result = run_module('opnsense_haproxy_facts', dict(api, include_secrets=True, **options))
+    assert not result['changed']
+    objects = exported(result)
+    assert objects['backend']['web']['linked_servers'] == ['web2', 'web1']
+    assert objects['user']['alice']['password'] == 'correct horse battery staple'
+    # The export converges to exactly what is on the firewall
+    result = run_module('opnsense_haproxy_converge', dict(api, objects=objects))
+    assert not result.get('failed') and not result['changed'], result
+
+
+def test_secrets_left_out(mock, api, run_module):
+    run_module('opnsense_haproxy_converge', dict(api, objects=OBJECTS))
+    result = run_module('opnsense_haproxy_facts', api)
+    assert 'password' not in exported(result)['user']['alice']
+    assert 'correct horse' not in json.dumps(result)
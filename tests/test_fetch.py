@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2019, Markus Joosten https://github.com/mj84
+from __future__ import absolute_import, division, print_function
+
+import time
+
+import pytest
+
+from ansible.module_utils.opnsense_utils import OpnsenseApi
+
+
+@pytest.fixture
+def apiconnection(mock):
+    mock.model.populate(8)
+    return OpnsenseApi.Haproxy(mock.url, ('key', 'secret'), False, retries=0)
+
+
+def test_results_in_input_order(mock, apiconnection):
+    names = ['server%d' % i for i in (5, 0, 7, 2, 6, 1, 3, 4)]
+    objects, errors = apiconnection.getObjectsByUuids('server', [mock.model.names['server'][name] for name in names])
+    assert errors == {}
+    assert [obj['name'] for obj in objects] == names
+
+
+def test_failures_are_collected(mock, apiconnection):
+    uuids = [mock.model.names['server']['server1'], 'missing', mock.model.names['server']['server2'], 'gone']
+    objects, errors = apiconnection.getObjectsByUuids('server', uuids)
+    # Failed requests leave a gap instead of aborting the batch
+    assert [obj and obj['name'] for obj in objects] == ['server1', None, 'server2', None]
+    assert sorted(errors) == ['gone', 'missing']
+    assert all(error.startswith('KeyError: ') for error in errors.values())
+
+
+def test_unknown_objecttype(apiconnection):
+    with pytest.raises(KeyError):
+        apiconnection.getObjectsByUuids('firewall', ['uuid'])
+
+
+def test_fetches_in_parallel(mock):
+    mock.model.populate(8)
+    mock.latency = 0.2
+    apiconnection = OpnsenseApi.Haproxy(mock.url, ('key', 'secret'), False)
+    uuids = list(mock.model.names['server'].values())
+    start = time.time()
+    objects, errors = apiconnection.getObjectsByUuids('server', uuids, max_workers=8)
+    assert errors == {} and len(objects) == 8
+    # One after another would take 8 * 0.2 seconds
+    assert time.time() - start < 0.8
+    start = time.time()
+    apiconnection.getObjectsByUuids('server', uuids, max_workers=1)
+    assert time.time() - start >= 1.6
+
+
+def test_snapshot_objects_need_no_request(mock, apiconnection):
+    apiconnection.loadSnapshot()
+    apiconnection.updateObject('server', 'server3', {'port': '8080'})
+    del mock.requests[:]
+    uuids = [mock.model.names['server'][name] for name in ('server2', 'server3', 'server4')]
+    objects, errors = apiconnection.getObjectsByUuids('server', uuids)
+    assert [obj['port'] for obj in objects] == ['80', '8080', '80']
+    # Only the changed object is read again
+    assert mock.requests == [('GET', '/api/haproxy/settings/getserver/' + uuids[1])]
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2019, Markus Joosten https://github.com/mj84
+from __future__ import absolute_import, division, print_function
+
+from ansible.module_utils.opnsense_utils import OpnsenseApi
+
+
+def test_pages(mock):
+    mock.model.populate(25)
+    apiconnection = OpnsenseApi.Haproxy(mock.url, ('key', 'secret'), False, page_size=10)
+    rows = apiconnection.listObjects('server')
+    assert [row['name'] for row in rows] == ['server%d' % i for i in range(25)]
+    assert [path for method, path in mock.requests] == [
+        '/api/haproxy/settings/searchservers?current=%d&rowCount=10' % current for current in (1, 2, 3)]
+    # The listing indexes every name
+    assert apiconnection.getUuidByName('server', 'server24') == mock.model.names['server']['server24']
+    assert len(mock.requests) == 3
+
+
+def test_full_last_page(mock):
+    mock.model.populate(20)
+    apiconnection = OpnsenseApi.Haproxy(mock.url, ('key', 'secret'), False, page_size=10)
+    assert len(list(apiconnection.iterObjects('server'))) == 20
+    # The total tells that there is no third page
+    assert len(mock.requests) == 2
+
+
+def test_early_stop(mock):
+    mock.model.populate(25)
+    apiconnection = OpnsenseApi.Haproxy(mock.url, ('key', 'secret'), False, page_size=10)
+    for row in apiconnection.iterObjects('server'):
+        if row['name'] == 'server12':
+            break
+    assert len(mock.requests) == 2
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2019, Markus Joosten https://github.com/mj84
+from __future__ import absolute_import, division, print_function
+
+import pytest
+
+from ansible.module_utils.opnsense_utils import HaproxyDiff
+from ansible.module_utils.opnsense_utils import HaproxySchema
+
+ENTRIES = u'www.example.com web\napi.example.com api\n'
+
+
+def content(mock, name):
+    return mock.model.objects['mapfile'][mock.model.names['mapfile'][name]]['content']
+
+
+@pytest.mark.parametrize('module,objects', [
+    ('opnsense_haproxy_bulk', lambda items: {'objecttype': 'mapfile', 'items': items}),
+    ('opnsense_haproxy_converge', lambda items: {'objects': {'mapfile': items}}),
+])
+def test_map_from_src(mock, api, run_module, tempdir, module, objects):
+    src = tempdir / 'hosts.map'
+    src.write_text(ENTRIES)
+    items = {'hosts': {'src': str(src), 'sort': True}}
+    assert run_module(module, dict(api, **objects(items)))['changed']
+    assert content(mock, 'hosts') == ENTRIES
+    # Same entries in another order, sort ignores it
+    src.write_text(u'api.example.com api\nwww.example.com web\n')
+    assert not run_module(module, dict(api, **objects(items)))['changed']
+    # The item module agrees
+    assert not run_module('opnsense_haproxy_mapfile', dict(api, mapfile_name='hosts', mapfile_src=str(src), mapfile_sort=True))['changed']
+
+    src.write_text(ENTRIES + u'db.example.com db\n')
+    result = run_module(module, dict(api, **objects(items)))
+    assert result['changed']
+    assert content(mock, 'hosts') == ENTRIES + u'db.example.com db\n'
+
+
+def test_unreadable_src(mock, api, run_module, tempdir):
+    result = run_module('opnsense_haproxy_converge', dict(api, objects={'mapfile': {'hosts': {'src': str(tempdir / 'missing.map')}}}))
+    assert result['failed'] and 'cannot read src' in result['msg']
+    assert 'hosts' not in mock.model.names['mapfile']
+
+
+def test_map_content_by_digest():
+    current = {'content': 'b.example.com b\r\na.example.com a\n\n'}
+    desired = {'content': 'a.example.com a\nb.example.com b'}
+    assert HaproxyDiff.diffObject('mapfile', current, desired, {'sort': True}) == ({}, [])
+    changes = HaproxyDiff.diffObject('mapfile', current, desired)[1]
+    assert changes[0]['kind'] == HaproxySchema.DIGEST
+    assert len(changes[0]['before']) == len(changes[0]['after']) == 64
+
+
+def test_module_reports_digests(mock, api, run_module):
+    args = dict(api, mapfile_name='hosts', mapfile_content=ENTRIES)
+    run_module('opnsense_haproxy_mapfile', args)
+    result = run_module('opnsense_haproxy_mapfile', dict(args, mapfile_content=ENTRIES + u'new.example.com new\n'))
+    change = result['changes'][0]
+    assert change['property'] == 'content' and change['kind'] == HaproxySchema.DIGEST
+    assert change['after'] == HaproxyDiff.digest(ENTRIES + u'new.example.com new\n') != change['before']
+    assert result['lines_added'] == 1
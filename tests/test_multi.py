@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2019, Markus Joosten https://github.com/mj84
+from __future__ import absolute_import, division, print_function
+
+import threading
+import time
+
+import pytest
+
+from ansible.module_utils.opnsense_utils import OpnsenseApi
+
+import mock_opnsense
+
+OBJECTS = {
+    'server': {'web1': {'address': '192.0.2.1', 'port': '8080'}, 'web2': {'address': '192.0.2.2', 'port': '8080'}},
+    'backend': {'web': {'linked_servers': ['web1', 'web2']}},
+}
+
+
+@pytest.fixture
+def mocks():
+    servers = [mock_opnsense.MockServer().start() for i in range(3)]
+    yield servers
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def targets(urls):
+    return [{'name': 'fw%d' % i, 'api_url': url, 'api_key': 'key', 'api_secret': 'secret'} for i, url in enumerate(urls)]
+
+
+class Peak:
+    # Highest number of threads inside the block at the same time
+    def __init__(self, delay=0.2):
+        self.lock = threading.Lock()
+        self.delay = delay
+        self.active = 0
+        self.peak = 0
+
+    def __enter__(self):
+        with self.lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+
+    def __exit__(self, *args):
+        time.sleep(self.delay)
+        with self.lock:
+            self.active -= 1
+
+
+def test_converges_every_target(mocks, run_module):
+    result = run_module('opnsense_haproxy_multi', {'targets': targets([mock.url for mock in mocks]), 'objects': OBJECTS})
+    assert result['changed'] and not result.get('failed')
+    assert list(result['targets']) == ['fw0', 'fw1', 'fw2']
+    for mock in mocks:
+        assert sorted(mock.model.names['server']) == ['web1', 'web2']
+        assert mock.model.reloads == 1
+    assert all(target['reloaded'] for target in result['targets'].values())
+    result = run_module('opnsense_haproxy_multi', {'targets': targets([mock.url for mock in mocks]), 'objects': OBJECTS})
+    assert not result['changed']
+
+
+def test_failing_target_doesnt_stop_the_others(mocks, run_module):
+    urls = [mocks[0].url, 'http://127.0.0.1:1', mocks[2].url]
+    result = run_module('opnsense_haproxy_multi', {'targets': targets(urls), 'objects': OBJECTS, 'api_retries': 0})
+    assert result['failed'] and result['changed']
+    assert result['msg'].startswith('Failed on 1 of 3 targets: fw1 (')
+    assert result['targets']['fw1']['failed'] and not result['targets']['fw1']['changed']
+    for name, mock in (('fw0', mocks[0]), ('fw2', mocks[2])):
+        assert result['targets'][name]['changed'] and result['targets'][name]['reloaded']
+        assert sorted(mock.model.names['server']) == ['web1', 'web2']
+    assert mocks[1].model.reloads == 0
+
+
+@pytest.mark.parametrize('max_reloads', [1, 2])
+def test_max_reloads(mocks, monkeypatch, max_reloads):
+    peak = Peak()
+    applyConfig = OpnsenseApi.Haproxy.applyConfig
+
+    def countedApply(self):
+        with peak:
+            return applyConfig(self)
+
+    monkeypatch.setattr(OpnsenseApi.Haproxy, 'applyConfig', countedApply)
+    apiconnections = OpnsenseApi.HaproxyTargets([{'name': 'fw%d' % i, 'url': mock.url, 'auth': ('key', 'secret')} for i, mock in enumerate(mocks)],
+                                                max_targets=3, max_reloads=max_reloads)
+    # All targets ask for a reload at the same time
+    barrier = threading.Barrier(3)
+
+    def reload(name, apiconnection):
+        barrier.wait(5)
+        return apiconnections.applyConfig(name)
+
+    outcomes = apiconnections.run(reload)
+    assert all(error is None for result, error in outcomes.values())
+    assert [mock.model.reloads for mock in mocks] == [1, 1, 1]
+    assert peak.peak == max_reloads
+
+
+@pytest.mark.parametrize('max_targets', [1, 2, 4])
+def test_max_targets(mocks, max_targets):
+    # More targets than workers, the same firewall can be a target under several names
+    apiconnections = OpnsenseApi.HaproxyTargets([{'name': 'fw%d' % i, 'url': mocks[i % 3].url, 'auth': ('key', 'secret')} for i in range(5)],
+                                                max_targets=max_targets)
+    peak = Peak(delay=0.1)
+
+    def work(name, apiconnection):
+        with peak:
+            return name
+
+    outcomes = apiconnections.run(work)
+    assert outcomes == dict(('fw%d' % i, ('fw%d' % i, None)) for i in range(5))
+    assert peak.peak == max_targets
+
+
+def test_duplicate_target(mocks):
+    with pytest.raises(ValueError):
+        OpnsenseApi.HaproxyTargets([{'name': 'fw', 'url': mock.url, 'auth': ('key', 'secret')} for mock in mocks[:2]])
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2019, Markus Joosten https://github.com/mj84
+from __future__ import absolute_import, division, print_function
+
+import pytest
+
+from ansible.module_utils.opnsense_utils import OpnsenseApi
+
+
+def searches(mock, objecttype):
+    return [path for method, path in mock.requests if path.startswith('/api/haproxy/settings/search%ss' % objecttype)]
+
+
+def test_create_searches_once(mock, api, run_module):
+    mock.model.populate(300)
+    result = run_module('opnsense_haproxy_server', dict(api, server_name='web', server_address='192.0.2.1', server_port='80'))
+    assert result['changed']
+    # The filtered search for web is empty, no full listing follows
+    assert len(searches(mock, 'server')) == 1
+    assert 'web' in mock.model.names['server']
+
+
+def test_lookup_with_substring_matches(mock):
+    mock.model.populate(300)
+    apiconnection = OpnsenseApi.Haproxy(mock.url, ('key', 'secret'), False, page_size=10)
+    # server1 is on the first of 12 pages of rows containing it
+    assert apiconnection.getUuidByName('server', 'server1') == mock.model.names['server']['server1']
+    with pytest.raises(KeyError):
+        apiconnection.getUuidByName('server', 'server')
+    assert len(searches(mock, 'server')) == 1 + 30
+
+
+def test_lookup_without_search_phrase(mock, monkeypatch):
+    # An API version ignoring searchPhrase answers with all rows
+    mock.model.populate(50)
+    search = mock.model.search
+    monkeypatch.setattr(mock.model, 'search', lambda objecttype, current=1, rowcount=-1, phrase='': search(objecttype, current, rowcount))
+    apiconnection = OpnsenseApi.Haproxy(mock.url, ('key', 'secret'), False)
+    with pytest.raises(KeyError):
+        apiconnection.getUuidByName('server', 'web')
+    assert len(searches(mock, 'server')) == 2
+    # The answer listed every server, so further lookups need no request
+    assert apiconnection.getUuidByName('server', 'server42') == mock.model.names['server']['server42']
+    with pytest.raises(KeyError):
+        apiconnection.getUuidByName('server', 'db')
+    assert len(searches(mock, 'server')) == 2
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2019, Markus Joosten https://github.com/mj84
+from __future__ import absolute_import, division, print_function
+
+import os
+import stat
+
+OBJECTS = {
+    'user': {'alice': {'password': 'correct horse battery staple'}},
+    'group': {'admins': {'members': ['alice']}},
+}
+
+
+def test_plan_keeps_secrets_out(mock, api, run_module, tempdir):
+    plan_file = str(tempdir / 'plan.json')
+    result = run_module('opnsense_haproxy_plan', dict(api, mode='plan', plan_file=plan_file, objects=OBJECTS))
+    # Planning only reads, the changes are in the summary
+    assert not result['changed'] and result['summary']['create'] == 2
+    assert stat.S_IMODE(os.stat(plan_file).st_mode) == 0o600
+    with open(plan_file) as f:
+        assert 'correct horse' not in f.read()
+    assert [path for method, path in mock.requests if method == 'POST'] == []
+
+    result = run_module('opnsense_haproxy_plan', dict(api, mode='apply', plan_file=plan_file, objects=OBJECTS))
+    assert result['changed']
+    user = mock.model.objects['user'][mock.model.names['user']['alice']]
+    assert user['password'] == 'correct horse battery staple'
+    assert 'admins' in mock.model.names['group']
+
+
+def test_apply_with_changed_variables(mock, api, run_module, tempdir):
+    plan_file = str(tempdir / 'plan.json')
+    run_module('opnsense_haproxy_plan', dict(api, mode='plan', plan_file=plan_file, objects=OBJECTS))
+    objects = dict(OBJECTS, user={'alice': {'password': 'another password'}})
+    result = run_module('opnsense_haproxy_plan', dict(api, mode='apply', plan_file=plan_file, objects=objects))
+    assert result['failed'] and 'user alice changed' in result['msg']
+    assert mock.model.names['user'] == {}
+
+
+def test_apply_planned_deletion(mock, api, run_module, tempdir):
+    mock.model.populate(2)
+    plan_file = str(tempdir / 'plan.json')
+    objects = {'acl': {'acl0': {'expression': 'hdr', 'hdr': 'host0.example.com'}}}
+    result = run_module('opnsense_haproxy_plan', dict(api, mode='plan', plan_file=plan_file, objects=objects, purge=True))
+    assert result['summary']['delete'] == 1
+    assert run_module('opnsense_haproxy_plan', dict(api, mode='apply', plan_file=plan_file, objects=objects))['changed']
+    assert sorted(mock.model.names['acl']) == ['acl0']
+
+
+def test_check_mode_writes_no_plan(mock, api, run_module, tempdir):
+    plan_file = str(tempdir / 'plan.json')
+    result = run_module('opnsense_haproxy_plan', dict(api, mode='plan', plan_file=plan_file, objects=OBJECTS, _ansible_check_mode=True))
+    assert not result['changed'] and result['summary']['create'] == 2
+    assert not os.path.exists(plan_file)
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2019, Markus Joosten https://github.com/mj84
+from __future__ import absolute_import, division, print_function
+
+import pytest
+
+from ansible.module_utils.opnsense_utils import HaproxyDiff
+from ansible.module_utils.opnsense_utils import HaproxySchema
+
+SERVER = {'name': 'web1', 'description': 'Web', 'address': '192.0.2.1', 'port': '80', 'weight': '10'}
+
+
+@pytest.mark.parametrize('desired,required,impact,properties', [
+    ({'description': 'Web server'}, False, HaproxySchema.COSMETIC, ['description']),
+    ({'weight': '20'}, True, HaproxySchema.RUNTIME, ['weight']),
+    ({'weight': '20', 'description': 'Web server'}, True, HaproxySchema.RUNTIME, ['weight']),
+    ({'enabled': '0', 'description': 'Web server'}, True, HaproxySchema.RUNTIME, ['enabled']),
+    ({'weight': '20', 'address': '192.0.2.2', 'port': '81'}, True, HaproxySchema.CONFIG, ['address', 'port']),
+    ({'advanced': 'maxconn 100'}, True, HaproxySchema.CONFIG, ['advanced']),
+    ({'description': 'Web', 'weight': '10'}, False, None, []),
+])
+def test_reload_impact(desired, required, impact, properties):
+    current = dict(SERVER, enabled='1')
+    changes = HaproxyDiff.diffObject('server', current, desired)[1]
+    reload = HaproxyDiff.reloadImpact('server', changes)
+    assert reload['required'] == required
+    assert reload['impact'] == impact
+    assert sorted(reload['properties']) == properties
+
+
+def test_unknown_property_needs_reload():
+    changes = HaproxyDiff.diffObject('server', SERVER, {'newOption': '1'})[1]
+    assert HaproxyDiff.reloadImpact('server', changes)['impact'] == HaproxySchema.CONFIG
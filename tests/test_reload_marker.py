@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2019, Markus Joosten https://github.com/mj84
+from __future__ import absolute_import, division, print_function
+
+import os
+import stat
+
+from ansible.module_utils.opnsense_utils import OpnsenseApi
+
+
+def test_state_dir_is_private(tempdir):
+    statedir = OpnsenseApi.getStateDir()
+    assert os.path.dirname(statedir) == str(tempdir)
+    assert stat.S_IMODE(os.stat(statedir).st_mode) == 0o700
+    assert OpnsenseApi.getStateDir() == statedir
+
+
+def test_state_dir_open_to_others_is_not_used(tempdir):
+    shared = os.path.join(str(tempdir), 'opnsense_haproxy_%d' % os.getuid())
+    os.mkdir(shared)
+    os.chmod(shared, 0o777)
+    statedir = OpnsenseApi.getStateDir()
+    assert statedir != shared
+    assert stat.S_IMODE(os.stat(statedir).st_mode) == 0o700
+
+
+def test_marker_is_never_followed(mock, tempdir):
+    apiconnection = OpnsenseApi.Haproxy(mock.url, ('key', 'secret'), False)
+    victim = tempdir / 'victim'
+    victim.write_text(u'keep')
+    os.symlink(str(victim), apiconnection.getReloadMarker())
+    apiconnection.markReloadPending()
+    assert victim.read_text() == u'keep'
+
+    apiconnection.clearReloadPending()
+    assert not apiconnection.isReloadPending()
+    apiconnection.markReloadPending()
+    assert apiconnection.isReloadPending()
+    assert stat.S_IMODE(os.stat(apiconnection.getReloadMarker()).st_mode) == 0o600
+    # Marking again keeps the pending reload
+    apiconnection.markReloadPending()
+    apiconnection.applyConfig()
+    assert not apiconnection.isReloadPending()
+    assert mock.model.reloads == 1
+
+
+def test_apply_fails_cleanly_when_unreachable(run_module):
+    # Nothing listens on port 1, the connection error fails the task instead of raising
+    result = run_module('opnsense_haproxy_apply', {'api_url': 'http://127.0.0.1:1', 'api_key': 'key', 'api_secret': 'secret',
+                                                   'api_retries': 0, 'force': True})
+    assert result['failed'] and result['msg'].startswith('Failed to apply the HAProxy configuration: ')
+    assert result['api_stats']['requests'] == 1
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2019, Markus Joosten https://github.com/mj84
+from __future__ import absolute_import, division, print_function
+
+# The per-item tasks (tasks/items.yml) and the schema used by bulk and converge must build the same objects:
+# after converging an inventory in one mode the other mode has nothing to change.
+
+import json
+import os
+import re
+import subprocess
+import sys
+
+import pytest
+
+import mock_opnsense
+
+INVENTORY = {
+    'opnsense_haproxy_acls': {
+        'acl_host': {'expression': 'hdr', 'hdr': 'www.example.com', 'description': 'Host'},
+        'acl_path': {'expression': 'path_beg', 'path_beg': '/api', 'negate': True},
+    },
+    'opnsense_haproxy_users': {
+        'alice': {'password': 'secret', 'description': 'Alice'},
+    },
+    'opnsense_haproxy_groups': {
+        'admins': {'members': ['alice']},
+    },
+    'opnsense_haproxy_cpus': {
+        'cpu0': {'cpu_id': ['x0']},
+    },
+    'opnsense_haproxy_errorfiles': {
+        'unavailable': {'code': '503', 'content': 'HTTP/1.0 503 Service Unavailable'},
+    },
+    'opnsense_haproxy_luas': {
+        'hello': {'content': 'core.Info("hello")'},
+    },
+    'opnsense_haproxy_mapfiles': {
+        'hosts': {'content': 'www.example.com web'},
+    },
+    'opnsense_haproxy_healthchecks': {
+        'http': {'http_uri': '/health'},
+        # Users and domains of the old per-type keys
+        'mysql': {'type': 'mysql', 'mysql_user': 'monitor'},
+        'esmtp': {'type': 'esmtp', 'esmtp_domain': 'example.com'},
+    },
+    'opnsense_haproxy_servers': {
+        # Checks go to the server port unless checkport is set
+        'web1': {'address': '192.0.2.1', 'port': '8080'},
+        'web2': {'address': '192.0.2.2', 'port': '8080', 'checkport': '8081', 'weight': '20'},
+    },
+    'opnsense_haproxy_backends': {
+        'web': {'linked_servers': ['web1', 'web2'], 'health_check': 'http', 'tuning_retries': '3'},
+        # Key of the per-item tasks before the schema existed
+        'legacy': {'linked_servers': ['web1'], 'backend_tuning_retries': '2'},
+    },
+    'opnsense_haproxy_actions': {
+        'to_web': {'type': 'use_backend', 'value': 'web', 'linked_acls': ['acl_host']},
+    },
+    'opnsense_haproxy_frontends': {
+        'public': {'bind': ['0.0.0.0:80'], 'default_backend': 'web', 'linked_actions': ['to_web']},
+    },
+}
+
+MODES = {
+    'items': {},
+    'bulk': {'opnsense_haproxy_bulk': True},
+    'converge': {'opnsense_haproxy_converge': True},
+    'plan': {'opnsense_haproxy_plan': 'plan'},
+    'apply': {'opnsense_haproxy_plan': 'apply'},
+}
+
+
+def runRole(mock, tmp_path, mode, check=False, extra=None):
+    # Run the role with ansible-playbook, return the number of changed tasks and the output
+    variables = dict(INVENTORY, opnsense_api_url=mock.url, opnsense_api_key='key', opnsense_api_secret='secret',
+                     ansible_python_interpreter=sys.executable, **MODES[mode])
+    variables.update(extra or {})
+    with open(str(tmp_path / 'vars.json'), 'w') as f:
+        json.dump(variables, f)
+    with open(str(tmp_path / 'play.yml'), 'w') as f:
+        f.write('- hosts: localhost\n  connection: local\n  gather_facts: false\n  roles:\n    - role: %s\n' % mock_opnsense.ROLE_DIR)
+    command = ['ansible-playbook', '-v', '-i', 'localhost,', '-e', '@' + str(tmp_path / 'vars.json'), str(tmp_path / 'play.yml')]
+    if check:
+        command.append('--check')
+    env = dict(os.environ, ANSIBLE_NOCOLOR='1', ANSIBLE_RETRY_FILES_ENABLED='0', ANSIBLE_LOCALHOST_WARNING='0')
+    process = subprocess.run(command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                             env=env, universal_newlines=True)
+    recap = re.search(r'localhost\s*: ok=\d+\s+changed=(\d+)\s+unreachable=(\d+)\s+failed=(\d+)', process.stdout)
+    assert process.returncode == 0 and recap is not None, process.stdout
+    return int(recap.group(1)), process.stdout
+
+
+@pytest.mark.parametrize('first,second', [('items', 'bulk'), ('items', 'converge'), ('converge', 'items'), ('bulk', 'items')])
+def test_modes_agree(mock, tmp_path, first, second):
+    changed, output = runRole(mock, tmp_path, first)
+    assert changed > 0, output
+    changed, output = runRole(mock, tmp_path, second, check=True)
+    assert changed == 0, output
+    # Every property the modules send exists in the OPNsense model
+    assert not mock.model.ignored, sorted(mock.model.ignored)
+
+
+def test_plan_doesnt_reload(mock, tmp_path):
+    extra = {'opnsense_haproxy_plan_file': str(tmp_path / 'plan.json'), 'opnsense_haproxy_reload': True}
+    changed, output = runRole(mock, tmp_path, 'plan', extra=extra)
+    assert changed == 0 and mock.model.reloads == 0, output
+    changed, output = runRole(mock, tmp_path, 'apply', extra=extra)
+    assert changed > 0 and mock.model.reloads == 1, output
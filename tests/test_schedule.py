@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2019, Markus Joosten https://github.com/mj84
+from __future__ import absolute_import, division, print_function
+
+import pytest
+
+from ansible.module_utils.opnsense_utils import HaproxySchedule
+from ansible.module_utils.opnsense_utils import OpnsenseApi
+
+
+def test_layers():
+    edges = {'c': ['a', 'b'], 'b': ['a'], 'a': ['outside']}
+    assert HaproxySchedule.layers(['a', 'b', 'c', 'd'], edges) == [['a', 'd'], ['b'], ['c']]
+
+
+def test_cycle():
+    a, b, c, d = [('backend', name) for name in 'abcd']
+    with pytest.raises(ValueError) as e:
+        HaproxySchedule.layers([a, b, c, d], {a: [c], b: [a], c: [b], d: [a]})
+    # d is stuck behind the cycle as well
+    assert str(e.value) == 'Circular references between backend a, backend b, backend c, backend d'
+
+
+def test_self_reference_is_no_cycle():
+    assert HaproxySchedule.layers(['a'], {'a': ['a']}) == [['a']]
+
+
+def test_create_order(mock):
+    scheduler = HaproxySchedule.Scheduler(OpnsenseApi.Haproxy(mock.url, ('key', 'secret'), False))
+    objects = {
+        'frontend': {'public': {'default_backend': 'web'}},
+        'backend': {'web': {'linked_servers': ['web1']}},
+        'server': {'web1': {'address': '192.0.2.1', 'port': '80'}},
+    }
+    assert scheduler.planCreates(objects) == [[('server', 'web1')], [('backend', 'web')], [('frontend', 'public')]]
+
+
+def test_circular_role_variables(mock, api, run_module):
+    # A backend using an action which sends requests back to the backend
+    objects = {
+        'backend': {'web': {'linked_actions': ['to_web']}},
+        'action': {'to_web': {'type': 'use_backend', 'value': 'web'}},
+    }
+    result = run_module('opnsense_haproxy_converge', dict(api, objects=objects))
+    assert result['failed'] and 'Circular references between' in result['msg']
+    assert [path for method, path in mock.requests if method == 'POST'] == []
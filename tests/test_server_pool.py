@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2019, Markus Joosten https://github.com/mj84
+from __future__ import absolute_import, division, print_function
+
+
+def writes(mock):
+    return [path for method, path in mock.requests if method == 'POST']
+
+
+def test_unknown_backend_changes_nothing(mock, api, run_module):
+    result = run_module('opnsense_haproxy_server_pool', dict(api, pool_name='web', pool_addresses=['192.0.2.1', '192.0.2.2'],
+                                                             pool_port='80', pool_backend='missing'))
+    assert result['failed'] and 'unknown backend missing' in result['msg']
+    assert writes(mock) == []
+
+
+def test_unknown_reference_changes_nothing(mock, api, run_module):
+    mock.model.populate(1)
+    result = run_module('opnsense_haproxy_server_pool', dict(api, pool_name='web', pool_addresses=['192.0.2.1', '192.0.2.2'],
+                                                             pool_port='80', pool_backend='backend0',
+                                                             pool_properties={'ssl_ca': ['Missing CA']}))
+    assert result['failed'] and len(result['problems']) == 2
+    assert writes(mock) == []
+
+
+def test_pool_linked_to_backend(mock, api, run_module):
+    mock.model.populate(1)
+    args = dict(api, pool_name='web', pool_addresses=['192.0.2.1', '192.0.2.2'], pool_port='80', pool_backend='backend0')
+    result = run_module('opnsense_haproxy_server_pool', args)
+    assert result['changed'] and result['summary']['create'] == 2
+    backend = mock.model.objects['backend'][mock.model.names['backend']['backend0']]
+    assert backend['linkedServers'].split(',') == [mock.model.names['server'][name] for name in ('server0', 'web-1', 'web-2')]
+    assert not run_module('opnsense_haproxy_server_pool', args)['changed']
+
+
+def test_address_pattern_only_matches_addresses():
+    from ansible.module_utils.opnsense_utils import HaproxyPool
+    regex = HaproxyPool.patternRegex('web-{address}')
+    assert HaproxyPool.matchesPattern(regex, 'web-10-0-1-5')
+    assert HaproxyPool.matchesPattern(regex, 'web-2001-db8--1')
+    for name in ('web-cafe', 'web-1', 'web-db', 'web-db-1-2', 'web-999-1-1-1'):
+        assert not HaproxyPool.matchesPattern(regex, name), name
+
+
+def test_unrelated_servers_survive(mock, api, run_module):
+    mock.model.populate(1)
+    # Fit the default pattern web-{index}, but are neither linked to the backend nor described as pool members
+    mock.model.add('server', {'name': 'web-3', 'address': '198.51.100.3', 'port': '80'})
+    mock.model.add('server', {'name': 'web-cafe', 'address': '198.51.100.4', 'port': '80'})
+    args = dict(api, pool_name='web', pool_addresses=['192.0.2.1', '192.0.2.2', '192.0.2.3'], pool_port='80', pool_backend='backend0')
+    result = run_module('opnsense_haproxy_server_pool', dict(args, pool_name_pattern='web-{address}'))
+    assert result['summary'] == {'create': 3, 'update': 0, 'delete': 0, 'none': 0, 'failed': 0}
+    # Shrinking the pool deletes the member which left it
+    result = run_module('opnsense_haproxy_server_pool', dict(args, pool_addresses=['192.0.2.1', '192.0.2.2'], pool_name_pattern='web-{address}'))
+    assert list(name for name in result['results'] if result['results'][name]['action'] == 'delete') == ['web-192-0-2-3']
+    # Removing the pool leaves the unrelated servers alone
+    result = run_module('opnsense_haproxy_server_pool', dict(args, pool_state='absent', pool_name_pattern='web-{address}'))
+    assert result['summary']['delete'] == 2
+    assert sorted(mock.model.names['server']) == ['server0', 'web-3', 'web-cafe']
+
+
+def test_members_without_backend_are_found_by_description(mock, api, run_module):
+    mock.model.add('server', {'name': 'web-9', 'address': '198.51.100.9', 'port': '80'})
+    args = dict(api, pool_name='web', pool_addresses=['192.0.2.1', '192.0.2.2'], pool_port='80')
+    assert run_module('opnsense_haproxy_server_pool', args)['summary']['create'] == 2
+    result = run_module('opnsense_haproxy_server_pool', dict(args, pool_state='absent'))
+    assert result['summary']['delete'] == 2
+    assert sorted(mock.model.names['server']) == ['web-9']
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2019, Markus Joosten https://github.com/mj84
+from __future__ import absolute_import, division, print_function
+
+import mock_haproxy_socket
+
+
+def test_disable_server_at_runtime(mock, api, run_module):
+    server = dict(api, server_name='web1', server_address='192.0.2.1', server_port='80')
+    assert run_module('opnsense_haproxy_server', server)['changed']
+    model = mock.model
+    assert model.objects['server'][model.names['server']['web1']]['enabled'] == '1'
+    model.add('backend', {'name': 'web', 'enabled': '1', 'linkedServers': model.names['server']['web1']})
+    model.reloads += 1
+    socket = mock_haproxy_socket.MockRuntimeSocket(model=model).start()
+    socket.reload()
+    try:
+        result = run_module('opnsense_haproxy_server', dict(server, server_enabled=False, runtime_socket=socket.address))
+        assert result['changed'] and not result['reload']['required']
+        assert [change['state']['after'] for change in result['runtime_changes']] == ['maint']
+        assert socket.backends['web']['web1']['admin'] == mock_haproxy_socket.STATES['maint']
+        assert model.objects['server'][model.names['server']['web1']]['enabled'] == '0'
+        assert model.reloads == 1
+        assert not run_module('opnsense_haproxy_server', dict(server, server_enabled=False, runtime_socket=socket.address))['changed']
+    finally:
+        socket.shutdown()
+        socket.server_close()
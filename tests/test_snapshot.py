@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2019, Markus Joosten https://github.com/mj84
+from __future__ import absolute_import, division, print_function
+
+import pytest
+
+from ansible.module_utils.opnsense_utils import OpnsenseApi
+
+
+def requests(mock):
+    # API requests of the mock since the last call
+    sent = list(mock.requests)
+    del mock.requests[:]
+    return sent
+
+
+@pytest.fixture
+def apiconnection(mock):
+    mock.model.populate(3)
+    apiconnection = OpnsenseApi.Haproxy(mock.url, ('key', 'secret'), False)
+    apiconnection.loadSnapshot()
+    requests(mock)
+    return apiconnection
+
+
+def test_single_request(mock):
+    mock.model.populate(3)
+    apiconnection = OpnsenseApi.Haproxy(mock.url, ('key', 'secret'), False)
+    snapshot = apiconnection.loadSnapshot()
+    assert requests(mock) == [('GET', '/api/haproxy/settings/get')]
+    assert sorted(obj['name'] for obj in snapshot['server'].values()) == ['server0', 'server1', 'server2']
+    assert snapshot['cpu'] == {}
+
+
+def test_reads_from_snapshot(mock, apiconnection):
+    assert sorted(row['name'] for row in apiconnection.listObjects('server')) == ['server0', 'server1', 'server2']
+    uuid = apiconnection.getUuidByName('backend', 'backend1')
+    assert uuid == mock.model.names['backend']['backend1']
+    assert apiconnection.getObjectByName('server', 'server1')['address'] == '10.0.0.2'
+    objects, errors = apiconnection.getObjectsByUuids('server', [row['uuid'] for row in apiconnection.listObjects('server')])
+    assert errors == {} and len(objects) == 3
+    with pytest.raises(KeyError):
+        apiconnection.getUuidByName('server', 'missing')
+    assert requests(mock) == []
+
+
+def test_update_is_read_again(mock, apiconnection):
+    apiconnection.updateObject('server', 'server1', {'port': '8080'})
+    assert apiconnection.getObjectByName('server', 'server1')['port'] == '8080'
+    uuid = mock.model.names['server']['server1']
+    assert requests(mock) == [('POST', '/api/haproxy/settings/setserver/' + uuid), ('GET', '/api/haproxy/settings/getserver/' + uuid)]
+    # Read once, then answered from the snapshot again
+    apiconnection.getObjectByName('server', 'server1')
+    assert requests(mock) == []
+
+
+def test_rename_is_indexed(mock, apiconnection):
+    apiconnection.updateObject('server', 'server1', {'name': 'web1'})
+    requests(mock)
+    assert sorted(row['name'] for row in apiconnection.listObjects('server')) == ['server0', 'server2', 'web1']
+    assert apiconnection.getObjectByName('server', 'web1')['name'] == 'web1'
+    with pytest.raises(KeyError):
+        apiconnection.getUuidByName('server', 'server1')
+
+
+def test_create_and_delete(mock, apiconnection):
+    apiconnection.createObject('server', 'web', {'address': '192.0.2.1', 'port': '80'})
+    apiconnection.deleteObject('server', 'server0')
+    requests(mock)
+    assert sorted(row['name'] for row in apiconnection.listObjects('server')) == ['server1', 'server2', 'web']
+    assert requests(mock) == []
+    # The new object is fetched once, the deleted one is gone
+    assert apiconnection.getObjectByName('server', 'web')['address'] == '192.0.2.1'
+    assert [method for method, path in requests(mock)] == ['GET']
+    with pytest.raises(KeyError):
+        apiconnection.getObjectByName('server', 'server0')
+    assert requests(mock) == []
+
+
+def test_changes_outside_are_not_seen(mock, apiconnection):
+    # The snapshot is a point in time copy, loading it again picks up changes made by others
+    mock.model.add('server', {'name': 'other', 'address': '192.0.2.9'})
+    with pytest.raises(KeyError):
+        apiconnection.getUuidByName('server', 'other')
+    apiconnection.loadSnapshot()
+    assert apiconnection.getUuidByName('server', 'other') == mock.model.names['server']['other']
+
+
+def cachedClient(mock, statedir):
+    return OpnsenseApi.Haproxy(mock.url, ('key', 'secret'), False, statedir=str(statedir), snapshot_cache=True)
+
+
+def test_cache_hit_at_same_revision(mock, tmp_path):
+    mock.model.populate(3)
+    first = cachedClient(mock, tmp_path)
+    first.loadSnapshot()
+    assert requests(mock) == [('GET', OpnsenseApi.REVISION_ENDPOINT), ('GET', '/api/haproxy/settings/get')]
+    assert first.getApiStats()['snapshot_cache']['misses'] == 1
+    # Nothing changed on the firewall, a second run only reads the revision
+    second = cachedClient(mock, tmp_path)
+    snapshot = second.loadSnapshot()
+    assert requests(mock) == [('GET', OpnsenseApi.REVISION_ENDPOINT)]
+    assert sorted(obj['name'] for obj in snapshot['server'].values()) == ['server0', 'server1', 'server2']
+    assert second.getUuidByName('backend', 'backend1') == mock.model.names['backend']['backend1']
+    stats = second.getApiStats()['snapshot_cache']
+    assert (stats['hits'], stats['misses']) == (1, 0)
+    assert stats['revision'] == 'config-%.6f.xml' % mock.model.revision
+
+
+def test_cache_miss_after_change(mock, tmp_path):
+    mock.model.populate(3)
+    cachedClient(mock, tmp_path).loadSnapshot()
+    mock.model.add('server', {'name': 'other', 'address': '192.0.2.9'})
+    requests(mock)
+    apiconnection = cachedClient(mock, tmp_path)
+    apiconnection.loadSnapshot()
+    assert requests(mock) == [('GET', OpnsenseApi.REVISION_ENDPOINT), ('GET', '/api/haproxy/settings/get')]
+    assert apiconnection.getUuidByName('server', 'other') == mock.model.names['server']['other']
+    assert apiconnection.getApiStats()['snapshot_cache']['misses'] == 1
+    # The new revision was cached in turn
+    cachedClient(mock, tmp_path).loadSnapshot()
+    assert requests(mock) == [('GET', OpnsenseApi.REVISION_ENDPOINT)]
+
+
+def test_no_cache_without_revision(mock, tmp_path, monkeypatch):
+    # API users without access to the backups can't tell whether a cached snapshot is current
+    monkeypatch.setattr(OpnsenseApi, 'REVISION_ENDPOINT', '/api/core/backup/missing')
+    mock.model.populate(3)
+    for attempt in range(2):
+        apiconnection = cachedClient(mock, tmp_path)
+        snapshot = apiconnection.loadSnapshot()
+        assert requests(mock) == [('GET', '/api/core/backup/missing'), ('GET', '/api/haproxy/settings/get')]
+        assert len(snapshot['server']) == 3
+        assert apiconnection.getApiStats()['snapshot_cache']['revision'] is None
+    assert not [name for name in tmp_path.iterdir() if name.name.startswith('opnsense_haproxy_snapshot_')]
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2019, Markus Joosten https://github.com/mj84
+from __future__ import absolute_import, division, print_function
+
+import json
+
+import pytest
+
+import mock_opnsense
+
+from ansible.module_utils.opnsense_utils import OpnsenseApi
+
+
+def client(mock, **kwargs):
+    return OpnsenseApi.Haproxy(mock.url, ('key', 'secret'), False, **kwargs)
+
+
+def templateRequests(mock, objecttype):
+    return len([path for method, path in mock.requests if path == '/api/haproxy/settings/get%s/' % objecttype])
+
+
+def test_cache_hit_across_clients(mock):
+    mock.model.populate(2)
+    first = client(mock)
+    assert 'server0' in first.getTemplateIndex('backend').options('linkedServers')
+    second = client(mock)
+    assert second.getTemplateIndex('backend').options('linkedServers').keys(['server1']) == [mock.model.names['server']['server1']]
+    assert templateRequests(mock, 'backend') == 1
+    assert (second.templatehits, second.templatemisses) == (1, 0)
+
+
+def test_ttl_expiry(mock):
+    first = client(mock)
+    first.getTemplate('server')
+    cache = first.getTemplateCache('server')
+    with open(cache) as f:
+        cached = json.load(f)
+    cached['fetched'] -= 61
+    with open(cache, 'w') as f:
+        json.dump(cached, f)
+    second = client(mock)
+    second.getTemplate('server')
+    assert templateRequests(mock, 'server') == 2
+    assert (second.templatehits, second.templatemisses) == (0, 1)
+
+
+@pytest.mark.parametrize('write', [
+    lambda apiconnection: apiconnection.createObject('server', 'web', {'address': '192.0.2.1'}),
+    lambda apiconnection: apiconnection.updateObject('server', 'server0', {'name': 'web'}),
+    lambda apiconnection: apiconnection.deleteObject('server', 'server0'),
+])
+def test_invalidation_after_writes(mock, write):
+    mock.model.populate(1)
+    apiconnection = client(mock)
+    apiconnection.getTemplate('backend')
+    write(apiconnection)
+    # Another client doesn't find the stale cache file either
+    other = client(mock)
+    names = set(row['name'] for row in other.listObjects('server'))
+    assert set(other.getTemplateIndex('backend').options('linkedServers').keybyvalue) == names
+    # The writer then uses the template the other client cached after the write
+    assert set(apiconnection.getTemplateIndex('backend').options('linkedServers').keybyvalue) == names
+    assert templateRequests(mock, 'backend') == 2
+
+
+def test_refetch_on_miss(mock, monkeypatch):
+    client(mock).getTemplate('server')
+    # A certificate added in System/Trust after the template got cached
+    monkeypatch.setitem(mock_opnsense.SSL_OBJECTS, '5d6d1e7b4c1a5', 'New CA')
+    mock.model.changed()
+    apiconnection = client(mock)
+    options = apiconnection.getTemplateIndex('server').options('sslCA')
+    assert options.keys(['Internal CA', 'New CA']) == ['5d6d1e7b4c1a2', '5d6d1e7b4c1a5']
+    assert templateRequests(mock, 'server') == 2
+    # Refetched only once, a name missing from a current template is unknown
+    with pytest.raises(KeyError):
+        options.key('Missing CA')
+    with pytest.raises(KeyError):
+        apiconnection.getTemplateIndex('server').options('sslCA').key('Missing CA')
+    assert templateRequests(mock, 'server') == 2
+
+
+def test_module_refetches_on_miss(mock, api, run_module):
+    mock.model.populate(1)
+    run_module('opnsense_haproxy_backend', dict(api, backend_name='web', backend_linked_servers=['server0']))
+    # Created by someone else while the backend template is cached
+    mock.model.add('server', {'name': 'other', 'address': '192.0.2.9'})
+    result = run_module('opnsense_haproxy_backend', dict(api, backend_name='web', backend_linked_servers=['server0', 'other']))
+    assert result['changed'] and not result.get('failed')
+
+
+def test_no_write_back_after_invalidation(mock):
+    mock.model.populate(1)
+    apiconnection = client(mock)
+
+    def invalidate(call):
+        # Another thread creates a server while the backend template is fetched
+        if call['endpoint'] == '/api/haproxy/settings/getbackend/':
+            apiconnection.invalidateTemplates('server')
+    apiconnection.addRequestHook(invalidate)
+    apiconnection.getTemplate('backend')
+    assert 'backend' not in apiconnection.templates
+    with pytest.raises(IOError):
+        open(apiconnection.getTemplateCache('backend'))
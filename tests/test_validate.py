@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2019, Markus Joosten https://github.com/mj84
+from __future__ import absolute_import, division, print_function
+
+import pytest
+
+from ansible.module_utils.opnsense_utils import HaproxyValidate
+from ansible.module_utils.opnsense_utils import OpnsenseApi
+
+
+@pytest.fixture
+def apiconnection(mock):
+    mock.model.populate(2)
+    return OpnsenseApi.Haproxy(mock.url, ('key', 'secret'), False)
+
+
+def messages(problems):
+    return [problem['msg'] for problem in problems]
+
+
+def test_existing_and_desired_references(apiconnection):
+    objects = {
+        'server': {'web1': {'address': '192.0.2.1', 'port': '80'}},
+        'backend': {'web': {'linked_servers': ['server0', 'web1']}},
+    }
+    assert HaproxyValidate.validate(apiconnection, objects) == []
+
+
+def test_dangling_references(apiconnection):
+    objects = {
+        'backend': {'web': {'linked_servers': ['server0', 'missing'], 'health_check': 'nocheck'}},
+        'frontend': {'public': {'bind': ['0.0.0.0:80'], 'default_backend': 'nobackend'}},
+    }
+    assert sorted(messages(HaproxyValidate.validate(apiconnection, objects))) == [
+        'backend web: health_check references unknown healthcheck nocheck',
+        'backend web: linked_servers references unknown server missing',
+        'frontend public: default_backend references unknown backend nobackend',
+    ]
+
+
+def test_references_to_deleted_objects(apiconnection):
+    objects = {
+        'server': {'server1': {'state': 'absent'}},
+        'backend': {'web': {'linked_servers': ['server1']}},
+    }
+    assert messages(HaproxyValidate.validate(apiconnection, objects)) == [
+        'backend web: linked_servers references server server1, which is to be deleted']
+
+
+def test_references_to_purged_objects(apiconnection):
+    objects = {
+        'user': {'user0': {'password': 'secret'}},
+        'group': {'admins': {'members': ['user0', 'user1']}},
+    }
+    assert HaproxyValidate.validate(apiconnection, objects) == []
+    assert messages(HaproxyValidate.validate(apiconnection, objects, purge=True)) == [
+        'group admins: members references user user1, which is to be deleted']
+
+
+def test_missing_required_property(apiconnection):
+    problems = HaproxyValidate.validate(apiconnection, {'server': {'web1': {'address': '192.0.2.1'}}})
+    assert [(problem['name'], problem['property']) for problem in problems] == [('web1', 'port')]